@@ -0,0 +1,69 @@
+"""
+Latency benchmark for the station gazetteer.
+
+Builds a gazetteer over a synthetic network of `--stations` stations and
+times autocomplete for every prefix of random station and city names (as
+if typed one keystroke at a time), plus resolving misspelled city names.
+
+    python benchmarks/bench_gazetteer.py [--stations 1000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import Gazetteer, place_view  # noqa: E402
+from timetable import Station  # noqa: E402
+from benchmarks.synthetic import city_name  # noqa: E402
+
+STATIONS_PER_CITY = 3
+
+
+def misspell(rng, name):
+    i = rng.randrange(len(name))
+    return name[:i] + name[i + 1:] if rng.random() < 0.5 else name[:i] + "x" + name[i + 1:]
+
+
+def report(label, latencies):
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{label:<13} {len(latencies):>6} queries  p50 {cuts[49] * 1000:7.1f} µs  p99 {cuts[98] * 1000:7.1f} µs")
+
+
+def run(stations, queries):
+    cities = stations // STATIONS_PER_CITY
+    network = [
+        Station(f"S{c:04d}{s}", f"{city_name(c)} Station {s}", city_name(c), city_name(c).lower())
+        for c in range(cities)
+        for s in range(STATIONS_PER_CITY)
+    ]
+    started = time.perf_counter()
+    gazetteer = Gazetteer(network)
+    print(f"built over {len(network)} stations in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    rng = random.Random(7)
+    keystrokes, typos = [], []
+    for _ in range(queries):
+        station = rng.choice(network)
+        name = rng.choice((station.name, station.city, station.code))
+        for end in range(1, len(name) + 1):
+            started = time.perf_counter()
+            [place_view(place) for place in gazetteer.complete(name[:end], 8)]
+            keystrokes.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        gazetteer.resolve(misspell(rng, station.city))
+        typos.append((time.perf_counter() - started) * 1000)
+
+    report("autocomplete", keystrokes)
+    report("typo resolve", typos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.stations, args.queries)
@@ -0,0 +1,77 @@
+"""
+Timetable feed import benchmark.
+
+Writes a synthetic GTFS feed of `--services` trips (150k trips of 8 stops
+make about 50 MB of text, 11 MB zipped), then measures, each in a fresh
+process so peak memory is its own:
+- import: parsing the feed into timetable columns and building the
+  journey planner index, as a worker does when the feed changes;
+- snapshot write: writing both to a snapshot file;
+- snapshot load: mapping the snapshot back in, as every other worker does.
+
+    python benchmarks/bench_gtfs.py [--services 150000] [--feed /tmp/feed.zip]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.synthetic import write_gtfs  # noqa: E402
+
+IMPORT = """
+import resource, sys, time
+started = time.perf_counter()
+from gtfs import import_gtfs
+from planner import ConnectionIndex
+from snapshot import write_snapshot
+from timetable import Timetable
+timetable = Timetable.from_columns(import_gtfs(sys.argv[1]))
+connections = ConnectionIndex(timetable)
+imported = time.perf_counter()
+write_snapshot(sys.argv[2], timetable, connections, {})
+written = time.perf_counter()
+print(imported - started, written - imported, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(timetable.trips))
+"""
+
+LOAD = """
+import resource, sys, time
+from snapshot import read_snapshot
+started = time.perf_counter()
+snapshot = read_snapshot(sys.argv[1])
+print(time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(code, *args):
+    output = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=BACKEND, capture_output=True, text=True, check=True,
+    ).stdout
+    return [float(value) for value in output.split()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=150_000)
+    parser.add_argument("--feed", help="GTFS zip to import instead of a synthetic one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        feed = args.feed
+        if feed is None:
+            feed = os.path.join(directory, "feed.zip")
+            started = time.perf_counter()
+            write_gtfs(feed, args.services)
+            print(f"wrote a feed of {args.services} trips in {time.perf_counter() - started:.1f}s")
+        snapshot = os.path.join(directory, "timetable.snapshot")
+
+        import_seconds, write_seconds, import_kb, trips = run(IMPORT, feed, snapshot)
+        load_seconds, load_kb = run(LOAD, snapshot)
+        print(f"feed              {os.path.getsize(feed) / 2**20:8.1f} MB zipped, {int(trips)} trips imported")
+        print(f"import            {import_seconds:8.2f}s  peak RSS {import_kb / 1024:6.0f} MB")
+        print(f"snapshot write    {write_seconds:8.2f}s  size {os.path.getsize(snapshot) / 2**20:6.1f} MB")
+        print(f"snapshot load     {load_seconds * 1000:8.1f}ms peak RSS {load_kb / 1024:6.0f} MB")
@@ -0,0 +1,135 @@
+"""
+Contention benchmark and correctness check for the seat inventory.
+
+Hot train: `--threads` threads keep trying to hold and confirm 1-4 seats on
+one train until it is sold out, with some holds released instead of
+confirmed and some left to expire. Afterwards no seat may be sold twice and,
+once the abandoned holds have expired, the taken seats must be exactly the
+confirmed ones.
+
+Multi-leg: threads book random three-leg journeys over a few trains that
+share legs. Every journey must get seats on all of its legs or on none, so
+the seats sold per train must equal the seats of the successful journeys
+using it.
+
+    python benchmarks/bench_inventory.py [--threads 64] [--capacity 5000] [--attempts 20000] [--state memory]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory import SeatInventory, SeatRequest, SeatsUnavailable, coach_layout
+from state import create_state_backend
+
+DATE = "2024-08-15"
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def hot_train(state, threads, capacity):
+    inventory = SeatInventory(lambda train_id: coach_layout("Economy", capacity), state, hold_ttl_seconds=0.05)
+    sold = []
+    attempts = Counter()
+    lock = threading.Lock()
+
+    def count(outcome):
+        with lock:
+            attempts[outcome] += 1
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while inventory.available("HOT", DATE) > 0:
+            try:
+                hold = inventory.hold([SeatRequest("HOT", DATE, count=rng.randint(1, 4))])
+            except SeatsUnavailable:
+                count("rejected")
+                continue
+            outcome = rng.random()
+            if outcome < 0.1:
+                inventory.release(hold.hold_id)
+                count("released")
+                continue
+            if outcome < 0.15:
+                # Abandoned: the hold expires and its seats go back on sale
+                count("abandoned")
+                continue
+            try:
+                inventory.confirm(hold.hold_id)
+            except SeatsUnavailable:
+                count("expired")
+                continue
+            with lock:
+                sold.extend(hold.seats[("HOT", DATE)])
+            count("confirmed")
+
+    elapsed = run_threads(threads, worker)
+    # Let abandoned holds expire, then make sure they all came back
+    time.sleep(0.1)
+    duplicates = len(sold) - len(set(sold))
+    total = sum(attempts.values())
+    print(
+        f"hot train: {total:,} hold attempts from {threads} threads in {elapsed:.2f}s ({total / elapsed:,.0f}/s), "
+        f"{dict(attempts)}"
+    )
+    taken = inventory.taken_seats("HOT", DATE)
+    print(f"  sold {len(sold)} of {capacity} seats, {duplicates} sold twice, {capacity - len(taken)} left after expiry")
+    return duplicates == 0 and len(sold) <= capacity and sorted(taken) == sorted(sold)
+
+
+def multi_leg(state, threads, capacity, attempts):
+    trains = [f"T{i}" for i in range(6)]
+    inventory = SeatInventory(lambda train_id: coach_layout("Executive", capacity), state)
+    booked = Counter()
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(attempts // threads):
+            count = rng.randint(1, 3)
+            legs = rng.sample(trains, 3)
+            try:
+                inventory.reserve([SeatRequest(train, DATE, count=count) for train in legs])
+            except SeatsUnavailable:
+                continue
+            with lock:
+                for train in legs:
+                    booked[train] += count
+
+    elapsed = run_threads(threads, worker)
+    sold = {train: capacity - inventory.available(train, DATE) for train in trains}
+    consistent = all(sold[train] == booked[train] for train in trains)
+    print(f"multi-leg: {attempts:,} three-leg bookings from {threads} threads in {elapsed:.2f}s ({attempts / elapsed:,.0f}/s)")
+    print(f"  seats sold per train {sold}, {'matching' if consistent else 'NOT matching'} the successful journeys")
+    return consistent and all(seats <= capacity for seats in sold.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--capacity", type=int, default=5000)
+    parser.add_argument("--attempts", type=int, default=20_000, help="multi-leg bookings")
+    parser.add_argument("--state", choices=("memory", "sqlite", "redis"), default="memory")
+    parser.add_argument("--state-db", default=os.path.join(tempfile.mkdtemp(), "state.db"))
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    state = create_state_backend(args.state, args.state_db, args.redis_url)
+    ok = hot_train(state, args.threads, args.capacity)
+    ok = multi_leg(state, args.threads, args.capacity, args.attempts) and ok
+    if not ok:
+        sys.exit(1)
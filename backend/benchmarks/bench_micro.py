@@ -0,0 +1,99 @@
+"""
+Micro-benchmarks of the search and booking functions, for pytest-benchmark.
+
+Runs against a synthetic timetable of BENCH_SERVICES services (default
+100k) with in-memory order and state stores. Save a run and compare a later
+one against it with pytest-benchmark's own options:
+
+    python -m pytest benchmarks/bench_micro.py --benchmark-autosave
+    python -m pytest benchmarks/bench_micro.py --benchmark-compare --benchmark-compare-fail=median:10%
+"""
+import datetime
+import functools
+import itertools
+import os
+import random
+import sys
+
+import pytest
+
+os.environ.setdefault("ORDER_STORE", "memory")
+os.environ.setdefault("STATE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.synthetic import city_name, generate_timetable, install_timetable  # noqa: E402
+
+SERVICES = int(os.getenv("BENCH_SERVICES", "100000"))
+CITIES = 200
+DATE = "2024-08-15"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def synthetic_timetable():
+    original = install_timetable(main, generate_timetable(SERVICES, cities=CITIES))
+    yield main.transit_indexes.timetable
+    main.transit_indexes = original
+    main.search_cache.clear()
+    main.tool_cache.clear()
+
+
+@pytest.fixture
+def city_pairs():
+    rng = random.Random(7)
+    return itertools.cycle([tuple(city_name(c) for c in rng.sample(range(CITIES), 2)) for _ in range(500)])
+
+
+@pytest.fixture
+def booking_dates():
+    # Every booking goes to a new date so trains never sell out mid-run
+    start = datetime.date(2030, 1, 1)
+    return (str(start + datetime.timedelta(days=i)) for i in itertools.count())
+
+
+def test_search_trains(benchmark, city_pairs):
+    benchmark(lambda: main.search_trains(*next(city_pairs), DATE))
+
+
+def test_find_alternative_routes(benchmark, city_pairs):
+    benchmark(lambda: main.find_alternative_routes(*next(city_pairs), DATE))
+
+
+def test_search_routes_cached(benchmark):
+    key = (city_name(1), city_name(2), DATE)
+    benchmark(lambda: main.search_cache.get_or_compute(key, lambda: main.search_routes(*key), functools.partial(main.search_result_tags, DATE)))
+
+
+def test_normalize_city_typo(benchmark):
+    benchmark(main.normalize_city, city_name(123).replace("y", "i"))
+
+
+def test_book_ticket_from_chat(benchmark, synthetic_timetable, booking_dates):
+    train_id = next(iter(synthetic_timetable.trips_by_id))
+    passengers = [{"name": "Bench", "idNumber": "1"}]
+
+    def book():
+        result = main.book_ticket_from_chat(train_id, next(booking_dates), 1, passengers)
+        assert result["status"] == "success", result
+
+    benchmark(book)
+
+
+def test_create_alternative_order(benchmark, synthetic_timetable, booking_dates):
+    trips = list(itertools.islice(synthetic_timetable.trips_by_id, 2))
+
+    def book():
+        date = next(booking_dates)
+        legs = [
+            {"trainId": trip, "trainName": trip, "from": "A", "to": "B", "date": date,
+             "departureTime": "08:00", "arrivalTime": "10:00"}
+            for trip in trips
+        ]
+        request = main.AlternativeBookingRequest(
+            route={"origin": "A", "destination": "B", "legs": legs}, passengers=2,
+            passengersInfo=[{"name": "Bench", "idNumber": "1"}, {"name": "Bench", "idNumber": "2"}],
+            selectedSeats={}, totalPrice=100000,
+        )
+        main.create_alternative_order(request)
+
+    benchmark(book)
@@ -0,0 +1,51 @@
+"""
+Latency benchmark for the journey planner.
+
+Builds the connection index over a synthetic timetable and reports p50/p99
+query time for random city pairs with up to two transfers.
+
+    python benchmarks/bench_planner.py [--sizes 100000 1000000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import city_name, generate_timetable  # noqa: E402
+from planner import JourneyPlanner  # noqa: E402
+
+
+def run(sizes, queries, cities):
+    rng = random.Random(11)
+    for size in sizes:
+        timetable = generate_timetable(size, cities=cities)
+        started = time.perf_counter()
+        planner = JourneyPlanner(timetable)
+        build_seconds = time.perf_counter() - started
+
+        latencies, found = [], 0
+        for _ in range(queries):
+            origin, destination = rng.sample(range(cities), 2)
+            started = time.perf_counter()
+            journeys = planner.search(city_name(origin).lower(), city_name(destination).lower(), min_transfers=1)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found += len(journeys)
+
+        cuts = statistics.quantiles(latencies, n=100)
+        print(
+            f"{len(planner.connections):>9} connections  index {build_seconds:6.2f}s  "
+            f"p50 {cuts[49]:7.2f} ms  p99 {cuts[98]:7.2f} ms  {found / queries:.1f} journeys/query"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--cities", type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.cities)
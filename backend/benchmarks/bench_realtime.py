@@ -0,0 +1,117 @@
+"""
+Real-time trip update benchmark.
+
+Feeds random delays, cancellations and recoveries for today's trips of a
+synthetic timetable through the same path as the REALTIME_FEED follower
+(parsing JSON lines, applying them to the indexes, dropping stale cached
+searches) at each of `--rates` events per second. Events arrive evenly
+spread in time and are applied in whatever batches have built up, so
+event latency (arrival to applied) includes the wait for the batch before
+it. Then compares the latency of find_alternative_routes with and without
+the resulting delays.
+
+    python benchmarks/bench_realtime.py [--services 100000] [--rates 1000 5000 20000] [--seconds 5]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("ORDER_STORE", "memory")
+os.environ.setdefault("STATE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.synthetic import city_name, generate_timetable, install_timetable  # noqa: E402
+
+
+def random_events(trip_ids, date, rng):
+    timestamp = 0
+    while True:
+        timestamp += 1
+        trip = {"trip_id": rng.choice(trip_ids), "start_date": date}
+        roll = rng.random()
+        if roll < 0.05:
+            trip["schedule_relationship"] = "CANCELED"
+            event = {"trip": trip}
+        elif roll < 0.15:
+            event = {"trip": trip}  # back on schedule
+        else:
+            event = {"trip": trip, "delay": rng.randrange(1, 120) * 60, "reason": "Signal fault"}
+        event["timestamp"] = timestamp
+        yield json.dumps(event)
+
+
+def quantiles(values):
+    cuts = statistics.quantiles(values, n=100)
+    return cuts[49], cuts[98]
+
+
+def run_rate(rate, seconds, events):
+    """Applies `rate` events per second for `seconds`; returns (events, batches, event latencies, apply times)."""
+    interval = 1 / rate
+    latencies, apply_times = [], []
+    started = time.perf_counter()
+    total = int(rate * seconds)
+    applied = 0
+    while applied < total:
+        now = time.perf_counter()
+        due = min(int((now - started) / interval) + 1, total)
+        if due <= applied:
+            time.sleep(interval)
+            continue
+        lines = [next(events) for _ in range(due - applied)]
+        main.apply_trip_updates(main.read_trip_updates(lines, "the benchmark"))
+        finished = time.perf_counter()
+        apply_times.append(finished - now)
+        latencies.extend(finished - (started + i * interval) for i in range(applied, due))
+        applied = due
+    return total, len(apply_times), latencies, apply_times, time.perf_counter() - started
+
+
+def search_latencies(queries, cities, date, rng):
+    latencies = []
+    for _ in range(queries):
+        origin, destination = rng.sample(range(cities), 2)
+        started = time.perf_counter()
+        main.find_alternative_routes(city_name(origin), city_name(destination), date)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=100_000)
+    parser.add_argument("--cities", type=int, default=200)
+    parser.add_argument("--rates", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    install_timetable(main, generate_timetable(args.services, cities=args.cities))
+    date = main.service_date()
+    rng = random.Random(7)
+    events = random_events(list(main.transit_indexes.timetable.trips_by_id), date, rng)
+
+    for rate in args.rates:
+        total, batches, latencies, apply_times, elapsed = run_rate(rate, args.seconds, events)
+        event_p50, event_p99 = quantiles(latencies)
+        batch_p50, batch_p99 = quantiles(apply_times) if batches > 1 else (apply_times[0],) * 2
+        print(
+            f"{rate:>6} events/s  {total / elapsed:8.0f} applied/s  {batches:5} batches  "
+            f"batch p50 {batch_p50 * 1000:6.2f} ms p99 {batch_p99 * 1000:6.2f} ms  "
+            f"event latency p50 {event_p50 * 1000:6.2f} ms p99 {event_p99 * 1000:6.2f} ms  "
+            f"{sum(apply_times) / total * 1e6:5.1f} us/event"
+        )
+
+    day = main.transit_indexes.realtime.day(date)
+    off_schedule = len(day.trips) if day else 0
+    delayed = search_latencies(args.queries, args.cities, date, random.Random(3))
+    undelayed = search_latencies(args.queries, args.cities, "2000-01-01", random.Random(3))
+    print(f"find_alternative_routes with {off_schedule} trips off schedule: "
+          f"p50 {quantiles(delayed)[0]:6.2f} ms p99 {quantiles(delayed)[1]:6.2f} ms")
+    print(f"find_alternative_routes on schedule:                   "
+          f"p50 {quantiles(undelayed)[0]:6.2f} ms p99 {quantiles(undelayed)[1]:6.2f} ms")
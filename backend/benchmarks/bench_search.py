@@ -0,0 +1,63 @@
+"""
+Latency benchmark for /api/search-routes.
+
+Swaps a synthetic timetable of 10k, 100k and 1M services into the app and
+reports p50/p99 latency of the endpoint over random city pairs, first with
+an empty search cache and then replaying the same searches from the cache.
+
+    python benchmarks/bench_search.py [--sizes 10000 100000 1000000] [--requests 500]
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.synthetic import city_name, generate_timetable, install_timetable  # noqa: E402
+
+# The app logs at INFO; the client's per-request lines would drown the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def run(sizes, requests, cities):
+    client = TestClient(main.app)
+    rng = random.Random(7)
+    for size in sizes:
+        started = time.perf_counter()
+        install_timetable(main, generate_timetable(size, cities=cities))
+        build_seconds = time.perf_counter() - started
+
+        bodies = []
+        for _ in range(requests):
+            origin, destination = rng.sample(range(cities), 2)
+            bodies.append({"origin": city_name(origin), "destination": city_name(destination), "date": "2024-08-15"})
+
+        for label in ("cold", "cached"):
+            latencies = []
+            for body in bodies:
+                started = time.perf_counter()
+                response = client.post("/api/search-routes", json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+
+            cuts = statistics.quantiles(latencies, n=100)
+            print(
+                f"{size:>9} services  build {build_seconds:6.2f}s  {label:>6}  "
+                f"p50 {cuts[49]:7.2f} ms  p99 {cuts[98]:7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--cities", type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.requests, args.cities)
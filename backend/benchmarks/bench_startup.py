@@ -0,0 +1,88 @@
+"""
+Cold start budget check.
+
+Measures, over `--runs` fresh processes each:
+- import time: how long `import main` takes;
+- time to first request: from launching `uvicorn main:app` until
+  /api/ready answers 200 and a first /api/search-routes has been served.
+
+The medians are compared against `--import-budget` and
+`--first-request-budget` (seconds); the exit status is 1 if either is over.
+The chat model is built in the background after startup and is not waited
+for, as in production.
+
+    python benchmarks/bench_startup.py [--runs 5] [--import-budget 0.8] [--first-request-budget 2.5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = dict(os.environ, ORDER_STORE="memory", STATE_BACKEND="memory")
+SEARCH = {"origin": "Jakarta", "destination": "Surabaya", "date": "2024-08-15"}
+
+
+def import_seconds():
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code], cwd=BACKEND, env=ENV,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def first_request_seconds(port, timeout=60):
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                try:
+                    if client.get("/api/ready").status_code == 200:
+                        ready = time.perf_counter() - started
+                        client.post("/api/search-routes", json=SEARCH).raise_for_status()
+                        return ready, time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError("uvicorn did not become ready")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def check(label, seconds, budget):
+    median = statistics.median(seconds)
+    within = median <= budget
+    print(
+        f"{label:<22} median {median:6.3f}s  min {min(seconds):6.3f}s  max {max(seconds):6.3f}s  "
+        f"budget {budget:.2f}s  {'ok' if within else 'OVER BUDGET'}"
+    )
+    return within
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=0.8)
+    parser.add_argument("--first-request-budget", type=float, default=2.5)
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    starts = [first_request_seconds(args.port) for _ in range(args.runs)]
+    ok = check("import main", imports, args.import_budget)
+    check("ready", [ready for ready, _ in starts], args.first_request_budget)
+    ok = check("first request served", [served for _, served in starts], args.first_request_budget) and ok
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,131 @@
+"""
+Multi-worker throughput and consistency check.
+
+For each worker count, serves the app with `uvicorn --workers N` on the
+shared SQLite state and order stores (fresh files per run) and has
+`--clients` concurrent clients loop over a mixed load for `--seconds`:
+search routes, hold a seat on one hot train, book the held seat, list
+orders. Holds and bookings land on different workers, so they only succeed
+if the workers share their state.
+
+Afterwards the seats booked across all workers must be distinct and must be
+exactly the seats the inventory shows as taken.
+
+    python benchmarks/bench_workers.py [--workers 1 4 16] [--clients 64] [--seconds 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAIN = "KAI001"
+DATE = "2024-08-15"
+LEG = {
+    "trainId": TRAIN, "trainName": TRAIN, "from": "Jakarta", "to": "Surabaya",
+    "date": DATE, "departureTime": "08:00", "arrivalTime": "16:00",
+}
+
+
+def start_server(workers, port, directory):
+    env = dict(
+        os.environ,
+        STATE_BACKEND="sqlite", STATE_DB_PATH=os.path.join(directory, "state.db"),
+        ORDER_STORE="sqlite", ORDERS_DB_PATH=os.path.join(directory, "orders.db"),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_up(client, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if (await client.get("/api/places/autocomplete", params={"q": "ja"})).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn did not come up")
+
+
+async def client_loop(client, seed, deadline, outcomes, booked):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        origin, destination = rng.sample(["Jakarta", "Bandung", "Yogyakarta", "Surabaya", "Semarang"], 2)
+        response = await client.post("/api/search-routes", json={"origin": origin, "destination": destination, "date": DATE})
+        outcomes[f"search {response.status_code}"] += 1
+
+        response = await client.post("/api/seat-holds", json={"legs": [{"trainId": TRAIN, "date": DATE}]})
+        outcomes[f"hold {response.status_code}"] += 1
+        if response.status_code == 200:
+            hold = response.json()
+            if rng.random() < 0.1:
+                response = await client.delete(f"/api/seat-holds/{hold['holdId']}")
+                outcomes[f"release {response.status_code}"] += 1
+            else:
+                body = {
+                    "route": {"origin": "Jakarta", "destination": "Surabaya", "legs": [LEG]},
+                    "passengers": 1, "passengersInfo": [{"name": "Load", "idNumber": str(seed)}],
+                    "selectedSeats": {}, "totalPrice": 100000, "holdId": hold["holdId"],
+                }
+                response = await client.post("/api/book-alternative-route", json=body)
+                outcomes[f"book {response.status_code}"] += 1
+                if response.status_code == 200:
+                    booked.extend(response.json()["orderDetails"]["legs"][0]["seats"])
+
+        response = await client.get("/api/my-orders", params={"limit": 20})
+        outcomes[f"orders {response.status_code}"] += 1
+
+
+async def run(workers, clients, seconds, port):
+    directory = tempfile.mkdtemp()
+    server = start_server(workers, port, directory)
+    limits = httpx.Limits(max_connections=clients + 10)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+            await wait_until_up(client, server)
+            outcomes, booked = Counter(), []
+            started = time.perf_counter()
+            deadline = time.monotonic() + seconds
+            await asyncio.gather(*(client_loop(client, i, deadline, outcomes, booked) for i in range(clients)))
+            elapsed = time.perf_counter() - started
+            taken = (await client.get(f"/api/trains/{TRAIN}/seats", params={"date": DATE})).json()["taken"]
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = sum(outcomes.values())
+    duplicates = len(booked) - len(set(booked))
+    consistent = duplicates == 0 and sorted(booked) == sorted(taken)
+    print(f"{workers:>3} workers: {total:,} requests in {elapsed:.1f}s ({total / elapsed:,.0f}/s), {dict(sorted(outcomes.items()))}")
+    print(f"     {len(booked)} seats booked, {duplicates} booked twice, "
+          f"{'matching' if consistent else 'NOT matching'} the {len(taken)} seats taken")
+    return consistent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    ok = True
+    for workers in args.workers:
+        ok = asyncio.run(run(workers, args.clients, args.seconds, args.port)) and ok
+    if not ok:
+        sys.exit(1)
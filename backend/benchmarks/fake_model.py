@@ -0,0 +1,91 @@
+"""
+Deterministic stand-in for the Gemini model used by the load tests.
+
+It mimics the small part of the `google.generativeai` surface the backend
+uses: `model.start_chat(history=...)` returning a chat object with
+`send_message` / `send_message_async`, whose responses expose
+`candidates[0].content.parts[i].function_call` and `.text`.
+
+The first reply of every chat asks for `tool_calls` (a list of
+`(name, args)` pairs) all at once; every later reply is plain text.
+Every reply takes `latency` seconds. Streamed replies deliver their
+first chunk after `latency` seconds and one more word every
+`token_delay` seconds. With `blocking=True` the async call
+sleeps synchronously, which reproduces the old behaviour of calling the
+synchronous SDK from inside the event loop.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+
+def _response(parts, text=""):
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))], text=text)
+
+
+def _text_response(text: str):
+    return _response([SimpleNamespace(function_call=None, text=text)], text)
+
+
+def _function_call_response(tool_calls):
+    return _response([
+        SimpleNamespace(function_call=SimpleNamespace(name=name, args=args), text="")
+        for name, args in tool_calls
+    ])
+
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def _reply(self, content):
+        first = not self.history
+        self.history.append(content)
+        self.model.calls += 1
+        if first and self.model.tool_calls:
+            return _function_call_response(self.model.tool_calls)
+        if isinstance(content, str):
+            return _text_response(f"echo: {content}")
+        return _text_response(f"received {len(content)} tool results")
+
+    def send_message(self, content):
+        time.sleep(self.model.latency)
+        return self._reply(content)
+
+    async def send_message_async(self, content, stream=False):
+        if stream:
+            return FakeStream(self.model, self._reply(content))
+        if self.model.blocking:
+            time.sleep(self.model.latency)
+        else:
+            await asyncio.sleep(self.model.latency)
+        return self._reply(content)
+
+
+class FakeStream:
+    def __init__(self, model, response):
+        self.model = model
+        self.response = response
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.model.latency)
+        if not self.response.text:
+            yield self.response
+            return
+        for i, word in enumerate(self.response.text.split(" ")):
+            if i:
+                await asyncio.sleep(self.model.token_delay)
+            yield _text_response(word if i == 0 else " " + word)
+
+
+class FakeModel:
+    def __init__(self, latency: float = 0.5, blocking: bool = False, tool_calls=None, token_delay: float = 0.05):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.blocking = blocking
+        self.tool_calls = list(tool_calls or [])
+        self.calls = 0
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
@@ -0,0 +1,93 @@
+"""
+Load test: /api/search-routes latency while many chats are in flight.
+
+Replaces the Gemini model with the local fake model, serves the app with
+uvicorn on a local port, starts `--chats` concurrent /api/chat requests
+and, while they are pending, measures /api/search-routes latency. A
+baseline without chats is measured first.
+
+    python benchmarks/load_chat.py [--chats 200] [--latency 2.0] [--blocking]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.fake_model import FakeModel  # noqa: E402
+
+# The app logs at INFO; the client's per-request lines would drown the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SEARCH = {"origin": "Jakarta", "destination": "Yogyakarta", "date": "2024-08-15"}
+
+
+async def measure_search(client, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = await client.post("/api/search-routes", json=SEARCH)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+def summary(label, latencies):
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(f"{label:<22} p50 {cuts[49]:8.2f} ms  p99 {cuts[98]:8.2f} ms  max {max(latencies):8.2f} ms")
+
+
+def serve(port):
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(chats, latency, blocking, searches, port):
+    main.model = FakeModel(latency=latency, blocking=blocking)
+    server = serve(port)
+    limits = httpx.Limits(max_connections=chats + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+        summary("search, idle", await measure_search(client, searches))
+
+        chat_tasks = []
+
+        async def start_chats():
+            # Staggered so chats keep arriving while the searches run
+            for i in range(chats):
+                body = {"message": f"hi {i}", "session_id": f"load-{i}"}
+                chat_tasks.append(asyncio.create_task(client.post("/api/chat", json=body)))
+                await asyncio.sleep(0.001)
+
+        spawner = asyncio.create_task(start_chats())
+        summary(f"search, {chats} chats", await measure_search(client, searches))
+
+        started = time.perf_counter()
+        await spawner
+        responses = await asyncio.gather(*chat_tasks)
+        failures = sum(1 for r in responses if r.status_code != 200)
+        print(f"chats finished {time.perf_counter() - started:.2f}s after searches, {failures} failed")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds per fake model reply")
+    parser.add_argument("--blocking", action="store_true", help="simulate the old blocking SDK call")
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.latency, args.blocking, args.searches, args.port))
@@ -0,0 +1,237 @@
+"""
+Scripted load scenarios against the HTTP API, with results saved as JSON.
+
+Serves the app with uvicorn on a local port over a synthetic timetable of
+`--services` services, with in-memory order and state stores and the
+Gemini model replaced by the deterministic fake model (`--model-latency`
+seconds per reply, one search_trains tool call per chat). Each scenario
+runs `--clients` concurrent clients, each sending `--requests` requests
+picked from the scenario's weighted mix with a fixed seed, so two runs
+send the same requests in the same order.
+
+Results (requests/s and p50/p95/p99 per endpoint) are written to
+`--output`. With `--compare` an earlier result file is read, the changes
+are printed, and the exit status is 1 if any endpoint's p99 grew by more
+than `--max-regression` percent.
+
+    python benchmarks/load_scenarios.py [--scenarios search orders booking chat mixed] [--clients 32]
+        [--requests 50] [--services 10000] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+os.environ.setdefault("ORDER_STORE", "memory")
+os.environ.setdefault("STATE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.fake_model import FakeModel  # noqa: E402
+from benchmarks.synthetic import city_name, generate_timetable, install_timetable  # noqa: E402
+
+# The app logs at INFO; the client's per-request lines would drown the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+CITIES = 200
+DATES = [str(datetime.date(2024, 8, 1) + datetime.timedelta(days=i)) for i in range(365)]
+
+# Weighted request mixes: {step name: weight}
+SCENARIOS = {
+    "search": {"search": 1},
+    "orders": {"orders": 1},
+    "booking": {"book": 1},
+    "chat": {"chat": 1},
+    "mixed": {"search": 6, "orders": 2, "book": 1, "chat": 1},
+}
+
+
+async def search(client, rng, context):
+    origin, destination = rng.sample(range(CITIES), 2)
+    body = {"origin": city_name(origin), "destination": city_name(destination), "date": rng.choice(DATES)}
+    return "/api/search-routes", await client.post("/api/search-routes", json=body)
+
+
+async def orders(client, rng, context):
+    params = {"limit": rng.choice((10, 50)), "fields": rng.choice(("full", "summary"))}
+    return "/api/my-orders", await client.get("/api/my-orders", params=params)
+
+
+async def book(client, rng, context):
+    date = rng.choice(DATES)
+    legs = [
+        {"trainId": train_id, "trainName": train_id, "from": "A", "to": "B", "date": date,
+         "departureTime": "08:00", "arrivalTime": "10:00"}
+        for train_id in rng.sample(context["train_ids"], 2)
+    ]
+    body = {
+        "route": {"origin": "A", "destination": "B", "legs": legs}, "passengers": 1,
+        "passengersInfo": [{"name": "Load", "idNumber": "1"}], "selectedSeats": {}, "totalPrice": 100000,
+    }
+    headers = {"Idempotency-Key": f"load-{rng.getrandbits(64):016x}"}
+    return "/api/book-alternative-route", await client.post("/api/book-alternative-route", json=body, headers=headers)
+
+
+async def chat(client, rng, context):
+    body = {"message": f"trains {rng.randrange(CITIES)}", "session_id": f"load-{rng.getrandbits(32)}"}
+    return "/api/chat", await client.post("/api/chat", json=body)
+
+
+STEPS = {"search": search, "orders": orders, "book": book, "chat": chat}
+
+
+def serve(port):
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def summarize(latencies, statuses, elapsed):
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(latencies), 3),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+async def run_scenario(name, port, clients, requests, context):
+    mix = SCENARIOS[name]
+    latencies, statuses = defaultdict(list), defaultdict(lambda: defaultdict(int))
+
+    async def client_loop(client, seed):
+        rng = random.Random(f"{name}-{seed}")
+        for step in rng.choices(list(mix), weights=list(mix.values()), k=requests):
+            started = time.perf_counter()
+            endpoint, response = await STEPS[step](client, rng, context)
+            latencies[endpoint].append((time.perf_counter() - started) * 1000)
+            statuses[endpoint][str(response.status_code)] += 1
+
+    limits = httpx.Limits(max_connections=clients + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, i) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    everything = [latency for endpoint in latencies.values() for latency in endpoint]
+    all_statuses = defaultdict(int)
+    for endpoint in statuses.values():
+        for status, count in endpoint.items():
+            all_statuses[status] += count
+    return {
+        "total": summarize(everything, all_statuses, elapsed),
+        "endpoints": {endpoint: summarize(latencies[endpoint], statuses[endpoint], elapsed) for endpoint in sorted(latencies)},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, max_regression):
+    """Prints the change of every endpoint against `baseline`; returns False on a p99 regression."""
+    ok = True
+    for name, scenario in results["scenarios"].items():
+        before_scenario = baseline.get("scenarios", {}).get(name)
+        if before_scenario is None:
+            continue
+        for endpoint, after in scenario["endpoints"].items():
+            before = before_scenario["endpoints"].get(endpoint)
+            if before is None:
+                continue
+            change = (after["p99_ms"] - before["p99_ms"]) / before["p99_ms"] * 100 if before["p99_ms"] else 0.0
+            regressed = change > max_regression
+            ok = ok and not regressed
+            print(
+                f"{name:<8} {endpoint:<28} p99 {before['p99_ms']:9.2f} -> {after['p99_ms']:9.2f} ms ({change:+6.1f}%)  "
+                f"{before['requests_per_second']:8.1f} -> {after['requests_per_second']:8.1f} req/s"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+    return ok
+
+
+def run(args):
+    install_timetable(main, generate_timetable(args.services, cities=CITIES))
+    # The app loads the SDK together with the real model; the fake one skips
+    # that, so load it here rather than inside the first measured chat
+    import google.generativeai  # noqa: F401
+    main.model = FakeModel(
+        latency=args.model_latency,
+        tool_calls=[("search_trains", {"origin": city_name(0), "destination": city_name(1), "date": DATES[0]})],
+    )
+    context = {"train_ids": list(main.transit_indexes.timetable.trips_by_id)}
+    server = serve(args.port)
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenarios:
+            # Every scenario starts from empty caches
+            main.search_cache.clear()
+            main.tool_cache.clear()
+            result = asyncio.run(run_scenario(name, args.port, args.clients, args.requests, context))
+            results["scenarios"][name] = result
+            total = result["total"]
+            print(
+                f"{name:<8} {total['requests']:>6} requests  {total['requests_per_second']:8.1f} req/s  "
+                f"p50 {total['p50_ms']:8.2f} ms  p99 {total['p99_ms']:8.2f} ms  {total['statuses']}"
+            )
+    finally:
+        server.should_exit = True
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, results, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client and scenario")
+    parser.add_argument("--services", type=int, default=10_000, help="synthetic timetable size")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="seconds per fake model reply")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--output", default=f"load-results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20, help="allowed p99 increase in percent")
+    run(parser.parse_args())
@@ -0,0 +1,91 @@
+"""
+Concurrency stress test for order ids and idempotent booking.
+
+Runs `--processes` worker processes with `--threads` threads each, all
+booking through book_ticket_from_chat against the in-memory order store,
+and checks that every order id is unique across all of them. It then fires
+the same booking with one idempotency key from many threads at once and
+checks that exactly one order was created.
+
+    python benchmarks/stress_booking.py [--processes 4] [--threads 8] [--bookings 20000]
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["ORDER_STORE"] = "memory"
+
+PASSENGERS = [{"name": "Stress Test", "idNumber": "0000000000"}]
+# Bookings are spread over many travel dates so the seat inventory never runs out
+FIRST_DATE = datetime.date(2024, 8, 15)
+DATES = 3650
+
+
+def travel_date(n):
+    return (FIRST_DATE + datetime.timedelta(days=n % DATES)).isoformat()
+
+
+def book_many(count, threads):
+    import main
+
+    ids = []
+    lock = threading.Lock()
+
+    def worker(n):
+        booked = [main.book_ticket_from_chat("KAI001", travel_date(i), 1, PASSENGERS)["order_id"] for i in range(n)]
+        with lock:
+            ids.extend(booked)
+
+    workers = [threading.Thread(target=worker, args=(count // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return ids, time.perf_counter() - started
+
+
+def check_idempotency(threads):
+    import main
+
+    before = main.order_repository.count()
+    results = []
+
+    def worker():
+        results.append(main.book_ticket_from_chat("KAI001", "2024-08-15", 1, PASSENGERS, idempotency_key="stress-retry"))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    created = main.order_repository.count() - before
+    distinct = {result["order_id"] for result in results}
+    return created, distinct
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--bookings", type=int, default=20_000, help="total bookings across all processes")
+    args = parser.parse_args()
+
+    per_process = args.bookings // args.processes
+    with multiprocessing.Pool(args.processes) as pool:
+        batches = pool.starmap(book_many, [(per_process, args.threads)] * args.processes)
+
+    ids = [order_id for batch, _ in batches for order_id in batch]
+    slowest = max(elapsed for _, elapsed in batches)
+    duplicates = len(ids) - len(set(ids))
+    print(f"{len(ids)} bookings in {slowest:.2f}s ({len(ids) / slowest:,.0f}/s across processes), {duplicates} duplicate ids")
+
+    created, distinct = check_idempotency(64)
+    print(f"64 concurrent retries with one idempotency key: {created} order created, {len(distinct)} distinct order id returned")
+    if duplicates or created != 1 or len(distinct) != 1:
+        sys.exit(1)
@@ -0,0 +1,109 @@
+"""
+Synthetic timetable generator used by the benchmarks.
+
+Generates a network of `cities` cities with a few stations each and
+`services` single-hop trips between random station pairs, spread over the
+whole service day. The output is deterministic for a given seed.
+
+`write_gtfs` writes a GTFS zip of multi-stop trips over the same kind of
+network, for benchmarking the feed import.
+"""
+import csv
+import io
+import os
+import random
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timetable import MINUTES_PER_DAY, Station, StopTime, Timetable, Trip  # noqa: E402
+
+TRAIN_TYPES = ("Executive", "Business", "Economy")
+
+
+def city_name(index: int) -> str:
+    return f"City{index:04d}"
+
+
+def generate_trips(services: int, cities: int = 200, stations_per_city: int = 3, seed: int = 42):
+    rng = random.Random(seed)
+    stations = [
+        Station(f"S{c:04d}{s}", f"{city_name(c)} Station {s}", city_name(c), city_name(c).lower())
+        for c in range(cities)
+        for s in range(stations_per_city)
+    ]
+    for i in range(services):
+        origin, destination = rng.sample(stations, 2)
+        if origin.city_key == destination.city_key:
+            continue
+        departure = rng.randrange(MINUTES_PER_DAY)
+        arrival = departure + rng.randrange(30, 12 * 60)
+        price = rng.randrange(50, 800) * 1000
+        stops = (
+            StopTime(origin, departure, departure, 0),
+            StopTime(destination, arrival, arrival, price),
+        )
+        yield Trip(f"SYN{i:07d}", f"Synthetic {i}", TRAIN_TYPES[i % 3], stops, 100)
+
+
+def generate_timetable(services: int, cities: int = 200, seed: int = 42) -> Timetable:
+    return Timetable(generate_trips(services, cities=cities, seed=seed))
+
+
+def write_gtfs(path: str, services: int, cities: int = 200, stops_per_trip: int = 8, seed: int = 42):
+    """Writes a GTFS zip with `services` trips of `stops_per_trip` stops each to `path`."""
+    rng = random.Random(seed)
+    stations = [f"S{c:04d}{s}" for c in range(cities) for s in range(3)]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as feed:
+        with _gtfs_file(feed, "stops.txt", ("stop_id", "stop_name", "city")) as stops:
+            for code in stations:
+                city = city_name(int(code[1:5]))
+                stops.writerow((code, f"{city} Station {code[5]}", city))
+        with _gtfs_file(feed, "routes.txt", ("route_id", "route_long_name", "route_desc", "route_type")) as routes:
+            for train_type in TRAIN_TYPES:
+                routes.writerow((train_type, f"Synthetic {train_type}", train_type, 2))
+        with _gtfs_file(feed, "trips.txt", ("route_id", "service_id", "trip_id")) as trips:
+            for i in range(services):
+                trips.writerow((TRAIN_TYPES[i % 3], "daily", f"SYN{i:07d}"))
+        columns = ("trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence")
+        with _gtfs_file(feed, "stop_times.txt", columns) as stop_times:
+            for i in range(services):
+                minute = rng.randrange(MINUTES_PER_DAY)
+                for sequence, code in enumerate(rng.sample(stations, stops_per_trip), 1):
+                    arrival = minute
+                    minute += rng.randrange(2, 6)
+                    stop_times.writerow((f"SYN{i:07d}", _gtfs_time(arrival), _gtfs_time(minute), code, sequence))
+                    minute += rng.randrange(20, 90)
+
+
+def _gtfs_time(minutes: int) -> str:
+    # GTFS times run past 24:00 for trips that cross midnight
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+class _gtfs_file:
+    def __init__(self, feed: zipfile.ZipFile, name: str, header):
+        self.file = io.TextIOWrapper(feed.open(name, "w"), encoding="utf-8", newline="")
+        self.header = header
+
+    def __enter__(self):
+        writer = csv.writer(self.file)
+        writer.writerow(self.header)
+        return writer
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+def install_timetable(app, timetable: Timetable):
+    """
+    Swaps `timetable` and the indexes built from it into the app module
+    `app`, and empties the caches holding results of the old one. Returns
+    the indexes it replaced.
+    """
+    previous = app.get_transit()
+    app.transit_indexes = app.build_transit_indexes(timetable)
+    app.search_cache.clear()
+    app.tool_cache.clear()
+    return previous
@@ -0,0 +1,251 @@
+"""
+In-process result cache.
+
+`ResultCache` maps keys to computed values with a TTL and a bounded number
+of entries (least recently used go first). Concurrent misses on the same
+key are coalesced: the first caller computes the value and the others wait
+for it instead of computing it again.
+
+Entries can carry tags (e.g. the trains whose seat counts a search result
+shows), and `invalidate_tag` drops every entry with a given tag. A value
+that was being computed while one of its tags was invalidated is returned
+to its callers but not stored, since it may already be stale.
+
+`ToolResultCache` memoizes read-only tool functions on top of it, keyed on
+the tool name and its arguments, with a TTL per tool. Tools without a TTL
+are never cached.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Set
+
+TagsOf = Callable[[Any], Iterable[Hashable]]
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "tags")
+
+    def __init__(self, value: Any, expires_at: float, tags: Set[Hashable]):
+        self.value = value
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class _Pending:
+    __slots__ = ("done", "value", "error", "generation")
+
+    def __init__(self, generation: int):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.generation = generation
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        # Bumped by every invalidation; `_invalidated_at` remembers when each
+        # tag was last invalidated so in-flight computations can tell whether
+        # their result might be stale.
+        self._generation = 0
+        self._invalidated_at: Dict[Hashable, int] = {}
+        self._cleared_at = -1
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], Any], tags: Optional[TagsOf] = None,
+        ttl_seconds: Optional[float] = None, keep: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Returns the cached value for `key`, or computes, caches and returns
+        it. `tags`, if given, is called with the computed value and returns
+        the tags to store it under. `ttl_seconds` overrides the cache's TTL
+        for this entry. `keep`, if given, decides whether a computed value is
+        cached at all; callers waiting on the computation get it either way.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                self._remove(key)
+                self.expirations += 1
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _Pending(self._generation)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = compute()
+            entry_tags = set(tags(value)) if tags else set()
+        except BaseException as e:
+            pending.error = e
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.done.set()
+            raise
+
+        with self._lock:
+            self._pending.pop(key, None)
+            if (keep is None or keep(value)) and pending.generation > self._cleared_at and not any(
+                self._invalidated_at.get(tag, -1) >= pending.generation for tag in entry_tags
+            ):
+                ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+                self._store(key, _Entry(value, time.monotonic() + ttl, entry_tags))
+            if not self._pending:
+                self._invalidated_at.clear()
+        pending.value = value
+        pending.done.set()
+        return value
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """Drops every entry stored under `tag`; returns how many were dropped."""
+        with self._lock:
+            if self._pending:
+                self._invalidated_at[tag] = self._generation
+            self._generation += 1
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._cleared_at = self._generation
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _store(self, key: Hashable, entry: _Entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class ToolResultCache:
+    def __init__(
+        self,
+        ttls: Mapping[str, float],
+        tags: Optional[Mapping[str, Callable[[Dict, Any], Iterable[Hashable]]]] = None,
+        max_entries: int = 10_000,
+    ):
+        self.ttls = dict(ttls)
+        self.tags = dict(tags or {})
+        self.results = ResultCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {
+            name: {"hits": 0, "misses": 0, "saved_seconds": 0.0} for name in self.ttls
+        }
+
+    def call(self, name: str, function: Callable[..., Any], args: Dict) -> Any:
+        """
+        Calls `function(**args)`, or returns the result of an earlier call
+        with the same tool name and arguments while it is fresh. Error
+        results ({"status": "error", ...}) are not cached: what they report,
+        e.g. an order that doesn't exist yet, can change at any time.
+        """
+        ttl = self.ttls.get(name)
+        if ttl is None:
+            return function(**args)
+
+        computed = False
+
+        def compute():
+            nonlocal computed
+            computed = True
+            started = time.perf_counter()
+            result = function(**args)
+            return result, time.perf_counter() - started
+
+        tags_of = self.tags.get(name)
+        result, elapsed = self.results.get_or_compute(
+            (name, json.dumps(args, sort_keys=True, default=str)), compute,
+            (lambda value: tags_of(args, value[0])) if tags_of else None,
+            ttl_seconds=ttl, keep=lambda value: not _is_error(value[0]),
+        )
+        with self._lock:
+            stats = self._stats[name]
+            if computed:
+                stats["misses"] += 1
+            else:
+                # Callers that got the result without running the tool saved
+                # what it took the first caller to compute it.
+                stats["hits"] += 1
+                stats["saved_seconds"] += elapsed
+        return result
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        return self.results.invalidate_tag(tag)
+
+    def clear(self):
+        self.results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tools = {
+                name: {
+                    "hits": stats["hits"],
+                    "misses": stats["misses"],
+                    "saved_ms": round(stats["saved_seconds"] * 1000, 3),
+                }
+                for name, stats in self._stats.items()
+            }
+        return {"cache": self.results.stats(), "tools": tools}
+
+
+def _is_error(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("status") == "error"
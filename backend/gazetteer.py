@@ -0,0 +1,156 @@
+"""
+Station and city gazetteer.
+
+Every name a user might type for a place -- city names, city aliases,
+station names and station codes -- is stored lowercased in a trie. Each
+trie node keeps its best suggestions precomputed, so autocomplete costs one
+walk down the typed prefix no matter how large the network is.
+
+`resolve` maps free text to a city key: exact names, aliases and station
+codes first, then the closest name within a small edit distance (one typo
+for short names, two for longer ones). The edit distance is computed while
+walking the trie, so branches that are already too far away are never
+visited.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from timetable import Station
+
+MAX_SUGGESTIONS = 10
+# Inputs shorter than this must match exactly; anything is one typo away
+# from a two-letter code.
+MIN_FUZZY_LENGTH = 4
+
+
+class Place(NamedTuple):
+    rank: int  # cities before stations
+    name: str
+    kind: str  # "city" or "station"
+    city: str
+    city_key: str
+    code: Optional[str] = None
+
+
+def max_typos(text: str) -> int:
+    if len(text) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(text) <= 6 else 2
+
+
+class _Node:
+    __slots__ = ("children", "places", "suggestions")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.places: List[Place] = []  # places whose name ends here
+        # Every place whose name starts here while building, then the best
+        # MAX_SUGGESTIONS of them in order
+        self.suggestions = set()
+
+
+class Gazetteer:
+    def __init__(self, stations: Iterable[Station], aliases: Optional[Dict[str, str]] = None):
+        self.root = _Node()
+        self.cities: Dict[str, Place] = {}
+        for station in stations:
+            city = self.cities.get(station.city_key)
+            if city is None:
+                city = self.cities[station.city_key] = Place(0, station.city, "city", station.city, station.city_key)
+                self._insert(station.city, city)
+            place = Place(1, station.name, "station", station.city, station.city_key, station.code)
+            self._insert(station.name, place)
+            self._insert(station.code, place)
+        for alias, city_key in (aliases or {}).items():
+            city = self.cities.get(city_key)
+            if city is not None:
+                self._insert(alias, city)
+        self._rank(self.root)
+
+    def _insert(self, name: str, place: Place):
+        node = self.root
+        for char in name.lower().strip():
+            node = node.children.setdefault(char, _Node())
+            node.suggestions.add(place)
+        if place not in node.places:
+            node.places.append(place)
+
+    def _rank(self, root: _Node):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node.suggestions = sorted(node.suggestions)[:MAX_SUGGESTIONS]
+            stack.extend(node.children.values())
+
+    def _find(self, prefix: str) -> Optional[_Node]:
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[Place]:
+        """
+        Places whose name, alias or code starts with `prefix`, cities first.
+        Falls back to typo-tolerant matches when nothing starts with it.
+        """
+        text = prefix.lower().strip()
+        if not text:
+            return []
+        node = self._find(text)
+        if node is not None:
+            return node.suggestions[:limit]
+        places = sorted({place for _, place in self._closest(text)})
+        return places[:limit]
+
+    def resolve(self, text: str) -> Optional[str]:
+        """Returns the city key `text` most likely refers to, or None."""
+        text = text.lower().strip()
+        if not text:
+            return None
+        node = self._find(text)
+        if node is not None and node.places:
+            return min(node.places).city_key
+        matches = self._closest(text)
+        if not matches:
+            return None
+        return min(matches)[1].city_key
+
+    def _closest(self, text: str) -> List[Tuple[int, Place]]:
+        # Most typos are a single edit, and a search with a tighter bound
+        # prunes far more of the trie, so widen the bound only if needed.
+        for max_distance in range(1, max_typos(text) + 1):
+            matches = self._fuzzy(text, max_distance)
+            if matches:
+                return matches
+        return []
+
+    def _fuzzy(self, text: str, max_distance: int) -> List[Tuple[int, Place]]:
+        """(edit distance, place) for every name within `max_distance` of `text`."""
+        matches = []
+        length = len(text)
+        too_far = max_distance + 1
+        first_row = [i if i <= max_distance else too_far for i in range(length + 1)]
+        stack = [(child, char, 1, first_row) for char, child in self.root.children.items()]
+        while stack:
+            node, char, depth, previous = stack.pop()
+            # Cells further than `max_distance` from the diagonal can't get
+            # back under the bound, so only the band around it is computed.
+            low, high = max(1, depth - max_distance), min(length, depth + max_distance)
+            row = [too_far] * (length + 1)
+            row[0] = depth if depth <= max_distance else too_far
+            for i in range(low, high + 1):
+                row[i] = min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (text[i - 1] != char), too_far)
+            if row[length] <= max_distance:
+                matches.extend((row[length], place) for place in node.places)
+            if min(row[low - 1:high + 1]) <= max_distance:
+                stack.extend((child, next_char, depth + 1, row) for next_char, child in node.children.items())
+        return matches
+
+
+def place_view(place: Place) -> Dict:
+    """Builds the suggestion dict the search form consumes."""
+    view = {"type": place.kind, "name": place.name, "city": place.city}
+    if place.code:
+        view["code"] = place.code
+    return view
@@ -0,0 +1,227 @@
+"""
+GTFS timetable import.
+
+Reads stops.txt, routes.txt (optional), trips.txt and stop_times.txt from a
+GTFS zip and builds timetable columns. stop_times.txt, by far the largest
+file, is streamed row by row: only the stops of the trip being read are
+held as Python objects, and everything else goes straight into the
+column arrays, so memory stays proportional to the size of the timetable
+rather than to the size of the text.
+
+Feeds list the stop times of each trip together in almost every case. A
+feed that doesn't is read a second time with its stop times grouped by trip
+in memory.
+
+GTFS has no notion of cities, train classes, seat counts or per-trip
+fares, which the app needs, so:
+- a stop's city comes from an optional (non-standard) `city` column in
+  stops.txt, else from its parent station's name, else from its own name.
+  Platforms are merged into their parent station.
+- a trip's class (Executive/Business/Economy) is read from its route's
+  description or names, and defaults to Economy.
+- every trip gets DEFAULT_TRAIN_SEATS seats.
+- fares grow with travel time at a rate per class (FARE_PER_MINUTE).
+Calendars are not applied: every trip is taken to run every day, like the
+rest of the app assumes.
+"""
+import csv
+import io
+import zipfile
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from timetable import Station, TimetableBuilder, TimetableColumns, parse_time
+
+DEFAULT_TRAIN_SEATS = 400
+DEFAULT_TRAIN_TYPE = "Economy"
+# Rupiah per minute of travel, from the fares of the current schedule
+FARE_PER_MINUTE = {"Executive": 925, "Business": 640, "Economy": 400}
+FARE_ROUNDING = 1000
+TRAIN_TYPE_WORDS = {
+    "executive": "Executive", "eksekutif": "Executive",
+    "business": "Business", "bisnis": "Business",
+    "economy": "Economy", "ekonomi": "Economy",
+}
+
+
+class GTFSError(Exception):
+    """Raised when a feed is missing a required file or column."""
+
+
+def import_gtfs(path: str, normalize: Callable[[str], str] = str.lower) -> TimetableColumns:
+    """Builds timetable columns from the GTFS zip at `path`; `normalize` maps city names to keys."""
+    with zipfile.ZipFile(path) as feed:
+        stations = _read_stations(feed, normalize)
+        routes = _read_routes(feed) if "routes.txt" in feed.namelist() else {}
+        trips = _read_trips(feed, routes)
+        builder = TimetableBuilder()
+        station_index = {stop_id: builder.add_station(station) for stop_id, station in stations.items()}
+        try:
+            _add_trips(builder, _grouped_stop_times(feed), trips, station_index)
+        except _NotGrouped:
+            builder = TimetableBuilder()
+            station_index = {stop_id: builder.add_station(station) for stop_id, station in stations.items()}
+            _add_trips(builder, _stop_times_by_trip(feed), trips, station_index)
+    return builder.build()
+
+
+class _NotGrouped(Exception):
+    pass
+
+
+def _rows(feed: zipfile.ZipFile, name: str, required: Tuple[str, ...]) -> Iterator[Dict[str, str]]:
+    if name not in feed.namelist():
+        raise GTFSError(f"{name} is missing from the feed")
+    with feed.open(name) as raw:
+        reader = csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""))
+        missing = [column for column in required if column not in (reader.fieldnames or ())]
+        if missing:
+            raise GTFSError(f"{name} lacks the column(s) {', '.join(missing)}")
+        yield from reader
+
+
+def _read_stations(feed: zipfile.ZipFile, normalize: Callable[[str], str]) -> Dict[str, Station]:
+    """stop_id -> the station a passenger sees (a platform's parent station)."""
+    stops = {row["stop_id"]: row for row in _rows(feed, "stops.txt", ("stop_id", "stop_name"))}
+
+    def station_row(stop_id: str) -> Dict[str, str]:
+        row = stops[stop_id]
+        parent = row.get("parent_station")
+        return stops[parent] if parent in stops else row
+
+    stations: Dict[str, Station] = {}
+    by_code: Dict[str, Station] = {}
+    for stop_id in stops:
+        row = station_row(stop_id)
+        code = row.get("stop_code") or row["stop_id"]
+        station = by_code.get(code)
+        if station is None:
+            city = stops[stop_id].get("city") or row.get("city") or row["stop_name"]
+            station = by_code[code] = Station(code, row["stop_name"], city, normalize(city))
+        stations[stop_id] = station
+    return stations
+
+
+def _read_routes(feed: zipfile.ZipFile) -> Dict[str, Tuple[str, str]]:
+    """route_id -> (train name, train type)."""
+    routes = {}
+    for row in _rows(feed, "routes.txt", ("route_id",)):
+        name = row.get("route_long_name") or row.get("route_short_name") or row["route_id"]
+        routes[row["route_id"]] = (name, _train_type(row))
+    return routes
+
+
+def _train_type(route: Dict[str, str]) -> str:
+    for field in ("route_desc", "route_long_name", "route_short_name"):
+        for word in (route.get(field) or "").lower().split():
+            if word in TRAIN_TYPE_WORDS:
+                return TRAIN_TYPE_WORDS[word]
+    return DEFAULT_TRAIN_TYPE
+
+
+def _read_trips(feed: zipfile.ZipFile, routes: Dict[str, Tuple[str, str]]) -> Dict[str, Tuple[str, str]]:
+    """trip_id -> (train name, train type)."""
+    trips = {}
+    for row in _rows(feed, "trips.txt", ("trip_id", "route_id")):
+        route_name, train_type = routes.get(row["route_id"], (None, DEFAULT_TRAIN_TYPE))
+        name = route_name or row.get("trip_short_name") or row.get("trip_headsign") or row["trip_id"]
+        trips[row["trip_id"]] = (name, train_type)
+    return trips
+
+
+StopRow = Tuple[int, str, Optional[int], Optional[int]]  # (stop_sequence, stop_id, arrival, departure)
+
+STOP_TIME_COLUMNS = ("trip_id", "stop_id", "stop_sequence", "arrival_time", "departure_time")
+
+
+class _Times(dict):
+    """'HH:MM:SS' -> minutes, parsed once per distinct value (a feed has a few thousand)."""
+
+    def __missing__(self, value: str) -> Optional[int]:
+        minutes = self[value] = parse_time(value.strip()) if value.strip() else None
+        return minutes
+
+
+def _stop_times(feed: zipfile.ZipFile, group: Callable) -> Iterator[Tuple[str, List[StopRow]]]:
+    # stop_times.txt is most of a feed: plain rows, column positions and a
+    # C-level grouping are several times faster than a DictReader here
+    if "stop_times.txt" not in feed.namelist():
+        raise GTFSError("stop_times.txt is missing from the feed")
+    with feed.open("stop_times.txt") as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""))
+        header = next(reader, [])
+        missing = [column for column in STOP_TIME_COLUMNS if column not in header]
+        if missing:
+            raise GTFSError(f"stop_times.txt lacks the column(s) {', '.join(missing)}")
+        trip, stop, sequence, arrival, departure = (header.index(column) for column in STOP_TIME_COLUMNS)
+        times = _Times()
+        for trip_id, rows in group(filter(None, reader), itemgetter(trip)):
+            yield trip_id, [(int(row[sequence]), row[stop], times[row[arrival]], times[row[departure]]) for row in rows]
+
+
+def _grouped_stop_times(feed: zipfile.ZipFile) -> Iterator[Tuple[str, List[StopRow]]]:
+    """(trip_id, its stop rows) per trip, assuming each trip's rows are together."""
+    seen = set()
+    for trip_id, stops in _stop_times(feed, groupby):
+        if trip_id in seen:
+            raise _NotGrouped()
+        seen.add(trip_id)
+        yield trip_id, stops
+
+
+def _stop_times_by_trip(feed: zipfile.ZipFile) -> Iterator[Tuple[str, List[StopRow]]]:
+    def group(rows, key):
+        by_trip: Dict[str, List[List[str]]] = {}
+        for row in rows:
+            by_trip.setdefault(key(row), []).append(row)
+        return by_trip.items()
+
+    return _stop_times(feed, group)
+
+
+def _add_trips(builder: TimetableBuilder, stop_times, trips: Dict[str, Tuple[str, str]], station_index: Dict[str, int]):
+    for trip_id, stops in stop_times:
+        trip = trips.get(trip_id)
+        if trip is None or len(stops) < 2:
+            continue
+        stops.sort()
+        times = _fill_times(stops)
+        if times is None:
+            continue
+        name, train_type = trip
+        rate = FARE_PER_MINUTE.get(train_type, FARE_PER_MINUTE[DEFAULT_TRAIN_TYPE])
+        arrivals = [arrival for arrival, _ in times]
+        start = times[0][1]
+        builder.add_stops(
+            [station_index[stop_id] for _, stop_id, _, _ in stops],
+            arrivals,
+            [departure for _, departure in times],
+            [round(max(arrival - start, 0) * rate / FARE_ROUNDING) * FARE_ROUNDING for arrival in arrivals],
+        )
+        builder.end_trip(trip_id, name, train_type, DEFAULT_TRAIN_SEATS)
+
+
+def _fill_times(stops: List[StopRow]) -> Optional[List[Tuple[int, int]]]:
+    """
+    (arrival, departure) for every stop. A stop with only one of the two uses
+    it for both; stops with neither (allowed between timepoints) get times
+    interpolated between their neighbours. None if the first or last stop
+    has no time at all.
+    """
+    known = [(arrival if arrival is not None else departure, departure if departure is not None else arrival)
+             for _, _, arrival, departure in stops]
+    if known[0][0] is None or known[-1][0] is None:
+        return None
+    previous = 0
+    for i in range(1, len(known)):
+        if known[i][0] is None:
+            continue
+        gap = i - previous
+        if gap > 1:
+            start, end = known[previous][1], known[i][0]
+            for j in range(previous + 1, i):
+                minute = start + (end - start) * (j - previous) // gap
+                known[j] = (minute, minute)
+        previous = i
+    return known
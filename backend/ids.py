@@ -0,0 +1,130 @@
+"""
+Order id generation and idempotent booking.
+
+Order ids are ULIDs with a prefix: 48 bits of millisecond timestamp
+followed by 80 random bits, written in Crockford base32. Ids therefore
+sort by creation time, and two processes generating ids in the same
+millisecond would need to draw the same 80 random bits to collide. Within
+one process, ids generated in the same millisecond increment the random
+part, so they stay strictly increasing and can't repeat.
+
+`IdempotencyStore` remembers the result of a booking under the client's
+idempotency key, so a retried request gets the original order back instead
+of booking again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from state import StateBackend, dump, load
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+RANDOM_BITS = 80
+RANDOM_LIMIT = 1 << RANDOM_BITS
+
+
+def encode_base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(CROCKFORD_ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+
+class OrderIdGenerator:
+    def __init__(self, prefix: str = "TRX"):
+        self.prefix = prefix
+        self._reset()
+        # A forked worker must not continue the parent's sequence
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = 0
+
+    def new_id(self) -> str:
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._last_random = int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+            else:
+                # Same millisecond (or the clock went back): keep increasing
+                self._last_random += 1
+                if self._last_random >= RANDOM_LIMIT:
+                    self._last_ms += 1
+                    self._last_random = int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+            value = (self._last_ms << RANDOM_BITS) | self._last_random
+        return self.prefix + encode_base32(value, 26)
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an idempotency key is sent again with a different request."""
+
+
+class IdempotencyStore:
+    """
+    Idempotency keys live in the shared state backend, so a retry that lands
+    on another worker still finds the first attempt.
+    """
+
+    def __init__(
+        self,
+        state: StateBackend,
+        ttl_seconds: float = 24 * 3600,
+        pending_ttl_seconds: float = 5 * 60,
+        poll_interval: float = 0.02,
+    ):
+        self.state = state
+        self.ttl_seconds = ttl_seconds
+        # A worker that dies mid-booking leaves its claim behind; it expires
+        # after this long so the key can be retried.
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.poll_interval = poll_interval
+
+    def run(
+        self, key: str, request: Dict, action: Callable[[], Any], keep: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Runs `action` once per key. Concurrent and later calls with the same
+        key and request wait for and return the first call's result. If the
+        action raises, or returns a result that `keep` rejects (e.g. an
+        error worth retrying), the key is released so the client can retry.
+        """
+        fingerprint = request_fingerprint(request)
+        state_key = f"idempotency:{key}"
+        claim = dump({"fingerprint": fingerprint, "done": False})
+        deadline = time.monotonic() + self.pending_ttl_seconds
+        while not self.state.set(state_key, claim, ttl=self.pending_ttl_seconds, nx=True):
+            entry = load(self.state.get(state_key))
+            if entry is None:
+                # The first attempt failed; try again as the new owner
+                continue
+            if entry["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused(f"Idempotency key {key} was already used for a different request.")
+            if entry["done"]:
+                return entry["result"]
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The request with idempotency key {key} is still being processed.")
+            time.sleep(self.poll_interval)
+
+        try:
+            result = action()
+        except BaseException:
+            self.state.delete(state_key)
+            raise
+        if keep is not None and not keep(result):
+            self.state.delete(state_key)
+            return result
+        self.state.set(state_key, dump({"fingerprint": fingerprint, "done": True, "result": result}), ttl=self.ttl_seconds)
+        return result
+
+
+def request_fingerprint(request: Dict) -> str:
+    """A hash of a request; values that are not JSON, like dates, count by their str()."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
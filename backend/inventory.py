@@ -0,0 +1,388 @@
+"""
+Seat inventory.
+
+Seats are tracked per (train id, travel date). Each coach's seat map is a
+bitset kept in an int, with a set bit for every seat that is held or sold.
+A booking first places a *hold* on seats, then either *confirms* it (the
+seats stay taken) or *releases* it (the seats become free again). Holds
+that are neither confirmed nor released expire after their TTL. Confirmed
+seats belong to an order and cannot be released through their hold; only
+the request that confirmed them can revert the confirmation, when storing
+the order fails.
+
+The seat maps live in a `StateBackend`, so every worker process sees the
+same seats. Each (train, date) is one key holding its seat map and its
+unconfirmed holds; each hold has a key recording its seats. A hold may span
+several trains (the legs of a multi-leg journey): all of their keys are
+changed in one atomic backend update, so either every leg gets its seats or
+none does.
+"""
+import datetime
+import functools
+import os
+import secrets
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from state import StateBackend, WithTTL, dump, load
+
+SEATS_PER_ROW = 4
+SEAT_LETTERS = "ABCD"
+# Rows per coach by class, as laid out by the seat picker in the frontend
+COACH_ROWS = {"Executive": 8, "Business": 10, "Economy": 12}
+DEFAULT_COACH_ROWS = 12
+SEAT_CHANGES_CHANNEL = "seat-changes"
+# How long the record of an unconfirmed hold outlives the hold itself
+HOLD_RECORD_GRACE_SECONDS = 60
+# How long the record of a confirmed hold outlives its last travel day. It
+# only stops the hold from being booked again: the seats stay taken.
+CONFIRMED_RECORD_GRACE_SECONDS = 24 * 60 * 60
+
+InventoryKey = Tuple[str, str]  # (train id, date)
+Seat = Tuple[int, int]  # (coach, seat index in coach)
+
+
+class SeatsUnavailable(Exception):
+    """Raised when a hold cannot get the requested seats."""
+
+
+class SeatRequest(NamedTuple):
+    train_id: str
+    date: str
+    count: int = 0
+    # Specific seat labels (e.g. "3B", or "2-3B" for coach 2), one per
+    # passenger; when empty, `count` seats are picked automatically.
+    seats: Sequence[str] = ()
+
+
+class SeatLayout(NamedTuple):
+    capacity: int
+    coach_size: int
+
+
+def coach_layout(train_type: str, capacity: int) -> SeatLayout:
+    return SeatLayout(capacity, COACH_ROWS.get(train_type, DEFAULT_COACH_ROWS) * SEATS_PER_ROW)
+
+
+class Hold(NamedTuple):
+    hold_id: str
+    seats: Dict[InventoryKey, Tuple[str, ...]]
+    expires_at: float  # time.time() timestamp
+
+
+@functools.lru_cache(maxsize=1024)
+def coach_sizes(layout: SeatLayout) -> Tuple[int, ...]:
+    coach_count = -(-layout.capacity // layout.coach_size)
+    return tuple(min(layout.coach_size, layout.capacity - coach * layout.coach_size) for coach in range(coach_count))
+
+
+def seat_label(coach: int, index: int) -> str:
+    row, column = divmod(index, SEATS_PER_ROW)
+    label = f"{row + 1}{SEAT_LETTERS[column]}"
+    return label if coach == 0 else f"{coach + 1}-{label}"
+
+
+def parse_seat_label(label: str, layout: SeatLayout) -> Seat:
+    """Returns (coach, seat index in coach) for a seat label."""
+    coach_part, _, seat_part = label.strip().upper().rpartition("-")
+    coach = int(coach_part) - 1 if coach_part else 0
+    row, letter = int(seat_part[:-1]) - 1, seat_part[-1]
+    index = row * SEATS_PER_ROW + SEAT_LETTERS.index(letter)
+    coach_count = -(-layout.capacity // layout.coach_size)
+    if not (0 <= coach < coach_count and 0 <= index < layout.coach_size) or \
+            coach * layout.coach_size + index >= layout.capacity:
+        raise ValueError(f"Seat {label} does not exist on this train.")
+    return coach, index
+
+
+class TrainInventory:
+    """Seat map and unconfirmed holds of one train on one date."""
+
+    def __init__(self, layout: SeatLayout, taken: Optional[List[int]] = None, pending: Optional[Dict] = None):
+        self.layout = layout
+        self.coach_sizes = coach_sizes(layout)
+        self.taken = taken or [0] * len(self.coach_sizes)
+        # hold id -> [expires at, [[coach, index], ...]]
+        self.pending: Dict[str, list] = pending or {}
+
+    @classmethod
+    def loads(cls, layout: SeatLayout, value: Optional[str]) -> "TrainInventory":
+        state = load(value, {})
+        return cls(layout, state.get("taken"), state.get("pending"))
+
+    def dumps(self) -> str:
+        return dump({"taken": self.taken, "pending": self.pending})
+
+    def available(self) -> int:
+        return self.layout.capacity - sum(bits.bit_count() for bits in self.taken)
+
+    def taken_labels(self) -> List[str]:
+        return [
+            seat_label(coach, index)
+            for coach, bits in enumerate(self.taken)
+            for index in range(self.coach_sizes[coach])
+            if bits >> index & 1
+        ]
+
+    def pick(self, request: SeatRequest) -> Tuple[Seat, ...]:
+        """Chooses seats for a request without taking them."""
+        if request.count < 1:
+            raise ValueError(f"At least one seat must be requested on {request.train_id}.")
+        if request.seats and len(request.seats) != request.count:
+            raise ValueError(
+                f"{len(request.seats)} seat(s) were selected on {request.train_id} for {request.count} passenger(s)."
+            )
+        if request.seats:
+            seats = tuple(parse_seat_label(label, self.layout) for label in request.seats)
+            if len(set(seats)) != len(seats):
+                raise SeatsUnavailable("The same seat was requested twice.")
+            for coach, index in seats:
+                if self.taken[coach] >> index & 1:
+                    raise SeatsUnavailable(f"Seat {seat_label(coach, index)} on {request.train_id} is already taken.")
+            return seats
+
+        if request.count > self.available():
+            raise SeatsUnavailable(f"Only {self.available()} seats left on {request.train_id}.")
+        seats = []
+        for coach, bits in enumerate(self.taken):
+            free = ~bits & ((1 << self.coach_sizes[coach]) - 1)
+            while free and len(seats) < request.count:
+                lowest = free & -free
+                seats.append((coach, lowest.bit_length() - 1))
+                free ^= lowest
+            if len(seats) == request.count:
+                break
+        return tuple(seats)
+
+    def take(self, seats: Sequence[Seat]):
+        for coach, index in seats:
+            self.taken[coach] |= 1 << index
+
+    def free(self, seats: Sequence[Seat]):
+        for coach, index in seats:
+            self.taken[coach] &= ~(1 << index)
+
+    def expire(self, now: float):
+        for hold_id in [h for h, (expires_at, _) in self.pending.items() if expires_at <= now]:
+            self.free(self.pending.pop(hold_id)[1])
+
+
+class SeatInventory:
+    def __init__(
+        self,
+        layout_for: Callable[[str], Optional[SeatLayout]],
+        state: StateBackend,
+        hold_ttl_seconds: float = 600,
+    ):
+        self.layout_for = layout_for
+        self.state = state
+        self.hold_ttl_seconds = hold_ttl_seconds
+        # Called with the (train id, date) keys whose availability changed,
+        # by this or by another worker
+        self.listeners: List[Callable[[Sequence[InventoryKey]], None]] = []
+        self._origin = f"{os.getpid()}:{secrets.token_hex(4)}"
+        state.subscribe(SEAT_CHANGES_CHANNEL, self._on_remote_change)
+
+    def _layout(self, train_id: str) -> SeatLayout:
+        layout = self.layout_for(train_id)
+        if layout is None:
+            raise SeatsUnavailable(f"Train with ID {train_id} not found.")
+        return layout
+
+    def _notify(self, keys: Sequence[InventoryKey]):
+        for listener in self.listeners:
+            listener(keys)
+        self.state.publish(SEAT_CHANGES_CHANNEL, dump({"origin": self._origin, "keys": keys}))
+
+    def _on_remote_change(self, message: str):
+        change = load(message)
+        if change["origin"] != self._origin:
+            keys = [tuple(key) for key in change["keys"]]
+            for listener in self.listeners:
+                listener(keys)
+
+    def _read(self, train_id: str, date: str) -> TrainInventory:
+        inventory = TrainInventory.loads(self._layout(train_id), self.state.get(_seats_key(train_id, date)))
+        inventory.expire(time.time())
+        return inventory
+
+    def available(self, train_id: str, date: str) -> int:
+        return self._read(train_id, date).available()
+
+    def taken_seats(self, train_id: str, date: str) -> List[str]:
+        return self._read(train_id, date).taken_labels()
+
+    def hold(self, requests: Sequence[SeatRequest], ttl_seconds: Optional[float] = None) -> Hold:
+        """Holds seats on every requested train, or on none of them."""
+        hold_id = secrets.token_hex(12)
+        keys = [(request.train_id, request.date) for request in requests]
+        if len(set(keys)) != len(keys):
+            raise ValueError("Each train and date may only appear once in a hold.")
+        layouts = [self._layout(request.train_id) for request in requests]
+        expires_at = time.time() + (ttl_seconds if ttl_seconds is not None else self.hold_ttl_seconds)
+
+        def hold_legs(values):
+            now = time.time()
+            writes, legs = {}, []
+            for request, layout in zip(requests, layouts):
+                seats_key = _seats_key(request.train_id, request.date)
+                inventory = TrainInventory.loads(layout, values[seats_key])
+                inventory.expire(now)
+                try:
+                    seats = inventory.pick(request)
+                except ValueError as e:
+                    raise SeatsUnavailable(str(e))
+                inventory.take(seats)
+                inventory.pending[hold_id] = [expires_at, seats]
+                writes[seats_key] = inventory.dumps()
+                legs.append([request.train_id, request.date, seats])
+            record_ttl = expires_at - now + HOLD_RECORD_GRACE_SECONDS
+            writes[_hold_key(hold_id)] = WithTTL(dump({"legs": legs, "confirmed": False}), record_ttl)
+            return writes, legs
+
+        legs = self.state.update([_seats_key(*key) for key in keys] + [_hold_key(hold_id)], hold_legs)
+        self._notify(keys)
+        return Hold(
+            hold_id,
+            {(train_id, date): tuple(seat_label(*seat) for seat in seats) for train_id, date, seats in legs},
+            expires_at,
+        )
+
+    def _legs(self, hold_id: str) -> Optional[List]:
+        record = load(self.state.get(_hold_key(hold_id)))
+        return record["legs"] if record else None
+
+    def confirm(self, hold_id: str) -> str:
+        """
+        Turns a hold into sold seats. Raises SeatsUnavailable if the hold
+        expired or was already confirmed, so a hold is booked at most once.
+        Returns a confirmation token for `revert`.
+        """
+        confirmation = secrets.token_hex(8)
+        legs = self._legs(hold_id)
+        if legs is None:
+            raise SeatsUnavailable("The seat hold has expired or does not exist.")
+
+        def confirm_legs(values):
+            record = load(values[_hold_key(hold_id)])
+            if record is None:
+                return {}, "The seat hold has expired or does not exist."
+            if record["confirmed"]:
+                return {}, "The seat hold has already been booked."
+            now = time.time()
+            inventories = {}
+            for train_id, date, _ in legs:
+                seats_key = _seats_key(train_id, date)
+                inventories[seats_key] = inventory = TrainInventory.loads(self._layout(train_id), values[seats_key])
+                inventory.expire(now)
+            if any(hold_id not in inventory.pending for inventory in inventories.values()):
+                # Partially expired holds are released entirely
+                for inventory in inventories.values():
+                    if hold_id in inventory.pending:
+                        inventory.free(inventory.pending.pop(hold_id)[1])
+                writes = {key: inventory.dumps() for key, inventory in inventories.items()}
+                writes[_hold_key(hold_id)] = None
+                return writes, "The seat hold has expired."
+            for inventory in inventories.values():
+                del inventory.pending[hold_id]
+            writes = {key: inventory.dumps() for key, inventory in inventories.items()}
+            writes[_hold_key(hold_id)] = WithTTL(
+                dump({"legs": legs, "confirmed": confirmation}), _confirmed_record_ttl(legs, now),
+            )
+            return writes, None
+
+        keys = [_seats_key(train_id, date) for train_id, date, _ in legs] + [_hold_key(hold_id)]
+        error = self.state.update(keys, confirm_legs)
+        if error:
+            raise SeatsUnavailable(error)
+        return confirmation
+
+    def revert(self, hold_id: str, confirmation: str):
+        """
+        Frees the seats of a hold confirmed with `confirmation`, for when the
+        order they were sold for could not be stored. Holds confirmed by
+        another request are left alone.
+        """
+        legs = self._legs(hold_id)
+        if legs is None:
+            return
+
+        def revert_legs(values):
+            record = load(values[_hold_key(hold_id)])
+            if record is None or record["confirmed"] != confirmation:
+                return {}, False
+            writes = {_hold_key(hold_id): None}
+            for train_id, date, seats in legs:
+                seats_key = _seats_key(train_id, date)
+                inventory = TrainInventory.loads(self._layout(train_id), values[seats_key])
+                inventory.free(seats)
+                writes[seats_key] = inventory.dumps()
+            return writes, True
+
+        keys = [_seats_key(train_id, date) for train_id, date, _ in legs] + [_hold_key(hold_id)]
+        if self.state.update(keys, revert_legs):
+            self._notify([(train_id, date) for train_id, date, _ in legs])
+
+    def seats(self, hold_id: str) -> Dict[InventoryKey, Tuple[str, ...]]:
+        """The seats of a live or confirmed hold, by (train id, date)."""
+        legs = self._legs(hold_id)
+        if legs is None:
+            raise SeatsUnavailable("The seat hold has expired or does not exist.")
+        return {(train_id, date): tuple(seat_label(*seat) for seat in seats) for train_id, date, seats in legs}
+
+    def release(self, hold_id: str):
+        """
+        Frees the seats of an unconfirmed hold. Raises SeatsUnavailable if
+        the hold was confirmed: its seats now belong to an order.
+        """
+        legs = self._legs(hold_id)
+        if legs is None:
+            return
+
+        def release_legs(values):
+            record = load(values[_hold_key(hold_id)])
+            if record is None:
+                return {}, None
+            if record["confirmed"]:
+                return {}, "The seats of this hold have already been booked."
+            writes = {_hold_key(hold_id): None}
+            for train_id, date, _ in legs:
+                seats_key = _seats_key(train_id, date)
+                inventory = TrainInventory.loads(self._layout(train_id), values[seats_key])
+                # An expired hold's seats may have been sold again since
+                if hold_id in inventory.pending:
+                    inventory.free(inventory.pending.pop(hold_id)[1])
+                writes[seats_key] = inventory.dumps()
+            return writes, None
+
+        keys = [_seats_key(train_id, date) for train_id, date, _ in legs] + [_hold_key(hold_id)]
+        error = self.state.update(keys, release_legs)
+        if error:
+            raise SeatsUnavailable(error)
+        self._notify([(train_id, date) for train_id, date, _ in legs])
+
+    def reserve(self, requests: Sequence[SeatRequest]) -> Tuple[Hold, str]:
+        """Holds and immediately confirms seats; returns the hold and its confirmation."""
+        hold = self.hold(requests)
+        return hold, self.confirm(hold.hold_id)
+
+
+def _confirmed_record_ttl(legs: Sequence, now: float) -> float:
+    """Seconds from `now` to the end of the last travel day of `legs`, plus a grace period."""
+    last_day_end = now
+    for _, date, _ in legs:
+        try:
+            day = datetime.date.fromisoformat(date)
+        except ValueError:
+            continue
+        day_end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()).timestamp()
+        last_day_end = max(last_day_end, day_end)
+    return last_day_end - now + CONFIRMED_RECORD_GRACE_SECONDS
+
+
+def _seats_key(train_id: str, date: str) -> str:
+    return f"seats:{train_id}:{date}"
+
+
+def _hold_key(hold_id: str) -> str:
+    return f"seat-hold:{hold_id}"
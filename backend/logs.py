@@ -0,0 +1,31 @@
+"""
+Logging off the request path.
+
+`configure_logging` routes every log record through a queue: the code that
+logs only puts the record on the queue, and a listener thread formats it
+and writes it out. A slow terminal or log file therefore never holds up a
+request.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level: str = "INFO") -> logging.handlers.QueueListener:
+    """Installs the queued handler on the root logger and starts its listener."""
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level.upper())
+    listener.start()
+    return listener
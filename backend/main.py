@@ -1,36 +1,56 @@
 import os
-import google.generativeai as genai
-from fastapi import FastAPI, HTTPException
+import asyncio
+import atexit
+import contextlib
+import functools
+import hashlib
+import logging
+import secrets
+import threading
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import json
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal, NamedTuple
 import datetime
-import locale
-import re
-import copy
+import time
+
+from cache import ResultCache, ToolResultCache
+from gazetteer import Gazetteer, place_view
+from gtfs import import_gtfs
+from ids import IdempotencyKeyReused, IdempotencyStore, OrderIdGenerator, request_fingerprint
+from inventory import SeatInventory, SeatRequest, SeatsUnavailable, coach_layout
+from logs import configure_logging
+from metrics import Metrics, MetricsMiddleware
+from orders import OrderQuery, create_order_repository, decode_cursor, encode_cursor, order_key, summarize_order
+from planner import ConnectionIndex, JourneyPlanner
+from realtime import Broadcaster, RealtimeIndex, TripUpdate, TripUpdateLog, parse_trip_updates, read_new_lines
+from sessions import ChatSessionStore, summarize_history
+from snapshot import Snapshot, SnapshotError, read_snapshot, write_snapshot
+from state import create_state_backend
+from timetable import Timetable, format_time
 
 # Load environment variables from .env file
 load_dotenv()
 
+# --- Logging and Metrics ---
+# Log records are written by a background thread, see logs.py
+log_listener = configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+atexit.register(log_listener.stop)
+logger = logging.getLogger("apaaja")
+
+metrics = Metrics(prefix="apaaja_")
+
 # --- Pydantic Models ---
 class ChatRequest(BaseModel):
     message: str
-    conversation_history: list[dict] = []
+    # The server keeps the history of each session itself
     session_id: str
 
-class BookingRequest(BaseModel):
-    status: str = "AWAITING_DETAILS"
-    origin: Optional[str] = None
-    destination: Optional[str] = None
-    date: Optional[str] = None
-    passengers: Optional[int] = None
-    selected_train: Optional[dict] = None
-    passenger_details: list[dict] = []
-    last_search_results: list[dict] = []
-    language: str = "en" # Default language
-
 class SearchRequest(BaseModel):
     origin: str
     destination: str
@@ -42,14 +62,26 @@ class PassengerInfo(BaseModel):
 
 class AlternativeBookingRequest(BaseModel):
     route: dict
-    passengers: int
+    passengers: int = Field(ge=1)
     passengersInfo: List[PassengerInfo]
     selectedSeats: Dict[str, List[str]]
     totalPrice: float
+    # Confirms seats held earlier through /api/seat-holds instead of
+    # reserving `selectedSeats` at booking time.
+    holdId: Optional[str] = None
+
+class SeatHoldLeg(BaseModel):
+    trainId: str
+    date: str
+    passengers: int = Field(1, ge=1)
+    seats: List[str] = []
+
+class SeatHoldRequest(BaseModel):
+    legs: List[SeatHoldLeg]
 
 # --- In-Memory Storage ---
-booking_sessions: Dict[str, BookingRequest] = {}
-booked_orders: List[Dict] = [
+# Orders the store is seeded with when it is empty
+SEED_ORDERS: List[Dict] = [
     {
         "id": "TRX1722784264",
         "isAlternative": False,
@@ -68,6 +100,33 @@ booked_orders: List[Dict] = [
     }
 ]
 
+# --- Shared State ---
+# Seat holds, chat histories and idempotency keys live in the state backend.
+# STATE_BACKEND=memory (default) keeps them in this process, which is only
+# correct with a single worker. STATE_BACKEND=sqlite shares them between
+# the workers on one machine (uvicorn --workers N), STATE_BACKEND=redis
+# between machines.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+state_backend = create_state_backend(STATE_BACKEND, STATE_DB_PATH, REDIS_URL)
+
+# --- Order Store ---
+# ORDER_STORE=sqlite (default) keeps orders in an embedded SQLite database
+# (shared by the workers on one machine), ORDER_STORE=state keeps them in the
+# state backend, and ORDER_STORE=memory keeps them in process memory only.
+ORDER_STORE = os.getenv("ORDER_STORE", "sqlite")
+ORDERS_DB_PATH = os.getenv("ORDERS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "orders.db"))
+
+MAX_ORDERS_PAGE_SIZE = 200
+
+order_repository = create_order_repository(ORDER_STORE, ORDERS_DB_PATH, state_backend)
+order_ids = OrderIdGenerator(prefix="TRX")
+idempotency_store = IdempotencyStore(state_backend)
+if order_repository.count() == 0:
+    order_repository.add_many(SEED_ORDERS)
+
 # --- Mock Data (with city information) ---
 mock_trains = [
     {
@@ -106,121 +165,394 @@ mock_trains = [
         "arrival": {"station_code": "LPN", "station_name": "Lempuyangan", "city": "Yogyakarta", "time": "07:10"},
         "duration": "8h 40m", "price": 180000, "available_seats": 15
     },
+    {
+        "train_id": "KAI007", "train_name": "Argo Cheribon", "train_type": "Executive",
+        "departure": {"station_code": "GMR", "station_name": "Gambir", "city": "Jakarta", "time": "08:00"},
+        "arrival": {"station_code": "CN", "station_name": "Cirebon", "city": "Cirebon", "time": "11:00"},
+        "duration": "3h 0m", "price": 250000, "available_seats": 60
+    },
+    {
+        "train_id": "KAI008", "train_name": "Bima", "train_type": "Executive",
+        "departure": {"station_code": "CN", "station_name": "Cirebon", "city": "Cirebon", "time": "12:00"},
+        "arrival": {"station_code": "SGU", "station_name": "Surabaya Pasarturi", "city": "Surabaya", "time": "20:30"},
+        "duration": "8h 30m", "price": 300000, "available_seats": 45
+    },
+    {
+        "train_id": "KAI009", "train_name": "Argo Parahyangan", "train_type": "Executive",
+        "departure": {"station_code": "GMR", "station_name": "Gambir", "city": "Jakarta", "time": "09:00"},
+        "arrival": {"station_code": "BD", "station_name": "Bandung", "city": "Bandung", "time": "12:15"},
+        "duration": "3h 15m", "price": 150000, "available_seats": 80
+    },
+    {
+        "train_id": "KAI010", "train_name": "Lodaya", "train_type": "Business",
+        "departure": {"station_code": "BD", "station_name": "Bandung", "city": "Bandung", "time": "13:00"},
+        "arrival": {"station_code": "YK", "station_name": "Yogyakarta", "city": "Yogyakarta", "time": "20:00"},
+        "duration": "7h 0m", "price": 270000, "available_seats": 50
+    },
 ]
 
+CITY_ALIASES = {
+    "jakarta": "jakarta", "jkt": "jakarta",
+    "surabaya": "surabaya", "sby": "surabaya",
+    "yogyakarta": "yogyakarta", "yogya": "yogyakarta", "jogja": "yogyakarta", "jogjakarta": "yogyakarta",
+    "bandung": "bandung", "bdg": "bandung",
+    "semarang": "semarang", "smg": "semarang",
+    "solo": "solo", "slo": "solo",
+    "malang": "malang", "ml": "malang",
+}
+
+def city_alias_key(city_name: str) -> str:
+    """Maps a city name or alias to its key, without typo correction."""
+    key = city_name.lower().strip()
+    return CITY_ALIASES.get(key, key)
+
+# --- Timetable ---
+# The timetable and the indexes built from it are read-only once built and
+# are only ever replaced as a whole, so a request sees one consistent set.
+# They are built by the startup hook, or by the first request that needs
+# them when the app runs without its lifespan (e.g. in scripts).
+#
+# TIMETABLE_FEED points at a GTFS zip; without it the mock trains above are
+# used. A feed is imported once into a snapshot file (TIMETABLE_SNAPSHOT)
+# that every worker maps into memory, so only one worker per machine parses
+# it. Every TIMETABLE_RELOAD_SECONDS the workers check whether the feed or
+# the snapshot changed and, if so, switch to the new timetable. Requests
+# already running keep the indexes they started with.
+TIMETABLE_FEED = os.getenv("TIMETABLE_FEED")
+TIMETABLE_SNAPSHOT = os.getenv(
+    "TIMETABLE_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "timetable.snapshot")
+)
+TIMETABLE_RELOAD_SECONDS = float(os.getenv("TIMETABLE_RELOAD_SECONDS", "30"))
+TIMETABLE_IMPORT_LOCK_SECONDS = 10 * 60
+MAX_TRANSFERS = 2
+MAX_ALTERNATIVE_ROUTES = 5
+MAX_AUTOCOMPLETE_SUGGESTIONS = 10
+
+class TransitIndexes(NamedTuple):
+    timetable: Timetable
+    planner: JourneyPlanner
+    gazetteer: Gazetteer
+    # Delays and cancellations applied on top of the timetable
+    realtime: RealtimeIndex
+    version: str = "mock"
+    # What the indexes were loaded from: feed and snapshot file stamps
+    source: tuple = ()
+
+def build_transit_indexes(
+    timetable: Timetable, connections: Optional[ConnectionIndex] = None, version: str = "mock", source: tuple = ()
+) -> TransitIndexes:
+    planner = JourneyPlanner(timetable, connections=connections)
+    gazetteer = Gazetteer(timetable.stations.values(), CITY_ALIASES)
+    return TransitIndexes(
+        timetable, planner, gazetteer, RealtimeIndex(timetable, planner.connections), version, source,
+    )
+
+transit_indexes: Optional[TransitIndexes] = None
+transit_lock = threading.Lock()
+# Stamp of a feed that failed to import, so it is not retried until it changes
+failed_feed: Optional[tuple] = None
+
+def file_stamp(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def timetable_source() -> tuple:
+    return (file_stamp(TIMETABLE_FEED), file_stamp(TIMETABLE_SNAPSHOT))
+
+def current_snapshot(feed: tuple) -> Optional[Snapshot]:
+    """The snapshot of the feed with stamp `feed`, if one has been written."""
+    try:
+        snapshot = read_snapshot(TIMETABLE_SNAPSHOT)
+    except (FileNotFoundError, SnapshotError):
+        return None
+    return snapshot if tuple(snapshot.meta.get("feed", ())) == feed else None
+
+def import_feed(feed: tuple):
+    """
+    Imports TIMETABLE_FEED into TIMETABLE_SNAPSHOT. Only one worker imports
+    at a time; the others wait for its snapshot.
+    """
+    token = secrets.token_hex(8)
+    while not state_backend.acquire("timetable-import", token, TIMETABLE_IMPORT_LOCK_SECONDS):
+        time.sleep(1)
+    try:
+        if current_snapshot(feed) is not None:
+            return
+        started = time.perf_counter()
+        digest = hashlib.sha256()
+        with open(TIMETABLE_FEED, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        timetable = Timetable.from_columns(import_gtfs(TIMETABLE_FEED, city_alias_key))
+        connections = ConnectionIndex(timetable)
+        write_snapshot(TIMETABLE_SNAPSHOT, timetable, connections, {"feed": feed, "version": digest.hexdigest()[:12]})
+        logger.info(
+            "Imported %d trips from %s in %.1f s", len(timetable.trips), TIMETABLE_FEED, time.perf_counter() - started
+        )
+    finally:
+        state_backend.release("timetable-import", token)
+
+def load_transit_indexes() -> TransitIndexes:
+    """Builds the indexes of the current timetable, importing the feed first if it has no snapshot yet."""
+    if not TIMETABLE_FEED:
+        return build_transit_indexes(Timetable.from_mock_trains(mock_trains, city_alias_key))
+    feed = file_stamp(TIMETABLE_FEED)
+    if feed is None:
+        raise FileNotFoundError(f"TIMETABLE_FEED {TIMETABLE_FEED} does not exist")
+    snapshot = current_snapshot(feed)
+    if snapshot is None:
+        import_feed(feed)
+        snapshot = current_snapshot(feed)
+        if snapshot is None:
+            raise SnapshotError(f"{TIMETABLE_FEED} changed while it was being imported")
+    source = (feed, file_stamp(TIMETABLE_SNAPSHOT))
+    return build_transit_indexes(snapshot.timetable, snapshot.connections, snapshot.meta["version"], source)
+
+def get_transit() -> TransitIndexes:
+    """The current timetable indexes, built on first use."""
+    global transit_indexes
+    indexes = transit_indexes
+    if indexes is None:
+        with transit_lock:
+            if transit_indexes is None:
+                started = time.perf_counter()
+                install_transit_indexes(load_transit_indexes())
+                logger.info("Built timetable indexes in %.1f ms", (time.perf_counter() - started) * 1000)
+            indexes = transit_indexes
+    return indexes
+
+def install_transit_indexes(indexes: TransitIndexes):
+    """Makes `indexes` the current ones, with the trip updates received so far applied to them."""
+    global transit_indexes
+    with realtime_lock:
+        indexes.realtime.apply(trip_updates.latest())
+        transit_indexes = indexes
+
+def reload_transit_indexes() -> bool:
+    """Switches to a new timetable if the feed or its snapshot changed. Returns whether it did."""
+    global failed_feed
+    source = timetable_source()
+    if source == get_transit().source or source[0] == failed_feed:
+        return False
+    with transit_lock:
+        try:
+            indexes = load_transit_indexes()
+        except Exception:
+            failed_feed = source[0]
+            raise
+        install_transit_indexes(indexes)
+    # Cached results were computed from the old timetable
+    search_cache.clear()
+    tool_cache.clear()
+    logger.info("Switched to timetable %s (%d trips)", indexes.version, len(indexes.timetable.trips))
+    return True
+
+async def watch_timetable():
+    while True:
+        await asyncio.sleep(TIMETABLE_RELOAD_SECONDS)
+        try:
+            await asyncio.to_thread(reload_transit_indexes)
+        except Exception:
+            logger.exception("Could not load the timetable from %s; keeping the current one", TIMETABLE_FEED)
+
 def normalize_city(city_name: str) -> str:
-    """Normalizes city names to a standard format for consistent searching."""
-    city_map = {
-        "jakarta": "jakarta", "jkt": "jakarta",
-        "surabaya": "surabaya", "sby": "surabaya",
-        "yogyakarta": "yogyakarta", "yogya": "yogyakarta", "jogja": "yogyakarta", "jogjakarta": "yogyakarta",
-        "bandung": "bandung", "bdg": "bandung",
-        "semarang": "semarang", "smg": "semarang",
-        "solo": "solo", "slo": "solo",
-        "malang": "malang", "ml": "malang",
-    }
-    return city_map.get(city_name.lower().strip(), city_name.lower().strip())
+    """
+    Normalizes city names to a standard format for consistent searching.
+    Station names, station codes and misspelled names resolve to their city.
+    """
+    return get_transit().gazetteer.resolve(city_name) or city_alias_key(city_name)
+
+# --- Seat Inventory ---
+SEAT_HOLD_TTL_SECONDS = 10 * 60
+
+def train_seat_layout(train_id: str):
+    trip = get_transit().timetable.get_trip(train_id)
+    return coach_layout(trip.train_type, trip.seats) if trip else None
+
+seat_inventory = SeatInventory(train_seat_layout, state_backend, hold_ttl_seconds=SEAT_HOLD_TTL_SECONDS)
+
+# --- Search Cache ---
+# Results of /api/search-routes by (origin, destination, date). Entries are
+# tagged with the (train id, date) of every direct route they list, since
+# those show seat counts, and dropped when seats on that train change. They
+# are also tagged ("realtime", date) and dropped when trip updates for that
+# date come in.
+SEARCH_CACHE_TTL_SECONDS = 60
+SEARCH_CACHE_MAX_ENTRIES = 10_000
+
+search_cache = ResultCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl_seconds=SEARCH_CACHE_TTL_SECONDS)
+
+# Results of the read-only tools by tool name and normalized arguments,
+# shared by the chatbot and /api/search-routes. Tools without a TTL here
+# (book_ticket_from_chat) always run.
+TOOL_CACHE_TTL_SECONDS = {
+    "search_trains": 60,
+    "find_alternative_routes": 5 * 60,
+    "get_order_status": 30,
+}
+
+tool_cache = ToolResultCache(
+    TOOL_CACHE_TTL_SECONDS,
+    tags={
+        "search_trains": lambda args, routes: [
+            ("realtime", args["date"]), *((route["train_id"], args["date"]) for route in routes)
+        ],
+        "find_alternative_routes": lambda args, routes: [("realtime", args["date"])],
+    },
+)
+
+# Optional tool arguments, filled in so a call that leaves them out shares
+# the cache entry of one that passes the default.
+TOOL_ARG_DEFAULTS = {"search_trains": {"passengers": 1}}
+
+def normalize_tool_args(function_name: str, args: Dict) -> Dict:
+    """
+    Normalizes tool arguments so equivalent calls share a cache entry (or
+    idempotency key).
+    """
+    normalized = {**TOOL_ARG_DEFAULTS.get(function_name, {}), **args}
+    for field in ("origin", "destination"):
+        if isinstance(normalized.get(field), str):
+            normalized[field] = normalize_city(normalized[field])
+    for field in ("date", "order_id"):
+        if isinstance(normalized.get(field), str):
+            normalized[field] = normalized[field].strip()
+    if "passengers" in normalized:
+        normalized["passengers"] = int(normalized["passengers"])
+    return normalized
+
+def invalidate_searches(keys):
+    for key in keys:
+        search_cache.invalidate_tag(key)
+        tool_cache.invalidate_tag(key)
+
+seat_inventory.listeners.append(invalidate_searches)
 
 def search_trains(origin: str, destination: str, date: str, passengers: int = 1):
     """
     Searches for direct trains based on origin, destination, and date.
-    Returns a list of deep copies of matching trains.
+    Returns a fresh list of lightweight route dicts built from the timetable index.
     """
-    results = [
-        copy.deepcopy(train) for train in mock_trains
-        if origin.lower() in train["departure"]["city"].lower() and
-           destination.lower() in train["arrival"]["city"].lower()
-    ]
-    return results
+    indexes = get_transit()
+    timetable, day = indexes.timetable, indexes.realtime.day(date)
+    offers = timetable.direct_offers(normalize_city(origin), normalize_city(destination))
+    routes = []
+    departures = []
+    for offer in offers:
+        state = day.trips.get(offer.trip) if day else None
+        if state is not None and state.times is None:
+            continue  # cancelled
+        view = timetable.offer_view(offer, state.times if state else None)
+        view["available_seats"] = seat_inventory.available(view["train_id"], date)
+        if view["available_seats"] >= passengers:
+            routes.append(view)
+            departures.append(offer.departure + view["delay_minutes"])
+    if day:
+        # Delays can change the order in which trains leave
+        routes = [routes[i] for i in sorted(range(len(routes)), key=departures.__getitem__)]
+    return routes
 
 
 def find_alternative_routes(origin: str, destination: str, date: str):
     """
-    Finds alternative routes with one transfer.
-    This is a mock implementation and will be replaced with a real one.
+    Finds routes with at least one transfer using the journey planner.
+    Returns the Pareto-optimal ones by arrival time, price and number of transfers.
+    Delays and cancellations on `date` are taken into account.
     """
-    # Normalize city names to handle variations consistently
-    origin_normalized = origin.strip().lower()
-    destination_normalized = destination.strip().lower()
-
-    # Mock data for alternative routes with lowercase keys for matching
-    alternatives = {
-        ("jakarta", "surabaya"): [
-            {
-                "route": "Jakarta → Cirebon → Surabaya",
-                "totalDuration": "11h 30m",
-                "transfers": 1,
-                "totalPrice": 550000,
-                "legs": [
-                    {"from": "Jakarta", "to": "Cirebon", "trainName": "Argo Cheribon", "category": "Executive", "duration": "3h 0m", "price": 250000, "departureTime": "08:00", "arrivalTime": "11:00", "date": date},
-                    {"from": "Cirebon", "to": "Surabaya", "trainName": "Bima", "category": "Executive", "duration": "8h 30m", "price": 300000, "departureTime": "12:00", "arrivalTime": "20:30", "date": date}
-                ]
-            }
-        ],
-        ("jakarta", "yogyakarta"): [
-            {
-                "route": "Jakarta → Bandung → Yogyakarta",
-                "totalDuration": "10h 15m",
-                "transfers": 1,
-                "totalPrice": 420000,
-                "legs": [
-                    {"from": "Jakarta", "to": "Bandung", "trainName": "Argo Parahyangan", "category": "Executive", "duration": "3h 15m", "price": 150000, "departureTime": "09:00", "arrivalTime": "12:15", "date": date},
-                    {"from": "Bandung", "to": "Yogyakarta", "trainName": "Lodaya", "category": "Business", "duration": "7h 0m", "price": 270000, "departureTime": "13:00", "arrivalTime": "20:00", "date": date}
-                ]
-            }
-        ]
-    }
-    
-    found_routes = alternatives.get((origin_normalized, destination_normalized), [])
-    
-    # Dynamically add origin and destination to each route object for frontend consistency
-    for route in found_routes:
-        route['origin'] = origin.title()
-        route['destination'] = destination.title()
-
-    return found_routes
+    indexes = get_transit()
+    planner, day = indexes.planner, indexes.realtime.day(date)
+    delays = day.connections if day else None
+    journeys = planner.search(
+        normalize_city(origin), normalize_city(destination),
+        min_transfers=1, max_transfers=MAX_TRANSFERS, delays=delays,
+    )
+    return [
+        planner.journey_view(journey, origin, destination, date, delays)
+        for journey in journeys[:MAX_ALTERNATIVE_ROUTES]
+    ]
 
 def get_order_status(order_id: str):
     """Looks up an order by its ID and returns its status."""
-    print(f"Searching for order with ID: {order_id}")
-    for order in booked_orders:
-        if order.get("id") == order_id:
-            return {
-                "status": "success",
-                "order_id": order_id,
-                "train_name": order["trainName"],
-                "destination": order["destination"],
-            }
+    order = order_repository.get(order_id)
+    if not order:
+        return {"status": "error", "message": f"Order {order_id} not found."}
+    return {
+        "status": "success",
+        "order_id": order_id,
+        "train_name": order["trainName"],
+        "destination": order["destination"],
+    }
 
-def book_ticket_from_chat(train_id: str, date: str, passengers: int, passengers_info: List[Dict]):
-    """Books a ticket from the chatbot, creating an order and storing it."""
-    selected_train = next((train for train in mock_trains if train['train_id'] == train_id), None)
+def book_ticket_from_chat(train_id: str, date: str, passengers: int, passengers_info: List[Dict], idempotency_key: Optional[str] = None):
+    """
+    Books a ticket from the chatbot, creating an order and storing it.
+    Calls repeated with the same idempotency key return the first booking.
+    """
+    if passengers < 1:
+        return {"status": "error", "message": "At least one passenger is needed for a booking."}
+    if len(passengers_info) != passengers:
+        return {
+            "status": "error",
+            "message": f"Details were given for {len(passengers_info)} passenger(s), but {passengers} are traveling.",
+        }
+    if idempotency_key:
+        request = {"train_id": train_id, "date": date, "passengers": passengers, "passengers_info": passengers_info}
+        # Only bookings are replayed: a sold-out train may have seats again on a retry
+        return idempotency_store.run(
+            idempotency_key, request,
+            lambda: book_ticket_from_chat(train_id, date, passengers, passengers_info),
+            keep=lambda result: result.get("status") != "error",
+        )
+
+    selected_train = get_transit().timetable.get_trip(train_id)
 
     if not selected_train:
         return {"status": "error", "message": f"Train with ID {train_id} not found."}
 
-    order_id = f"TRX{int(datetime.datetime.now().timestamp())}"
-    
+    first_stop, last_stop = selected_train.stops[0], selected_train.stops[-1]
+
+    try:
+        hold = seat_inventory.hold([SeatRequest(train_id, date, count=passengers)])
+    except SeatsUnavailable as e:
+        return {"status": "error", "message": str(e)}
+
+    order_id = order_ids.new_id()
+
     new_order = {
         "id": order_id,
         "isAlternative": False,
         "trainId": train_id,
-        "trainName": selected_train["train_name"],
-        "origin": selected_train["departure"]["city"],
-        "destination": selected_train["arrival"]["city"],
+        "trainName": selected_train.train_name,
+        "origin": first_stop.station.city,
+        "destination": last_stop.station.city,
         "date": date,
-        "time": selected_train["departure"]["time"],
+        "time": format_time(first_stop.departure),
         "passengers": passengers,
-        "price": selected_train["price"] * passengers,
+        "price": (last_stop.fare - first_stop.fare) * passengers,
         "status": "confirmed",
         "passengersInfo": passengers_info,
         "refundStatus": None,
-        "legs": []
+        "legs": [],
+        "seats": list(hold.seats[(train_id, date)]),
     }
 
-    booked_orders.append(new_order)
-    print(f"Successfully booked order via chat: {order_id}")
-    
+    try:
+        confirmation = seat_inventory.confirm(hold.hold_id)
+    except SeatsUnavailable as e:
+        return {"status": "error", "message": str(e)}
+    except Exception:
+        seat_inventory.release(hold.hold_id)
+        raise
+    try:
+        order_repository.add(new_order)
+    except Exception:
+        seat_inventory.revert(hold.hold_id, confirmation)
+        raise
+    logger.info("Booked order %s via chat", order_id)
+
     return {
         "status": "success",
         "order_id": order_id,
@@ -236,34 +568,412 @@ available_functions = {
     "book_ticket_from_chat": book_ticket_from_chat,
 }
 
-class SearchRequest(BaseModel):
-    origin: str
-    destination: str
-    date: str
+# --- Real-time Trip Updates ---
+# Delays and cancellations as GTFS-Realtime style trip updates (see
+# realtime.py). Every worker follows the JSON-lines file REALTIME_FEED, if
+# set; updates posted to /api/realtime/trip-updates reach every worker
+# through the state backend. They are applied on top of the timetable
+# indexes behind search_trains and find_alternative_routes, and pushed to
+# the clients of /api/realtime/stream. Updates for service dates before
+# yesterday are dropped, from the state backend too.
+REALTIME_FEED = os.getenv("REALTIME_FEED")
+REALTIME_POLL_SECONDS = float(os.getenv("REALTIME_POLL_SECONDS", "0.2"))
+REALTIME_KEEPALIVE_SECONDS = 15
+TRIP_UPDATES_CHANNEL = "trip-updates"
+TRIP_UPDATES_KEY = "trip-updates"
 
-class PassengerInfo(BaseModel):
-    name: str
-    idNumber: str
+trip_updates = TripUpdateLog()
+realtime_lock = threading.Lock()
+realtime_events = Broadcaster()
+realtime_counts = {"applied": 0, "stale": 0, "unknown_trip": 0, "invalid": 0}
+realtime_pruned_before = ""
 
-class AlternativeBookingRequest(BaseModel):
-    route: dict
-    passengers: int
-    passengersInfo: List[PassengerInfo]
-    selectedSeats: Dict[str, List[str]]
-    totalPrice: float
+def service_date(days: int = 0) -> str:
+    return (datetime.date.today() + datetime.timedelta(days=days)).isoformat()
+
+def trip_update_field(update: TripUpdate) -> str:
+    """The update's field in the TRIP_UPDATES_KEY hash."""
+    return f"{update.date} {update.trip_id}"
+
+def apply_trip_updates(updates: List[TripUpdate]):
+    """
+    Applies `updates` to the current timetable indexes, drops the search
+    results they make stale and sends the changes to stream subscribers.
+    Updates for service dates before yesterday are ignored.
+    """
+    global realtime_pruned_before
+    if not updates:
+        return
+    started = time.perf_counter()
+    get_transit()
+    yesterday = service_date(-1)
+    pruned = []
+    with realtime_lock:
+        if realtime_pruned_before != yesterday:
+            pruned = trip_updates.prune(yesterday)
+            transit_indexes.realtime.prune(yesterday)
+            realtime_pruned_before = yesterday
+        fresh = trip_updates.add(update for update in updates if update.date >= yesterday)
+        realtime = transit_indexes.realtime
+        changes = realtime.apply(fresh)
+        realtime_counts["applied"] += len(changes)
+        realtime_counts["stale"] += len(updates) - len(fresh)
+        realtime_counts["unknown_trip"] += len(fresh) - len(changes)
+    if pruned:
+        state_backend.hdel(TRIP_UPDATES_KEY, *map(trip_update_field, pruned))
+    invalidate_searches({("realtime", update.date) for update in fresh})
+    metrics.observe("realtime_apply_seconds", time.perf_counter() - started)
+    if changes and len(realtime_events):
+        views = [view for view in (realtime.trip_view(update, state) for update, state in changes) if view]
+        realtime_events.publish(sse_event("trip-updates", {"trips": views}))
+
+def read_trip_updates(documents: List[str], source: str) -> List[TripUpdate]:
+    """Parses JSON documents of trip updates, logging and skipping malformed ones."""
+    today = service_date()
+    updates = []
+    for document in documents:
+        try:
+            updates.extend(parse_trip_updates(json.loads(document), today))
+        except ValueError as e:
+            with realtime_lock:
+                realtime_counts["invalid"] += 1
+            logger.warning("Skipping malformed trip updates from %s: %s", source, e)
+    return updates
+
+def share_trip_updates(updates: List[TripUpdate]):
+    """Stores `updates` in the state backend and has every worker, this one included, apply them."""
+    yesterday = service_date(-1)
+    updates = [update for update in updates if update.date >= yesterday]
+    if not updates:
+        return
+    documents = [update.as_json() for update in updates]
+    for update, document in zip(updates, documents):
+        state_backend.hset(TRIP_UPDATES_KEY, trip_update_field(update), json.dumps(document))
+    state_backend.publish(TRIP_UPDATES_CHANNEL, json.dumps(documents))
+
+def on_shared_trip_updates(message: str):
+    try:
+        apply_trip_updates(read_trip_updates([message], "the state backend"))
+    except Exception:
+        logger.exception("Could not apply shared trip updates")
+
+state_backend.subscribe(TRIP_UPDATES_CHANNEL, on_shared_trip_updates)
+
+def load_shared_trip_updates():
+    """Applies the updates other workers shared before this one started, and forgets past ones."""
+    updates = read_trip_updates(state_backend.hvals(TRIP_UPDATES_KEY), "the state backend")
+    yesterday = service_date(-1)
+    past = [update for update in updates if update.date < yesterday]
+    if past:
+        state_backend.hdel(TRIP_UPDATES_KEY, *map(trip_update_field, past))
+    apply_trip_updates(updates)
+
+def poll_realtime_feed(position):
+    lines, position = read_new_lines(REALTIME_FEED, position)
+    apply_trip_updates(read_trip_updates(lines, REALTIME_FEED))
+    return bool(lines), position
+
+async def follow_realtime_feed():
+    position = (None, 0)
+    while True:
+        try:
+            more, position = await asyncio.to_thread(poll_realtime_feed, position)
+        except Exception:
+            logger.exception("Could not read trip updates from %s", REALTIME_FEED)
+            more = False
+        if not more:
+            await asyncio.sleep(REALTIME_POLL_SECONDS)
+
+# --- Chat Pipeline ---
+# The Gemini SDK calls and the tools are kept off the event loop so that a
+# slow model reply never stalls search or order requests.
+LLM_TIMEOUT_SECONDS = 30
+TOOL_TIMEOUT_SECONDS = 10
+MAX_TOOL_ITERATIONS = 5
+TOOL_LIMIT_REPLY = "Sorry, I couldn't finish that request. Could you try rephrasing it?"
+IDEMPOTENT_TOOLS = {"book_ticket_from_chat"}
+TOOL_STATUS_MESSAGES = {
+    "search_trains": "Searching trains…",
+    "find_alternative_routes": "Looking for alternative routes…",
+    "get_order_status": "Checking your order…",
+    "book_ticket_from_chat": "Booking your ticket…",
+}
+
+# Server-side chat sessions. With CHAT_HISTORY_MODE=summarize, long
+# histories are folded into a short text summary to cut prompt tokens.
+# Histories are saved to the state backend after every turn only when it is
+# shared between workers; in a single process the chat objects are enough.
+CHAT_SESSION_TTL_SECONDS = 30 * 60
+MAX_CHAT_SESSIONS = 1000
+MAX_CHAT_HISTORY_CHARS = 50_000_000
+CHAT_HISTORY_MODE = os.getenv("CHAT_HISTORY_MODE", "full")
+SUMMARY_TRIGGER_ENTRIES = 30
+SUMMARY_KEEP_ENTRIES = 10
+
+chat_sessions = ChatSessionStore(
+    ttl_seconds=CHAT_SESSION_TTL_SECONDS,
+    max_sessions=MAX_CHAT_SESSIONS,
+    max_total_chars=MAX_CHAT_HISTORY_CHARS,
+    state=state_backend if STATE_BACKEND != "memory" else None,
+)
+
+class ToolLimitExceeded(Exception):
+    """Raised when the model keeps asking for tools past MAX_TOOL_ITERATIONS."""
+
+tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat-tool")
+
+async def send_to_model(chat, content):
+    """Sends one message to the model without blocking the event loop."""
+    return await asyncio.wait_for(chat.send_message_async(content), timeout=LLM_TIMEOUT_SECONDS)
+
+def get_function_calls(response) -> list:
+    """Returns every function call the model asked for in its reply."""
+    parts = response.candidates[0].content.parts
+    return [part.function_call for part in parts if part.function_call]
+
+def plain_args(value):
+    """
+    Tool arguments as plain JSON values. The SDK hands them over as proto
+    maps and lists (with every number a float), which neither the order
+    stores nor json can take.
+    """
+    if isinstance(value, Mapping):
+        return {key: plain_args(item) for key, item in value.items()}
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        return [plain_args(item) for item in value]
+    return value
+
+async def call_function(function_name: str, args: dict, session_id: str):
+    """Runs a tool function on the bounded tool thread pool."""
+    if function_name not in available_functions:
+        # Handle case where the model calls a function that doesn't exist
+        return {"status": "error", "message": f"Function '{function_name}' is not available."}
+    args = normalize_tool_args(function_name, plain_args(args))
+    if function_name in IDEMPOTENT_TOOLS:
+        # A model that repeats the same booking call in a session gets the
+        # original booking back instead of a second order.
+        args = {**args, "idempotency_key": f"chat:{session_id}:{request_fingerprint(args)}"}
+    loop = asyncio.get_running_loop()
+    call = functools.partial(tool_cache.call, function_name, available_functions[function_name], args)
+    with metrics.span("chat_tool_call_seconds", tool=function_name):
+        result = await asyncio.wait_for(loop.run_in_executor(tool_executor, call), timeout=TOOL_TIMEOUT_SECONDS)
+    # Function responses sent to the model must be objects
+    return result if isinstance(result, dict) else {"result": result}
+
+def function_response_part(name: str, response: dict):
+    # Imported here: the SDK is loaded with the model, not at startup
+    from google.generativeai import protos
+
+    return protos.Part(function_response=protos.FunctionResponse(name=name, response=response))
+
+@contextlib.asynccontextmanager
+async def chat_session_turn(request: ChatRequest):
+    """Yields the session's chat for one turn and keeps the stored history valid."""
+    session_id = request.session_id
+    session = chat_sessions.get_or_create(session_id, lambda: model.start_chat(history=[]))
+    # Turns of one session are serialized (across workers too) so they never
+    # interleave in its history
+    async with session.lock, chat_sessions.turn_lock(session_id):
+        stored = await asyncio.to_thread(chat_sessions.load_history, session_id)
+        if stored is not None and stored.revision != session.revision:
+            # The last turn was answered by another worker
+            chat_sessions.replace_chat(session, model.start_chat(history=stored.history))
+            session.revision = stored.revision
+        chat = session.chat
+        history_length = len(chat.history)
+        try:
+            yield chat
+        except BaseException:
+            # Drop the half-finished turn so the stored history stays valid
+            chat.history = chat.history[:history_length]
+            raise
+        chat_sessions.update_size(session)
+        if CHAT_HISTORY_MODE == "summarize" and len(chat.history) > SUMMARY_TRIGGER_ENTRIES:
+            summarized = summarize_history(chat.history, keep_last=SUMMARY_KEEP_ENTRIES)
+            chat_sessions.replace_chat(session, model.start_chat(history=summarized))
+        await asyncio.to_thread(chat_sessions.save_history, session_id, session)
+
+async def stream_from_model(chat, content):
+    """Streams one model reply chunk by chunk, with a timeout per chunk."""
+    response = await asyncio.wait_for(chat.send_message_async(content, stream=True), timeout=LLM_TIMEOUT_SECONDS)
+    chunks = response.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=LLM_TIMEOUT_SECONDS)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+async def model_reply(chat, content, stream: bool):
+    """Yields the text pieces and function calls of one model reply."""
+    if not stream:
+        response = await send_to_model(chat, content)
+        function_calls = get_function_calls(response)
+        if function_calls:
+            for function_call in function_calls:
+                yield function_call
+        else:
+            yield response.text
+        return
+    async for chunk in stream_from_model(chat, content):
+        for part in chunk.candidates[0].content.parts:
+            if part.function_call:
+                yield part.function_call
+            elif part.text:
+                yield part.text
+
+async def chat_turn_events(chat, message: str, session_id: str, stream: bool = False):
+    """
+    Sends one user message and resolves tool calls until the model answers
+    in text. Yields (event, data) pairs: "status" while tools run, "token"
+    for each piece of the answer and a final "done" with timings.
+    """
+    turn_started = time.perf_counter()
+    first_byte_ms = first_token_ms = None
+    round_trips, tool_calls = 0, 0
+
+    def elapsed_ms():
+        return round((time.perf_counter() - turn_started) * 1000, 1)
+
+    # Loop to handle function calls from the model, capped so a model that
+    # keeps calling tools cannot hold on to the request forever. All calls
+    # requested in one model turn run concurrently and their results go
+    # back to the model in a single message.
+    content = message
+    iterations = 0
+    while True:
+        function_calls = []
+        round_trips += 1
+        # Only the time spent waiting on the model counts towards the round
+        # trip, not the time the client takes to consume the tokens
+        round_trip_seconds = 0.0
+        waited_since = time.perf_counter()
+        try:
+            async for piece in model_reply(chat, content, stream):
+                round_trip_seconds += time.perf_counter() - waited_since
+                if isinstance(piece, str):
+                    if first_token_ms is None:
+                        first_token_ms = elapsed_ms()
+                        first_byte_ms = first_byte_ms or first_token_ms
+                    yield "token", {"text": piece}
+                else:
+                    function_calls.append(piece)
+                waited_since = time.perf_counter()
+            round_trip_seconds += time.perf_counter() - waited_since
+            outcome = "tools" if function_calls else "answer"
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            metrics.observe(
+                "chat_llm_round_trip_seconds", round_trip_seconds,
+                mode="stream" if stream else "full", outcome=outcome,
+            )
+        if not function_calls:
+            break
+        iterations += 1
+        if iterations > MAX_TOOL_ITERATIONS:
+            logger.warning("Chat session %s exceeded %d tool rounds", session_id, MAX_TOOL_ITERATIONS)
+            raise ToolLimitExceeded()
+
+        for function_call in function_calls:
+            first_byte_ms = first_byte_ms or elapsed_ms()
+            yield "status", {"tool": function_call.name, "message": TOOL_STATUS_MESSAGES.get(function_call.name, "Working on it…")}
+        function_responses = await asyncio.gather(*(
+            call_function(function_call.name, dict(function_call.args), session_id)
+            for function_call in function_calls
+        ))
+        tool_calls += len(function_calls)
+
+        # Send the functions' results back to the model
+        content = [
+            function_response_part(function_call.name, function_response)
+            for function_call, function_response in zip(function_calls, function_responses)
+        ]
+
+    total_ms = elapsed_ms()
+    logger.debug(
+        "Chat turn for session %s: %d LLM round trips, %d tool calls, first byte %s ms, first token %s ms, total %s ms",
+        session_id, round_trips, tool_calls, first_byte_ms, first_token_ms, total_ms,
+    )
+    yield "done", {
+        "round_trips": round_trips,
+        "tool_calls": tool_calls,
+        "ttfb_ms": first_byte_ms,
+        "first_token_ms": first_token_ms,
+        "total_ms": total_ms,
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def chat_event_stream(request: ChatRequest):
+    """Runs one chat turn and formats its events as server-sent events."""
+    try:
+        async with chat_session_turn(request) as chat:
+            async for event, data in chat_turn_events(chat, request.message, request.session_id, stream=True):
+                yield sse_event(event, data)
+    except ToolLimitExceeded:
+        yield sse_event("token", {"text": TOOL_LIMIT_REPLY})
+        yield sse_event("done", {})
+    except asyncio.TimeoutError:
+        logger.warning("Timed out in /api/chat/stream for session %s", request.session_id)
+        yield sse_event("error", {"message": "The chat service took too long to respond."})
+    except Exception as e:
+        logger.exception("Error in /api/chat/stream endpoint: %s", e)
+        yield sse_event("error", {"message": "An internal error occurred in the chat service."})
 
 # --- FastAPI App Setup ---
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Builds the timetable indexes, with the trip updates shared so far, before
+    serving; the model follows in the background, and the feeds are watched
+    for updates.
+    """
+    await asyncio.to_thread(get_transit)
+    await asyncio.to_thread(load_shared_trip_updates)
+    tasks = [asyncio.create_task(keep_model_initialized())]
+    if TIMETABLE_FEED:
+        tasks.append(asyncio.create_task(watch_timetable()))
+    if REALTIME_FEED:
+        tasks.append(asyncio.create_task(follow_realtime_feed()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:8080", "http://127.0.0.1:8080"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 # --- API Endpoints ---
 
+def search_routes(origin: str, destination: str, date: str) -> Dict:
+    args = {"origin": origin, "destination": destination, "date": date}
+    direct_routes = tool_cache.call("search_trains", search_trains, {**args, "passengers": 1})
+
+    # Add the date to each direct route found (copies, the cached ones are shared)
+    direct_routes = [{**route, 'date': date} for route in direct_routes]
+
+    alternative_routes = tool_cache.call("find_alternative_routes", find_alternative_routes, args)
+
+    return {
+        "direct_routes": direct_routes,
+        "alternative_routes": alternative_routes
+    }
+
+
+def search_result_tags(date: str, result: Dict) -> List[tuple]:
+    return [("realtime", date), *((route["train_id"], route["date"]) for route in result["direct_routes"])]
+
+
 @app.post("/api/search-routes")
 async def search_routes_endpoint(request: SearchRequest):
     try:
@@ -271,117 +981,347 @@ async def search_routes_endpoint(request: SearchRequest):
         destination = request.destination.strip().lower()
         date = request.date
 
-        direct_routes = search_trains(origin, destination, date)
-        
-        # Add the date to each direct route found
-        for route in direct_routes:
-            route['date'] = date
-
-        alternative_routes = find_alternative_routes(origin, destination, date)
-
-        return {
-            "direct_routes": direct_routes,
-            "alternative_routes": alternative_routes
-        }
+        key = (normalize_city(origin), normalize_city(destination), date)
+        return await asyncio.to_thread(
+            search_cache.get_or_compute, key,
+            lambda: search_routes(*key), functools.partial(search_result_tags, date),
+        )
     except Exception as e:
-        print(f"Error in /api/search-routes: {e}")
+        logger.exception("Error in /api/search-routes: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/book-alternative-route")
-async def book_alternative_route(request: AlternativeBookingRequest):
+async def book_alternative_route(
+    request: AlternativeBookingRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Books a multi-leg route. Clients should send an Idempotency-Key header;
+    a retry with the same key returns the original order instead of booking again.
+    """
+    if any("trainId" not in leg for leg in request.route.get("legs", [])):
+        raise HTTPException(status_code=400, detail="Every route leg needs a trainId.")
+    if len(request.passengersInfo) != request.passengers:
+        raise HTTPException(status_code=400, detail="Passenger details are needed for every passenger.")
     try:
-        order_id = f"TRX{int(datetime.datetime.now().timestamp())}"
-        booking_date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-        new_order = {
-            "id": order_id,
-            "isAlternative": True,
-            "trainName": f"Alternative: {request.route['origin']} - {request.route['destination']}",
-            "origin": request.route['origin'],
-            "destination": request.route['destination'],
-            "date": booking_date,
-            "passengers": request.passengers,
-            "price": request.totalPrice,
-            "status": "confirmed",
-            "legs": [],
-            "passengersInfo": [p.dict() for p in request.passengersInfo]
+        if idempotency_key:
+            return await asyncio.to_thread(
+                idempotency_store.run, f"alternative:{idempotency_key}", request.model_dump(),
+                lambda: create_alternative_order(request),
+            )
+        return await asyncio.to_thread(create_alternative_order, request)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except SeatsUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.exception("Error booking alternative route: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to book alternative route: {e}")
+
+
+def create_alternative_order(request: AlternativeBookingRequest) -> Dict:
+    """
+    Creates and stores the order for a multi-leg route. The seats of all legs
+    are reserved together: if any leg is sold out, nothing is booked and
+    SeatsUnavailable is raised.
+    """
+    legs = request.route['legs']
+    if request.holdId:
+        hold_id = request.holdId
+        held = seat_inventory.seats(hold_id)
+        if set(held) != {(leg['trainId'], leg['date']) for leg in legs} or \
+                any(len(seats) != request.passengers for seats in held.values()):
+            raise SeatsUnavailable("The seat hold does not match the route being booked.")
+        confirmation = seat_inventory.confirm(hold_id)
+    else:
+        hold, confirmation = seat_inventory.reserve([
+            SeatRequest(leg['trainId'], leg['date'], count=request.passengers, seats=request.selectedSeats.get(str(i), []))
+            for i, leg in enumerate(legs)
+        ])
+        hold_id = hold.hold_id
+    try:
+        return store_alternative_order(request, seat_inventory.seats(hold_id))
+    except Exception:
+        # Only undoes the confirmation made above, never another booking's
+        seat_inventory.revert(hold_id, confirmation)
+        raise
+
+
+def store_alternative_order(request: AlternativeBookingRequest, seats: Dict) -> Dict:
+    order_id = order_ids.new_id()
+    booking_date = datetime.datetime.now().strftime("%Y-%m-%d")
+
+    new_order = {
+        "id": order_id,
+        "isAlternative": True,
+        "trainName": f"Alternative: {request.route['origin']} - {request.route['destination']}",
+        "origin": request.route['origin'],
+        "destination": request.route['destination'],
+        "date": booking_date,
+        "passengers": request.passengers,
+        "price": request.totalPrice,
+        "status": "confirmed",
+        "legs": [],
+        "passengersInfo": [p.model_dump() for p in request.passengersInfo]
+    }
+
+    for i, leg in enumerate(request.route['legs']):
+        leg_info = {
+            "trainName": leg['trainName'],
+            "origin": leg['from'],
+            "destination": leg['to'],
+            "date": leg['date'],
+            "time": f"{leg['departureTime']} - {leg['arrivalTime']}",
+            "seats": list(seats.get((leg['trainId'], leg['date']), ())),
         }
+        new_order["legs"].append(leg_info)
 
-        for i, leg in enumerate(request.route['legs']):
-            leg_info = {
-                "trainName": leg['trainName'],
-                "origin": leg['from'],
-                "destination": leg['to'],
-                "date": leg['date'],
-                "time": f"{leg['departureTime']} - {leg['arrivalTime']}",
-                "seats": request.selectedSeats.get(str(i), [])
-            }
-            new_order["legs"].append(leg_info)
+    order_repository.add(new_order)
+    return {"status": "success", "orderId": order_id, "orderDetails": new_order}
+
+
+@app.get("/api/places/autocomplete")
+async def autocomplete_places(q: str = "", limit: int = Query(8, ge=1, le=MAX_AUTOCOMPLETE_SUGGESTIONS)):
+    """Cities and stations matching what the user has typed so far, cities first."""
+    return {"query": q, "suggestions": [place_view(place) for place in get_transit().gazetteer.complete(q, limit)]}
+
+
+@app.get("/api/ready")
+async def readiness():
+    """
+    200 once the timetable indexes are built, 503 before. The chat model is
+    reported but not required: search and booking work without it.
+    """
+    indexes = transit_indexes
+    ready = indexes is not None
+    if model is not None:
+        model_status = "ready"
+    else:
+        model_status = "unavailable" if model_error else "starting"
+    return JSONResponse(
+        {
+            "ready": ready,
+            "timetable": "ready" if ready else "loading",
+            "timetable_version": indexes.version if ready else None,
+            "model": model_status,
+        },
+        status_code=200 if ready else 503,
+    )
+
+
+@app.post("/api/realtime/trip-updates")
+async def post_trip_updates(request: Request):
+    """
+    Takes GTFS-Realtime style trip updates (one, a list, or a feed message;
+    see realtime.py) and applies them on every worker.
+    """
+    try:
+        updates = parse_trip_updates(await request.json(), service_date())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await asyncio.to_thread(share_trip_updates, updates)
+    return {"status": "accepted", "updates": len(updates)}
+
+
+@app.get("/api/realtime/trips")
+async def get_realtime_trips():
+    """Every trip currently running off schedule."""
+    return {"trips": await asyncio.to_thread(lambda: get_transit().realtime.views())}
+
+
+async def realtime_event_stream():
+    """A "snapshot" of the trips off schedule, then "trip-updates" events as they change."""
+    with realtime_events.subscribe() as subscription:
+        yield sse_event("snapshot", {"trips": await asyncio.to_thread(lambda: get_transit().realtime.views())})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), REALTIME_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if subscription.overflowed:
+                # Fell behind and missed updates: start over from the current state
+                subscription.overflowed = False
+                event = sse_event("snapshot", {"trips": await asyncio.to_thread(lambda: get_transit().realtime.views())})
+            yield event
+
+
+@app.get("/api/realtime/stream")
+async def stream_realtime_updates():
+    """Server-sent events with delays and cancellations as they come in."""
+    return StreamingResponse(
+        realtime_event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        booked_orders.append(new_order)
-        return {"status": "success", "orderId": order_id, "orderDetails": new_order}
-    except Exception as e:
-        print(f"Error booking alternative route: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to book alternative route: {e}")
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """Hit, miss and eviction counters of the server-side caches."""
+    return {"search": search_cache.stats(), "tools": tool_cache.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request and chat latencies, in-flight requests and cache counters in the Prometheus text format."""
+    gauges, counters = {"chat_sessions": {(): len(chat_sessions)}}, {}
+    tool_stats = tool_cache.stats()
+    for cache_name, stats in (("search", search_cache.stats()), ("tools", tool_stats["cache"])):
+        for stat, value in stats.items():
+            kind = gauges if stat in ("size", "max_entries") else counters
+            kind.setdefault(f"cache_{stat}", {})[(("cache", cache_name),)] = value
+    for tool, stats in tool_stats["tools"].items():
+        for stat, value in stats.items():
+            counters.setdefault(f"tool_cache_{stat}", {})[(("tool", tool),)] = value
+    if transit_indexes is not None:
+        statuses = {"delayed": 0, "cancelled": 0}
+        for day in transit_indexes.realtime.days.values():
+            for state in day.trips.values():
+                statuses["cancelled" if state.times is None else "delayed"] += 1
+        gauges["realtime_trips"] = {(("status", status),): count for status, count in statuses.items()}
+    gauges["realtime_stream_subscribers"] = {(): len(realtime_events)}
+    counters["realtime_trip_updates"] = {(("outcome", outcome),): count for outcome, count in realtime_counts.items()}
+    return Response(metrics.render(gauges, counters), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/seat-holds")
+async def create_seat_hold(request: SeatHoldRequest):
+    """
+    Holds seats on every leg of a journey (all legs or none) while the user
+    fills in passenger details. Book with the returned holdId before it
+    expires; DELETE the hold if the user backs out.
+    """
+    seat_requests = [SeatRequest(leg.trainId, leg.date, count=leg.passengers, seats=leg.seats) for leg in request.legs]
+    try:
+        hold = await asyncio.to_thread(seat_inventory.hold, seat_requests)
+    except SeatsUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "holdId": hold.hold_id,
+        "expiresIn": SEAT_HOLD_TTL_SECONDS,
+        "legs": [
+            {"trainId": train_id, "date": date, "seats": list(seats)}
+            for (train_id, date), seats in hold.seats.items()
+        ],
+    }
+
+
+@app.delete("/api/seat-holds/{hold_id}")
+async def release_seat_hold(hold_id: str):
+    try:
+        await asyncio.to_thread(seat_inventory.release, hold_id)
+    except SeatsUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "released"}
+
+
+@app.get("/api/trains/{train_id}/seats")
+async def get_train_seats(train_id: str, date: str):
+    """Seat map of a train on a date: the seats already held or sold."""
+    try:
+        taken = await asyncio.to_thread(seat_inventory.taken_seats, train_id, date)
+    except SeatsUnavailable as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"trainId": train_id, "date": date, "available": seat_inventory.available(train_id, date), "taken": taken}
 
 
 @app.get("/api/my-orders")
-async def get_my_orders():
-    return booked_orders
+async def get_my_orders(
+    request: Request,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    is_alternative: Optional[bool] = Query(None, alias="isAlternative"),
+    fields: Literal["full", "summary"] = "full",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_ORDERS_PAGE_SIZE),
+):
+    """
+    Lists orders, newest travel date first. The body stays a plain JSON array;
+    with `limit`, the cursor for the next page comes back in the X-Next-Cursor
+    header (and a Link rel="next" header). Repeated polls with If-None-Match
+    get a 304 while no order has changed.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    version = await asyncio.to_thread(order_repository.version)
+    etag = '"' + hashlib.sha1(f"{version}?{request.url.query}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    query = OrderQuery(status, date_from, date_to, is_alternative)
+    # One extra order tells whether there is a next page
+    page_size = limit + 1 if limit else None
+    orders = await asyncio.to_thread(lambda: list(order_repository.iter_orders(query, after=after, limit=page_size)))
+    if limit and len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(order_key(orders[-1]))
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    if fields == "summary":
+        orders = [summarize_order(order) for order in orders]
+    return JSONResponse(orders, headers=headers)
+
+
+@app.get("/api/my-orders/export")
+async def export_my_orders(
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    is_alternative: Optional[bool] = Query(None, alias="isAlternative"),
+):
+    """Streams every matching order as newline-delimited JSON."""
+    query = OrderQuery(status, date_from, date_to, is_alternative)
+    lines = (json.dumps(order) + "\n" for order in order_repository.iter_orders(query))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @app.post("/api/chat")
 async def chat_endpoint(request: ChatRequest):
     try:
-        if not model:
-            raise HTTPException(status_code=500, detail="GenerativeAI model not initialized.")
-
-        # Build a valid history for the model
-        history = []
-        for message in request.conversation_history:
-            role = "user" if message.get("role") == "user" else "model"
-            content = message.get("content") or ""
-            history.append({"role": role, "parts": [{"text": content}]})
-
-        chat = model.start_chat(history=history)
-        response = chat.send_message(request.message)
-
-        # Loop to handle function calls from the model
-        while response.candidates[0].content.parts[0].function_call:
-            function_call = response.candidates[0].content.parts[0].function_call
-            function_name = function_call.name
-            args = dict(function_call.args)
-
-            if function_name in available_functions:
-                function_to_call = available_functions[function_name]
-                function_response = function_to_call(**args)
-
-                # Send the function's result back to the model
-                response = chat.send_message(
-                    genai.types.Part.from_function_response(
-                        name=function_name,
-                        response=function_response,
-                    ),
-                )
-            else:
-                # Handle case where the model calls a function that doesn't exist
-                response = chat.send_message(
-                     genai.types.Part.from_function_response(
-                        name=function_name,
-                        response={"status": "error", "message": f"Function '{function_name}' is not available."}
-                    ),
-                )
-        
-        # Once the loop is done, the final response is text
-        final_response = response.text
-        return {"content": final_response}
+        if await get_model() is None:
+            raise HTTPException(status_code=503, detail="GenerativeAI model not initialized.")
+
+        pieces = []
+        async with chat_session_turn(request) as chat:
+            async for event, data in chat_turn_events(chat, request.message, request.session_id):
+                if event == "token":
+                    pieces.append(data["text"])
 
+        return {"content": "".join(pieces)}
+
+    except HTTPException:
+        raise
+    except ToolLimitExceeded:
+        return {"content": TOOL_LIMIT_REPLY}
+    except asyncio.TimeoutError:
+        logger.warning("Timed out in /api/chat for session %s", request.session_id)
+        raise HTTPException(status_code=504, detail="The chat service took too long to respond.")
     except Exception as e:
         # Broad exception handler to prevent server crashes
-        print(f"Error in /api/chat endpoint: {e}")
+        logger.exception("Error in /api/chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail="An internal error occurred in the chat service.")
 
 
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Streaming variant of /api/chat: tool progress and answer tokens as server-sent events."""
+    if await get_model() is None:
+        raise HTTPException(status_code=503, detail="GenerativeAI model not initialized.")
+    return StreamingResponse(
+        chat_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/submit-order")
 async def submit_order(order: dict):
     """
@@ -392,105 +1332,144 @@ async def submit_order(order: dict):
     pass
 
 
-# --- Gemini API Configuration ---
-try:
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
-    genai.configure(api_key=GEMINI_API_KEY)
+# --- Gemini Model ---
+# The SDK is imported and the model built only when first needed, so workers
+# start quickly. The startup hook builds it in the background and keeps
+# retrying with backoff while that fails; until then the chat endpoints
+# answer 503 and everything else works.
+GEMINI_MODEL_NAME = "gemini-flash-latest"
+MODEL_INIT_RETRY_SECONDS = 5
+MODEL_INIT_MAX_RETRY_SECONDS = 5 * 60
 
-    # Define the function declarations for the model
-    tools = [
-        {
-            "function_declarations": [
-                {
-                    "name": "search_trains",
-                    "description": "Search for available train tickets between two cities on a specific date.",
-                    "parameters": {
-                        "type": "OBJECT",
-                        "properties": {
-                            "origin": {"type": "STRING", "description": "The departure city, e.g., 'Jakarta'"},
-                            "destination": {"type": "STRING", "description": "The arrival city, e.g., 'Bandung'"},
-                            "date": {"type": "STRING", "description": "The date of travel in YYYY-MM-DD format."},
-                            "passengers": {"type": "INTEGER", "description": "The number of passengers."}
-                        },
-                        "required": ["origin", "destination", "date"]
-                    }
-                },
-                {
-                    "name": "find_alternative_routes",
-                    "description": "Find alternative routes if no direct trains are available.",
-                    "parameters": {
-                        "type": "OBJECT",
-                        "properties": {
-                            "origin": {"type": "STRING", "description": "The departure city."},
-                            "destination": {"type": "STRING", "description": "The arrival city."},
-                            "date": {"type": "STRING", "description": "The date of travel in YYYY-MM-DD format."}
-                        },
-                        "required": ["origin", "destination", "date"]
-                    }
-                },
-                {
-                    "name": "get_order_status",
-                    "description": "Get the current status of a booking order using its Order ID.",
-                    "parameters": {
-                        "type": "OBJECT",
-                        "properties": {
-                            "order_id": {"type": "STRING", "description": "The unique ID of the order, e.g., 'TRX1722784264'"}
-                        },
-                        "required": ["order_id"]
-                    }
-                },
-                {
-                "name": "book_ticket_from_chat",
-                "description": "Books a train ticket after user has selected a train and provided all passenger details.",
+# Define the function declarations for the model
+tools = [
+    {
+        "function_declarations": [
+            {
+                "name": "search_trains",
+                "description": "Search for available train tickets between two cities on a specific date.",
                 "parameters": {
                     "type": "OBJECT",
                     "properties": {
-                        "train_id": {"type": "STRING", "description": "The ID of the selected train, e.g., 'KAI001'."},
+                        "origin": {"type": "STRING", "description": "The departure city, e.g., 'Jakarta'"},
+                        "destination": {"type": "STRING", "description": "The arrival city, e.g., 'Bandung'"},
                         "date": {"type": "STRING", "description": "The date of travel in YYYY-MM-DD format."},
-                        "passengers": {"type": "INTEGER", "description": "The total number of passengers."},
-                        "passengers_info": {
-                            "type": "ARRAY",
-                            "description": "A list of passenger details.",
-                            "items": {
-                                "type": "OBJECT",
-                                "properties": {
-                                    "name": {"type": "STRING", "description": "Full name of the passenger."},
-                                    "idNumber": {"type": "STRING", "description": "ID number of the passenger."}
-                                }
-                            }
-                        }
+                        "passengers": {"type": "INTEGER", "description": "The number of passengers."}
+                    },
+                    "required": ["origin", "destination", "date"]
+                }
+            },
+            {
+                "name": "find_alternative_routes",
+                "description": "Find alternative routes if no direct trains are available.",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "origin": {"type": "STRING", "description": "The departure city."},
+                        "destination": {"type": "STRING", "description": "The arrival city."},
+                        "date": {"type": "STRING", "description": "The date of travel in YYYY-MM-DD format."}
+                    },
+                    "required": ["origin", "destination", "date"]
+                }
+            },
+            {
+                "name": "get_order_status",
+                "description": "Get the current status of a booking order using its Order ID.",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "order_id": {"type": "STRING", "description": "The unique ID of the order, e.g., 'TRX1722784264'"}
                     },
-                    "required": ["train_id", "date", "passengers", "passengers_info"]
+                    "required": ["order_id"]
                 }
+            },
+            {
+            "name": "book_ticket_from_chat",
+            "description": "Books a train ticket after user has selected a train and provided all passenger details.",
+            "parameters": {
+                "type": "OBJECT",
+                "properties": {
+                    "train_id": {"type": "STRING", "description": "The ID of the selected train, e.g., 'KAI001'."},
+                    "date": {"type": "STRING", "description": "The date of travel in YYYY-MM-DD format."},
+                    "passengers": {"type": "INTEGER", "description": "The total number of passengers."},
+                    "passengers_info": {
+                        "type": "ARRAY",
+                        "description": "A list of passenger details.",
+                        "items": {
+                            "type": "OBJECT",
+                            "properties": {
+                                "name": {"type": "STRING", "description": "Full name of the passenger."},
+                                "idNumber": {"type": "STRING", "description": "ID number of the passenger."}
+                            }
+                        }
+                    }
+                },
+                "required": ["train_id", "date", "passengers", "passengers_info"]
             }
-            ]
         }
-    ]
-    
-    SYSTEM_INSTRUCTION = """
-    You are KAI Assistant, a friendly and helpful AI for booking train tickets in Indonesia.
-    **Core Instructions:**
-    1.  **Detect Language**: You MUST detect the user's language (English or Indonesian). Your responses MUST be in the same language.
-    2.  **Be Concise and Friendly**: Keep your responses brief and helpful.
-    3.  **Booking Flow**:
-        a. **Search**: When a user wants to book a ticket, first use the `search_trains` function. If it returns no results, use `find_alternative_routes`.
-        b. **Selection**: After showing the results, ask the user to select one train.
-        c. **Collect Passenger Data**: Once a train is selected, you MUST ask for passenger details ONE BY ONE. Start by asking for the name and ID of "Passenger 1". After you get it, ask for "Passenger 2", and so on, until you have details for the correct number of passengers.
-        d. **Finalize**: After collecting ALL passenger details, you MUST call the `book_ticket_from_chat` function with all the gathered information (train_id, date, passengers, passengers_info).
-        e. **Confirmation**: After calling the booking function, confirm the booking success and provide the Order ID to the user.
-    4.  **Other Tools**: Use `get_order_status` if the user asks about an existing order.
-    """
-    model = genai.GenerativeModel(
-        model_name='gemini-flash-latest', 
+        ]
+    }
+]
+
+SYSTEM_INSTRUCTION = """
+You are KAI Assistant, a friendly and helpful AI for booking train tickets in Indonesia.
+**Core Instructions:**
+1.  **Detect Language**: You MUST detect the user's language (English or Indonesian). Your responses MUST be in the same language.
+2.  **Be Concise and Friendly**: Keep your responses brief and helpful.
+3.  **Booking Flow**:
+    a. **Search**: When a user wants to book a ticket, first use the `search_trains` function. If it returns no results, use `find_alternative_routes`.
+    b. **Selection**: After showing the results, ask the user to select one train.
+    c. **Collect Passenger Data**: Once a train is selected, you MUST ask for passenger details ONE BY ONE. Start by asking for the name and ID of "Passenger 1". After you get it, ask for "Passenger 2", and so on, until you have details for the correct number of passengers.
+    d. **Finalize**: After collecting ALL passenger details, you MUST call the `book_ticket_from_chat` function with all the gathered information (train_id, date, passengers, passengers_info).
+    e. **Confirmation**: After calling the booking function, confirm the booking success and provide the Order ID to the user.
+4.  **Other Tools**: Use `get_order_status` if the user asks about an existing order.
+"""
+
+model = None
+model_error: Optional[str] = None
+model_retry_at = 0.0
+model_retry_delay = MODEL_INIT_RETRY_SECONDS
+model_lock = threading.Lock()
+
+def create_model():
+    import google.generativeai as genai
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(
+        model_name=GEMINI_MODEL_NAME,
         system_instruction=SYSTEM_INSTRUCTION,
         tools=tools
     )
 
-except (ValueError, KeyError) as e:
-    print(f"Error initializing GenerativeAI model: {e}")
-    model = None
+def init_model():
+    """Builds the model unless it exists or the last attempt failed too recently. Returns it or None."""
+    global model, model_error, model_retry_at, model_retry_delay
+    with model_lock:
+        if model is None and time.monotonic() >= model_retry_at:
+            try:
+                model = create_model()
+                model_error = None
+                logger.info("GenerativeAI model initialized")
+            except Exception as e:
+                model_error = str(e)
+                model_retry_at = time.monotonic() + model_retry_delay
+                logger.error("Error initializing GenerativeAI model, retrying in %ss: %s", model_retry_delay, e)
+                model_retry_delay = min(model_retry_delay * 2, MODEL_INIT_MAX_RETRY_SECONDS)
+        return model
+
+async def get_model():
+    """The chat model, or None while it is unavailable."""
+    if model is not None:
+        return model
+    return await asyncio.to_thread(init_model)
+
+async def keep_model_initialized():
+    """Startup task: retries building the model until it succeeds."""
+    while await get_model() is None:
+        await asyncio.sleep(max(model_retry_at - time.monotonic(), 0.1))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,216 @@
+"""
+Latency metrics in the Prometheus text format.
+
+`LatencyHistogram` counts observations in two sets of buckets: the usual
+Prometheus bounds, exported as a histogram so a Prometheus server can
+aggregate them across workers, and fine log-spaced buckets (about 5% wide)
+from which p50/p95/p99 are estimated in process. Observing a value is a
+bisect and two increments, whatever the number of observations.
+
+`Metrics` keeps one histogram per metric name and label set, an in-flight
+gauge per label set, and renders everything for a /metrics endpoint.
+Counts are cumulative since the process started, like any Prometheus
+counter.
+"""
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+PROMETHEUS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Fine buckets for the quantile estimates: 10 microseconds to ~2 minutes,
+# each 5% wider than the one before
+FINE_MIN_SECONDS = 1e-5
+FINE_GROWTH = 1.05
+FINE_BOUNDS = [FINE_MIN_SECONDS * FINE_GROWTH ** i for i in range(336)]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(PROMETHEUS_BUCKETS) + 1)
+        self.fine = [0] * (len(FINE_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        bucket = bisect.bisect_left(PROMETHEUS_BUCKETS, seconds)
+        fine = bisect.bisect_left(FINE_BOUNDS, seconds)
+        with self._lock:
+            self.buckets[bucket] += 1
+            self.fine[fine] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the fine bucket holding the q-th observation (0 when empty)."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, math.ceil(q * self.count))
+            seen = 0
+            for i, count in enumerate(self.fine):
+                seen += count
+                if seen >= rank:
+                    return FINE_BOUNDS[i] if i < len(FINE_BOUNDS) else math.inf
+        return math.inf
+
+    def cumulative_buckets(self) -> List[Tuple[float, int]]:
+        with self._lock:
+            counts = list(self.buckets)
+        total, cumulative = 0, []
+        for bound, count in zip(PROMETHEUS_BUCKETS + (math.inf,), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+def _labels(labels: Mapping[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._histograms: Dict[str, Dict[Labels, LatencyHistogram]] = {}
+        self._in_flight: Dict[Labels, int] = {(): 0}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = _labels(labels)
+        family = self._histograms.get(name)
+        if family is None or key not in family:
+            with self._lock:
+                family = self._histograms.setdefault(name, {})
+                family.setdefault(key, LatencyHistogram())
+        return family[key]
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **labels):
+        """
+        Times the block into the `name` histogram. The block may set
+        `labels["outcome"]` (or any other label) before it ends; an
+        exception records outcome="error".
+        """
+        labels.setdefault("outcome", "ok")
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["outcome"] = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def track_in_flight(self, delta: int, **labels):
+        """Adjusts the in-flight requests gauge by `delta`."""
+        key = _labels(labels)
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + delta
+
+    def render(
+        self,
+        gauges: Optional[Mapping[str, Mapping[Labels, float]]] = None,
+        counters: Optional[Mapping[str, Mapping[Labels, float]]] = None,
+    ) -> str:
+        """
+        The Prometheus text exposition of every histogram, its p50/p95/p99,
+        the in-flight requests and any extra `gauges` and `counters`
+        ({name: {labels: value}}, counted elsewhere, e.g. by the caches).
+        """
+        lines = []
+        with self._lock:
+            families = {name: dict(family) for name, family in self._histograms.items()}
+            in_flight = dict(self._in_flight)
+        for name, family in sorted(families.items()):
+            metric = self.prefix + name
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in sorted(family.items()):
+                for bound, count in histogram.cumulative_buckets():
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+            quantiles = metric.replace("_seconds", "") + "_quantile_seconds"
+            lines.append(f"# TYPE {quantiles} gauge")
+            for labels, histogram in sorted(family.items()):
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    lines.append(f"{quantiles}{_format_labels(labels + (('quantile', str(q)),))} {_format_value(value)}")
+
+        metric = self.prefix + "http_requests_in_flight"
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in sorted(in_flight.items()):
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        for name, values in sorted((gauges or {}).items()):
+            metric = self.prefix + name
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+        for name, values in sorted((counters or {}).items()):
+            metric = self.prefix + name + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request into `http_request_duration_seconds`,
+    labelled with the route template (not the raw path, so ids don't blow up
+    the number of series), method and status. Streaming responses are timed
+    until their last chunk is sent.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.track_in_flight(1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            self.metrics.track_in_flight(-1)
+            route = scope.get("route")
+            self.metrics.observe(
+                "http_request_duration_seconds", time.perf_counter() - started,
+                route=getattr(route, "path", "unmatched"), method=scope["method"], status=status,
+            )
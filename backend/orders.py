@@ -0,0 +1,404 @@
+"""
+Order storage.
+
+`OrderRepository` is the interface the API and the chat tools use. Two
+backends are provided:
+
+* `SQLiteOrderRepository` (default): an embedded SQLite database in WAL
+  mode. Orders are looked up through the primary-key B-tree (O(log n)) and
+  listed through an index on date. Writes are queued and a
+  background writer commits everything that queued up while the previous
+  commit was running as one batch (optionally lingering `batch_interval`
+  seconds for more); `add` waits for the batch holding its order to be
+  committed (group commit), so a confirmed booking is on disk.
+* `InMemoryOrderRepository`: a dict-backed store for tests and local runs.
+* `StateOrderRepository`: orders kept in the shared state backend (e.g.
+  Redis), for workers spread over several machines.
+
+Orders are stored as the same dicts the frontend consumes;
+`migrate_order` fills in fields that older order dicts don't have.
+
+Listings are ordered by travel date, newest first (ties broken by id), and
+are paged with keyset cursors: a page continues strictly after the
+(date, id) of the last order of the previous page, so paging never skips or
+repeats orders while new ones are being added. Every write bumps a version
+number that callers can use to tell whether anything changed.
+"""
+import base64
+import json
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from state import StateBackend
+
+ORDER_DEFAULTS = {
+    "isAlternative": False,
+    "status": "confirmed",
+    "passengersInfo": [],
+    "refundStatus": None,
+    "legs": [],
+}
+
+
+class OrderQuery(NamedTuple):
+    status: Optional[str] = None
+    date_from: Optional[str] = None  # inclusive, YYYY-MM-DD
+    date_to: Optional[str] = None  # inclusive, YYYY-MM-DD
+    is_alternative: Optional[bool] = None
+
+
+OrderKey = Tuple[str, str]  # (date, id), the listing sort key
+
+
+def order_key(order: Dict) -> OrderKey:
+    return (order.get("date") or "", order["id"])
+
+
+def encode_cursor(key: OrderKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> OrderKey:
+    """Decodes a cursor made by `encode_cursor`; raises ValueError if it is malformed."""
+    try:
+        date, order_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return (str(date), str(order_id))
+
+
+# Fields the order list view needs; everything else (passenger details,
+# seats, bookkeeping) is left out of summary listings.
+ORDER_SUMMARY_FIELDS = (
+    "id", "trainId", "trainName", "origin", "destination", "date", "time",
+    "passengers", "status", "price", "refundStatus", "isAlternative",
+)
+ORDER_LEG_SUMMARY_FIELDS = ("trainName", "origin", "destination", "date", "time")
+
+
+def summarize_order(order: Dict) -> Dict:
+    summary = {field: order.get(field) for field in ORDER_SUMMARY_FIELDS}
+    summary["legs"] = [{field: leg.get(field) for field in ORDER_LEG_SUMMARY_FIELDS} for leg in order.get("legs") or []]
+    return summary
+
+
+def migrate_order(order: Dict) -> Dict:
+    """Brings an order dict in the original in-memory shape up to date."""
+    migrated = {**ORDER_DEFAULTS, **order}
+    migrated.setdefault("createdAt", time.time())
+    return migrated
+
+
+class OrderRepository(ABC):
+    @abstractmethod
+    def add(self, order: Dict) -> None:
+        """Stores a new order (or replaces the order with the same id)."""
+
+    def add_many(self, orders: Iterable[Dict]) -> None:
+        for order in orders:
+            self.add(order)
+
+    @abstractmethod
+    def get(self, order_id: str) -> Optional[Dict]:
+        """Returns the order with the given id, or None."""
+
+    @abstractmethod
+    def iter_orders(
+        self, query: OrderQuery = OrderQuery(), after: Optional[OrderKey] = None, limit: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Yields the orders matching `query`, newest travel date first,
+        starting strictly after the `after` key.
+        """
+
+    def list_orders(self) -> List[Dict]:
+        """Returns every order, newest travel date first."""
+        return list(self.iter_orders())
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def version(self) -> int:
+        """A number that changes whenever an order is written."""
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryOrderRepository(OrderRepository):
+    def __init__(self):
+        self._orders: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._version = 0
+
+    def add(self, order: Dict) -> None:
+        order = migrate_order(order)
+        with self._lock:
+            self._orders[order["id"]] = order
+            self._version += 1
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        return self._orders.get(order_id)
+
+    def iter_orders(
+        self, query: OrderQuery = OrderQuery(), after: Optional[OrderKey] = None, limit: Optional[int] = None
+    ) -> Iterator[Dict]:
+        with self._lock:
+            orders = list(self._orders.values())
+        orders.sort(key=order_key, reverse=True)
+        yielded = 0
+        for order in orders:
+            if limit is not None and yielded >= limit:
+                return
+            if after is not None and order_key(order) >= after:
+                continue
+            if _matches(order, query):
+                yielded += 1
+                yield order
+
+    def count(self) -> int:
+        return len(self._orders)
+
+    def version(self) -> int:
+        return self._version
+
+
+class StateOrderRepository(OrderRepository):
+    """Orders in a state backend hash, by id. Listings are sorted in process."""
+
+    ORDERS_KEY = "orders"
+    VERSION_KEY = "orders:version"
+
+    def __init__(self, state: StateBackend):
+        self.state = state
+
+    def add(self, order: Dict) -> None:
+        order = migrate_order(order)
+        self.state.hset(self.ORDERS_KEY, order["id"], json.dumps(order))
+        self.state.incr(self.VERSION_KEY)
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        data = self.state.hget(self.ORDERS_KEY, order_id)
+        return json.loads(data) if data else None
+
+    def iter_orders(
+        self, query: OrderQuery = OrderQuery(), after: Optional[OrderKey] = None, limit: Optional[int] = None
+    ) -> Iterator[Dict]:
+        orders = [json.loads(data) for data in self.state.hvals(self.ORDERS_KEY)]
+        orders.sort(key=order_key, reverse=True)
+        yielded = 0
+        for order in orders:
+            if limit is not None and yielded >= limit:
+                return
+            if after is not None and order_key(order) >= after:
+                continue
+            if _matches(order, query):
+                yielded += 1
+                yield order
+
+    def count(self) -> int:
+        return self.state.hlen(self.ORDERS_KEY)
+
+    def version(self) -> int:
+        return int(self.state.get(self.VERSION_KEY) or 0)
+
+
+def _matches(order: Dict, query: OrderQuery) -> bool:
+    date = order.get("date") or ""
+    return (
+        (query.status is None or order.get("status") == query.status)
+        and (query.date_from is None or date >= query.date_from)
+        and (query.date_to is None or date <= query.date_to)
+        and (query.is_alternative is None or bool(order["isAlternative"]) == query.is_alternative)
+    )
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    date TEXT,
+    status TEXT,
+    is_alternative INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+-- Orders carry no user, so databases from before that was noticed lose
+-- their (user_id, date) index; the column itself is left NULL.
+DROP INDEX IF EXISTS idx_orders_user_date;
+CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (date);
+CREATE TABLE IF NOT EXISTS orders_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO orders_meta (id, version) VALUES (0, 0);
+"""
+
+UPSERT = (
+    "INSERT OR REPLACE INTO orders (id, date, status, is_alternative, created_at, data) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def _order_row(order: Dict) -> tuple:
+    return (
+        order["id"], order.get("date") or "", order.get("status"),
+        int(bool(order["isAlternative"])), order["createdAt"], json.dumps(order),
+    )
+
+
+class _PendingWrite:
+    __slots__ = ("rows", "done", "error")
+
+    def __init__(self, rows: List[tuple]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class SQLiteOrderRepository(OrderRepository):
+    def __init__(self, path: str, batch_size: int = 500, batch_interval: float = 0.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+
+        self._queue: "queue.Queue[Optional[_PendingWrite]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="order-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            size = len(first.rows)
+            deadline = time.monotonic() + self.batch_interval
+            stop = False
+            while size < self.batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        pending = self._queue.get(timeout=remaining)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stop = True
+                    break
+                batch.append(pending)
+                size += len(pending.rows)
+
+            error = None
+            try:
+                connection.execute("BEGIN")
+                connection.executemany(UPSERT, [row for pending in batch for row in pending.rows])
+                connection.execute("UPDATE orders_meta SET version = version + 1 WHERE id = 0")
+                connection.execute("COMMIT")
+            except Exception as e:
+                connection.execute("ROLLBACK")
+                error = e
+            for pending in batch:
+                pending.error = error
+                pending.done.set()
+            if stop:
+                break
+        connection.close()
+
+    def _write(self, rows: List[tuple]):
+        pending = _PendingWrite(rows)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def add(self, order: Dict) -> None:
+        self._write([_order_row(migrate_order(order))])
+
+    def add_many(self, orders: Iterable[Dict]) -> None:
+        self._write([_order_row(migrate_order(order)) for order in orders])
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        with self._read_lock:
+            row = self._reader.execute("SELECT data FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_orders(
+        self, query: OrderQuery = OrderQuery(), after: Optional[OrderKey] = None, limit: Optional[int] = None
+    ) -> Iterator[Dict]:
+        conditions, params = [], []
+        for column, operator, value in (
+            ("status", "=", query.status),
+            ("date", ">=", query.date_from),
+            ("date", "<=", query.date_to),
+            ("is_alternative", "=", None if query.is_alternative is None else int(query.is_alternative)),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        if after is not None:
+            conditions.append("(date, id) < (?, ?)")
+            params.extend(after)
+        sql = "SELECT data FROM orders"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date DESC, id DESC"
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+            with self._read_lock:
+                rows = self._reader.execute(sql, params).fetchall()
+            for row in rows:
+                yield json.loads(row[0])
+            return
+
+        # Unbounded listings (exports) get their own connection so they
+        # don't hold the shared reader while the caller consumes them.
+        connection = self._connect()
+        try:
+            for row in connection.execute(sql, params):
+                yield json.loads(row[0])
+        finally:
+            connection.close()
+
+    def count(self) -> int:
+        with self._read_lock:
+            return self._reader.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    def version(self) -> int:
+        with self._read_lock:
+            return self._reader.execute("SELECT version FROM orders_meta WHERE id = 0").fetchone()[0]
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join()
+        self._reader.close()
+
+
+def create_order_repository(backend: str, path: str, state: Optional[StateBackend] = None) -> OrderRepository:
+    if backend == "memory":
+        return InMemoryOrderRepository()
+    if backend == "sqlite":
+        return SQLiteOrderRepository(path)
+    if backend == "state" and state is not None:
+        return StateOrderRepository(state)
+    raise ValueError(f"Unknown order store backend: {backend}")
@@ -0,0 +1,480 @@
+"""
+Transfer-aware journey planner (multi-criteria Connection Scan).
+
+Every trip in the timetable is split into elementary connections (one per
+pair of consecutive stops). The connections are stored column-wise in
+arrays sorted by departure time, then arrival time.
+
+A query scans the connections minute by minute in departure order. Within a
+minute only connections arriving before the current horizon are looked at
+(found by bisection), and of those only the ones leaving a station that has
+already been reached go through the Python loop. The horizon starts a few
+slack windows after the start and tightens to the earliest arrival plus the
+slack once a journey is found; a search that finds nothing widens it and
+scans again. Labels at intermediate stations are dropped when a journey
+found already beats anything they could still lead to.
+
+Real-time delays and cancellations come in as `ConnectionDelays`: the
+connections running off schedule are skipped in the main scan and scanned
+instead from small per-station side streams sorted by their expected
+departure, so a query stays in departure order and transfers that a delay
+has made impossible are never taken.
+
+Each station holds a bag of Pareto-optimal labels over
+(arrival time, price, number of legs). Labels remember the trip they arrived
+on so that staying on board never pays a transfer, while changing trains
+requires the station's minimum transfer time.
+"""
+import datetime
+import functools
+import heapq
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from timetable import MINUTES_PER_DAY, Timetable, format_duration, format_time
+
+DEFAULT_MIN_TRANSFER_MINUTES = 15
+DEFAULT_MAX_TRANSFERS = 2
+# How long after the earliest arrival the search keeps looking for
+# cheaper or simpler journeys.
+DEFAULT_SEARCH_SLACK_MINUTES = 3 * 60
+# The first scan of a search only looks for journeys arriving within this
+# many times the slack after the start; later scans double the window.
+FIRST_ARRIVAL_WINDOW_SLACKS = 3
+NEVER = 1 << 62
+
+
+class Label(NamedTuple):
+    arrival: int
+    price: int
+    legs: int
+    trip: int
+    connection: int
+    parent: Optional["Label"]
+
+
+class ConnectionDelays(NamedTuple):
+    """
+    The connections of one service day that run off schedule. `moved` maps
+    each of them to its expected (departure, arrival), or to None if it is
+    cancelled; `outgoing` holds, for each station, the sorted
+    (departure, connection, arrival) of the moved connections leaving it.
+    """
+    moved: Mapping[int, Optional[Tuple[int, int]]]
+    outgoing: Mapping[int, Sequence[Tuple[int, int, int]]]
+
+
+class ConnectionIndex:
+    """Column-wise, departure-sorted connections of a timetable."""
+
+    # Arrays that fully describe the index, see `arrays` and `from_arrays`
+    ARRAYS = ("departure", "arrival", "origin", "destination", "trip", "fare", "stop_connection")
+
+    def __init__(self, timetable: Timetable):
+        self.timetable = timetable
+        self.station_codes: List[str] = list(timetable.stations)
+        self.station_ids: Dict[str, int] = {code: i for i, code in enumerate(self.station_codes)}
+
+        columns = timetable.columns
+        trip_stops, stop_station = columns.trip_stops, columns.stop_station
+        stop_departure, stop_arrival, stop_fare = columns.stop_departure, columns.stop_arrival, columns.stop_fare
+        # Station positions in the timetable's station list match station_ids.
+        # A connection is identified by its boarding stop; they are sorted by
+        # (departure, arrival, origin, destination) packed into one int, and
+        # the sort being stable orders ties by trip as the tuples used to.
+        boarding = array("i")
+        stop_trip = array("i")
+        for trip_index in range(len(trip_stops) - 1):
+            boarding.extend(range(trip_stops[trip_index], trip_stops[trip_index + 1] - 1))
+            stop_trip.extend([trip_index] * (trip_stops[trip_index + 1] - trip_stops[trip_index]))
+        time_bits = max(stop_arrival, default=0).bit_length()
+        station_bits = len(self.station_codes).bit_length()
+
+        def key(stop: int) -> int:
+            times = (stop_departure[stop] << time_bits) + stop_arrival[stop + 1]
+            return (((times << station_bits) + stop_station[stop]) << station_bits) + stop_station[stop + 1]
+
+        order = array("i", sorted(boarding, key=key))
+        del boarding
+
+        self.departure = array("i", map(stop_departure.__getitem__, order))
+        self.arrival = array("i", (stop_arrival[stop + 1] for stop in order))
+        self.origin = array("i", map(stop_station.__getitem__, order))
+        self.destination = array("i", (stop_station[stop + 1] for stop in order))
+        self.trip = array("i", map(stop_trip.__getitem__, order))
+        self.fare = array("i", (stop_fare[stop + 1] - stop_fare[stop] for stop in order))
+        # The connection leaving each stop (-1 for the last stop of a trip)
+        self.stop_connection = array("i", [-1]) * len(stop_station)
+        for connection, stop in enumerate(order):
+            self.stop_connection[stop] = connection
+        del order, stop_trip
+
+    @classmethod
+    def from_arrays(cls, timetable: Timetable, arrays: Mapping[str, Sequence[int]]) -> "ConnectionIndex":
+        """Rebuilds an index from the arrays of `arrays()`, e.g. read from a snapshot."""
+        index = cls.__new__(cls)
+        index.timetable = timetable
+        index.station_codes = list(timetable.stations)
+        index.station_ids = {code: i for i, code in enumerate(index.station_codes)}
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def arrays(self) -> Dict[str, Sequence[int]]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    # Computed on first use rather than stored, so loading a snapshot stays cheap
+    @functools.cached_property
+    def min_duration(self) -> int:
+        """The shortest scheduled connection, in minutes."""
+        return min(map(operator.sub, self.arrival, self.departure), default=0)
+
+    @functools.cached_property
+    def min_fare(self) -> int:
+        """The cheapest connection."""
+        return max(min(self.fare, default=0), 0)
+
+    def __len__(self):
+        return len(self.departure)
+
+
+class JourneyPlanner:
+    """Answers Pareto-optimal journey queries over a timetable."""
+
+    def __init__(
+        self,
+        timetable: Timetable,
+        min_transfer_minutes: Optional[Dict[str, int]] = None,
+        default_transfer_minutes: int = DEFAULT_MIN_TRANSFER_MINUTES,
+        connections: Optional[ConnectionIndex] = None,
+    ):
+        self.timetable = timetable
+        self.connections = connections or ConnectionIndex(timetable)
+        overrides = min_transfer_minutes or {}
+        self.transfer_minutes = array("i", (
+            overrides.get(code, default_transfer_minutes) for code in self.connections.station_codes
+        ))
+
+    def _station_ids_in_city(self, city_key: str) -> List[int]:
+        stations = self.timetable.stations_by_city.get(city_key, {})
+        return [self.connections.station_ids[code] for code in stations]
+
+    def search(
+        self,
+        origin_key: str,
+        destination_key: str,
+        start: int = 0,
+        min_transfers: int = 0,
+        max_transfers: int = DEFAULT_MAX_TRANSFERS,
+        slack: int = DEFAULT_SEARCH_SLACK_MINUTES,
+        delays: Optional[ConnectionDelays] = None,
+    ) -> List[Label]:
+        """
+        Returns the Pareto-optimal journeys (as final labels) from any station
+        of the origin city to any station of the destination city, departing
+        at or after `start` minutes on the service day. Journeys with fewer
+        than `min_transfers` transfers are left out of the Pareto set.
+        `delays` are the real-time changes of that day, if any.
+        """
+        targets = set(self._station_ids_in_city(destination_key))
+        sources = [s for s in self._station_ids_in_city(origin_key) if s not in targets]
+        if not sources or not targets:
+            return []
+
+        # Journeys must depart within one service day and arrive within
+        # `slack` minutes of the earliest one. The earliest arrival isn't known
+        # up front, so the scan first stops at a short arrival limit, and only
+        # scans again with a later one if that limit may have cut journeys off.
+        last_arrival = start + 2 * MINUTES_PER_DAY
+        limit = min(start + FIRST_ARRIVAL_WINDOW_SLACKS * slack, last_arrival)
+        while True:
+            results = self._scan(sources, targets, start, min_transfers + 1, max_transfers + 1, slack, limit, delays)
+            if results:
+                if results[0].arrival + slack <= limit or limit == last_arrival:
+                    return results
+                limit = min(results[0].arrival + slack, last_arrival)
+            elif limit == last_arrival:
+                return results
+            else:
+                limit = min(start + 2 * (limit - start), last_arrival)
+
+    def _scan(
+        self,
+        sources: List[int],
+        targets: Set[int],
+        start: int,
+        min_legs: int,
+        max_legs: int,
+        slack: int,
+        arrival_limit: int,
+        delays: Optional[ConnectionDelays],
+    ) -> List[Label]:
+        """The Pareto-optimal journeys arriving by `arrival_limit`, sorted by arrival."""
+        index = self.connections
+        departure, arrival, origin = index.departure, index.arrival, index.origin
+        destination, trip, fare = index.destination, index.trip, index.fare
+        transfer = self.transfer_minutes
+        moved = delays.moved if delays is not None else {}
+        delayed_outgoing = delays.outgoing if delays is not None else {}
+        station_count = len(index.station_codes)
+        # Lower bounds on what a journey still pays after reaching a station
+        # that isn't a destination; delays can shorten a connection, though.
+        min_duration = 0 if moved else index.min_duration
+        min_fare = index.min_fare
+
+        arrival_horizon = arrival_limit
+        horizon = min(start + MINUTES_PER_DAY, arrival_horizon)
+        minute = start
+        bags: List[Optional[List[Label]]] = [None] * station_count
+        # For each station, the earliest departure its labels can change
+        # trains for and the trips they can stay on, so that connections
+        # neither can board are skipped without going through the bag.
+        ready: List[int] = [NEVER] * station_count
+        riding: List[Set[int]] = [set()] * station_count
+        # Stations where some label can board by now, and (minute, station)
+        # for the ones where one will
+        boardable: List[bool] = [False] * station_count
+        activations: list = []
+        results: List[Label] = []
+        # Delayed streams of the stations reached so far:
+        # (departure, arrival, connection, position, end, stream)
+        delayed: list = []
+        delayed_start: Dict[int, int] = {}
+
+        def store(station: int, bag: List[Label]):
+            bags[station] = bag
+            wait = transfer[station]
+            change = ride = NEVER
+            for e in bag:
+                if e.legs < max_legs:
+                    at = e.arrival + wait if e.legs else e.arrival
+                    if at < change:
+                        change = at
+                if e.trip >= 0 and e.arrival < ride:
+                    ride = e.arrival
+            ready[station] = change
+            riding[station] = {e.trip for e in bag}
+            if not boardable[station]:
+                first = min(change, ride)
+                if first <= minute:
+                    boardable[station] = True
+                elif first < NEVER:
+                    heapq.heappush(activations, (first, station))
+
+        def open_delayed(station: int, since: int):
+            # Makes sure every delayed connection leaving `station` at or
+            # after `since` is (or will be) scanned.
+            stream = delayed_outgoing.get(station)
+            if stream:
+                first = bisect_left(stream, (since,))
+                end = delayed_start.get(station, len(stream))
+                if first < end:
+                    dep, c, arr = stream[first]
+                    heapq.heappush(delayed, (dep, arr, c, first, end, stream))
+                    delayed_start[station] = first
+
+        for station in sources:
+            store(station, [Label(start, 0, 0, -1, -1, None)])
+            open_delayed(station, start)
+
+        count = len(departure)
+        position = bisect_left(departure, start)
+        while True:
+            # All connections leaving in the same minute are scanned together.
+            # They are sorted by arrival, so the ones arriving too late to
+            # matter are cut off without looking at them one by one.
+            minute = departure[position] if position < count else horizon + 1
+            if delayed and delayed[0][0] < minute:
+                minute = delayed[0][0]
+            if minute > horizon:
+                break
+            while activations and activations[0][0] <= minute:
+                boardable[heapq.heappop(activations)[1]] = True
+            block_end = bisect_right(departure, minute, position)
+            end = bisect_right(arrival, arrival_horizon, position, block_end)
+            # Connections from stations where no label can board are dropped
+            # before the loop, lazily so that stations reached within this
+            # minute count.
+            leaving = compress(range(position, end), map(boardable.__getitem__, origin[position:end]))
+            position = block_end
+            if moved:
+                # Connections running off schedule come from the delayed
+                # streams, if at all, merged in by their expected arrival.
+                leaving = (c for c in leaving if c not in moved)
+                if delayed and delayed[0][0] == minute:
+                    expected = []
+                    while delayed and delayed[0][0] == minute:
+                        _, _, c, at, stream_end, stream = heapq.heappop(delayed)
+                        expected.append(c)
+                        if at + 1 < stream_end:
+                            following_dep, following, following_arr = stream[at + 1]
+                            heapq.heappush(delayed, (following_dep, following_arr, following, at + 1, stream_end, stream))
+                    leaving = heapq.merge(
+                        leaving, expected, key=lambda c: moved[c][1] if c in moved else arrival[c],
+                    )
+
+            for c in leaving:
+                arr = moved[c][1] if moved and c in moved else arrival[c]
+                if arr > arrival_horizon:
+                    continue
+                station = origin[c]
+                t = trip[c]
+                if minute < ready[station] and t not in riding[station]:
+                    continue
+                to = destination[c]
+                if to in targets:
+                    reach, extra = arr, 0
+                else:
+                    reach, extra = arr + min_duration, min_fare
+                    if reach > arrival_horizon:
+                        continue
+                cost = fare[c]
+
+                # Only the cheapest boardable label for each resulting leg count
+                # can produce a useful candidate.
+                best: Dict[int, Label] = {}
+                wait = transfer[station]
+                for label in bags[station]:
+                    if label.trip == t:
+                        if label.arrival > minute:
+                            continue
+                        legs = label.legs
+                    else:
+                        if label.legs >= max_legs or label.arrival + (wait if label.legs else 0) > minute:
+                            continue
+                        legs = label.legs + 1
+                    current = best.get(legs)
+                    if current is None or label.price < current.price:
+                        best[legs] = label
+
+                for legs, label in best.items():
+                    price = label.price + cost
+                    # The journeys a candidate leads to arrive by `reach` at the
+                    # earliest, cost `extra` more and have at least `min_legs` legs
+                    final_price = price + extra
+                    final_legs = legs if legs > min_legs else min_legs
+                    dominated = False
+                    for r in results:
+                        if r.arrival <= reach and r.price <= final_price and r.legs <= final_legs:
+                            dominated = True
+                            break
+                    if dominated:
+                        continue
+                    candidate = Label(arr, price, legs, t, c, label)
+
+                    if to in targets:
+                        if legs < min_legs:
+                            continue
+                        results = [r for r in results if not (arr <= r.arrival and price <= r.price and legs <= r.legs)]
+                        results.append(candidate)
+                        arrival_horizon = min(arrival_horizon, arr + slack)
+                        horizon = min(horizon, arrival_horizon)
+                        continue
+
+                    to_bag = bags[to]
+                    if to_bag is None:
+                        store(to, [candidate])
+                        open_delayed(to, arr)
+                        continue
+                    tr = transfer[to]
+                    if any(_dominates(e, candidate, tr, min_legs) for e in to_bag):
+                        continue
+                    to_bag = [e for e in to_bag if not _dominates(candidate, e, tr, min_legs)]
+                    to_bag.append(candidate)
+                    store(to, to_bag)
+                    open_delayed(to, arr)
+
+        # Journeys found before the earliest one may arrive after its slack
+        results = [r for r in results if r.arrival <= arrival_horizon]
+        results.sort(key=lambda r: (r.arrival, r.price, r.legs))
+        return results
+
+    def journey_view(
+        self, label: Label, origin: str, destination: str, date: str, delays: Optional[ConnectionDelays] = None,
+    ) -> Dict:
+        """
+        Builds the alternative-route dict shape the frontend consumes, with
+        the expected times if the journey was found with `delays`.
+        """
+        index = self.connections
+        moved = delays.moved if delays is not None else {}
+
+        def times(c: int) -> Tuple[int, int]:
+            return moved.get(c) or (index.departure[c], index.arrival[c])
+        stations = self.timetable.stations
+        chain = []
+        while label.parent is not None:
+            chain.append(label.connection)
+            label = label.parent
+        chain.reverse()
+
+        # Merge consecutive connections on the same trip into one leg.
+        segments: List[List[int]] = []
+        for c in chain:
+            if segments and index.trip[segments[-1][-1]] == index.trip[c]:
+                segments[-1].append(c)
+            else:
+                segments.append([c])
+
+        travel_date = _parse_date(date)
+        legs = []
+        for segment in segments:
+            first, last = segment[0], segment[-1]
+            trip = self.timetable.trips[index.trip[first]]
+            leg_departure, leg_arrival = times(first)[0], times(last)[1]
+            legs.append({
+                "trainId": trip.train_id,
+                "from": stations[index.station_codes[index.origin[first]]].city,
+                "to": stations[index.station_codes[index.destination[last]]].city,
+                "trainName": trip.train_name,
+                "category": trip.train_type,
+                "duration": format_duration(leg_arrival - leg_departure),
+                "price": sum(index.fare[c] for c in segment),
+                "departureTime": format_time(leg_departure),
+                "arrivalTime": format_time(leg_arrival),
+                "date": _shift_date(travel_date, date, leg_departure // MINUTES_PER_DAY),
+                "delayMinutes": leg_departure - index.departure[first],
+            })
+
+        total_minutes = times(chain[-1])[1] - times(chain[0])[0]
+        return {
+            "route": " → ".join([legs[0]["from"]] + [leg["to"] for leg in legs]),
+            "totalDuration": format_duration(total_minutes),
+            "transfers": len(legs) - 1,
+            "totalPrice": sum(leg["price"] for leg in legs),
+            "legs": legs,
+            "origin": origin.title(),
+            "destination": destination.title(),
+        }
+
+
+def _dominates(a: Label, b: Label, transfer: int, min_legs: int = 1) -> bool:
+    """
+    True if label `a` makes label `b` useless at the same station. Staying
+    on board is only free for the trip a label arrived on, so a label on a
+    different trip must be early enough to make the transfer, and needs a
+    spare leg in case `b` would have continued without changing trains.
+    Fewer legs only help once `a` has `min_legs`: below that, the journeys
+    `a` leads to may be left out while the same ones through `b` are not.
+    """
+    if a.price > b.price or a.legs < min(b.legs, min_legs):
+        return False
+    if a.trip == b.trip:
+        return a.arrival <= b.arrival and a.legs <= b.legs
+    return a.arrival + transfer <= b.arrival and a.legs < b.legs
+
+
+def _parse_date(date: str) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        return None
+
+
+def _shift_date(travel_date: Optional[datetime.date], date: str, days: int) -> str:
+    if travel_date is None or days == 0:
+        return date
+    return (travel_date + datetime.timedelta(days=days)).isoformat()
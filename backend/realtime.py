@@ -0,0 +1,430 @@
+"""
+Real-time trip updates: delays and cancellations.
+
+Updates follow GTFS-Realtime's TripUpdate, in its JSON form, one per line
+or several in a FeedMessage:
+
+    {"trip": {"trip_id": "KAI001", "start_date": "20240815"},
+     "delay": 2700,
+     "stop_time_update": [{"stop_id": "CN", "arrival": {"delay": 2700}, "departure": {"delay": 3000}}],
+     "reason": "Technical maintenance at Cirebon",
+     "timestamp": 1723700000}
+    {"trip": {"trip_id": "KAI002", "start_date": "20240815", "schedule_relationship": "CANCELED"}}
+
+Field names may be snake_case or camelCase. Delays are in seconds and
+rounded to whole minutes, the timetable's resolution. `delay` applies from
+the first stop; a stop time update's delay applies from its stop (a
+station code) until the next one. An update without `start_date` is for
+today. `reason` is an extension of ours. An update replaces everything
+known before about its trip on that date, so one without delays puts the
+trip back on schedule; updates older than the one applied are ignored.
+
+`RealtimeIndex` applies updates on top of a timetable and its planner
+index. For every service date with updates it keeps a `DayOverlay`: the
+expected times of the trips running off schedule, and the
+`ConnectionDelays` the planner searches with. Overlays are never changed
+once published: a batch of updates builds new ones from the old (touching
+only the updated trips) and swaps them in, so a search always sees one
+consistent state.
+
+`Broadcaster` passes applied changes on to asyncio subscribers, e.g. the
+server-sent event streams, from whatever thread applied them.
+"""
+import asyncio
+import contextlib
+import datetime
+import functools
+import os
+import threading
+from bisect import insort
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from planner import ConnectionDelays, ConnectionIndex
+from timetable import Timetable, format_time
+
+
+class StopDelay(NamedTuple):
+    station: str
+    arrival: Optional[int]  # minutes
+    departure: Optional[int]
+
+
+class TripUpdate(NamedTuple):
+    trip_id: str
+    date: str  # service date, YYYY-MM-DD
+    cancelled: bool = False
+    delay: int = 0  # minutes, from the first stop
+    stop_delays: Tuple[StopDelay, ...] = ()
+    reason: str = ""
+    timestamp: int = 0
+
+    def as_json(self) -> Dict:
+        """The update in the form `parse_trip_update` reads."""
+        trip = {"trip_id": self.trip_id, "start_date": self.date.replace("-", "")}
+        if self.cancelled:
+            trip["schedule_relationship"] = "CANCELED"
+        stop_time_updates = []
+        for stop in self.stop_delays:
+            stop_time_update: Dict[str, Any] = {"stop_id": stop.station}
+            if stop.arrival is not None:
+                stop_time_update["arrival"] = {"delay": stop.arrival * 60}
+            if stop.departure is not None:
+                stop_time_update["departure"] = {"delay": stop.departure * 60}
+            stop_time_updates.append(stop_time_update)
+        return {
+            "trip": trip, "delay": self.delay * 60, "stop_time_update": stop_time_updates,
+            "reason": self.reason, "timestamp": self.timestamp,
+        }
+
+
+class TripState(NamedTuple):
+    update: TripUpdate
+    # Expected (arrival, departure) of every stop; None if cancelled
+    times: Optional[Tuple[Tuple[int, int], ...]]
+
+
+class DayOverlay(NamedTuple):
+    trips: Mapping[int, TripState]  # trip position in the timetable -> state
+    connections: ConnectionDelays
+
+
+@functools.lru_cache(maxsize=None)
+def _camel_case(name: str) -> str:
+    head, *rest = name.split("_")
+    return head + "".join(part.title() for part in rest)
+
+
+@functools.lru_cache(maxsize=64)
+def _service_date(start_date: str) -> str:
+    return datetime.datetime.strptime(start_date.replace("-", ""), "%Y%m%d").date().isoformat()
+
+
+def _field(data: Mapping, name: str, default=None):
+    if name in data:
+        return data[name]
+    return data.get(_camel_case(name), default)
+
+
+def _minutes(seconds) -> int:
+    return round(int(seconds) / 60)
+
+
+def _event_delay(stop_time_update: Mapping, name: str) -> Optional[int]:
+    event = _field(stop_time_update, name)
+    if not event or _field(event, "delay") is None:
+        return None
+    return _minutes(_field(event, "delay"))
+
+
+def parse_trip_update(data: Mapping, today: str) -> TripUpdate:
+    """Reads one trip update (see the module docstring). Raises ValueError if it is malformed."""
+    try:
+        trip = _field(data, "trip") or data
+        trip_id = _field(trip, "trip_id")
+        if not trip_id:
+            raise ValueError("trip update without a trip_id")
+        start_date = _field(trip, "start_date")
+        date = today
+        if start_date:
+            date = _service_date(start_date)
+        stop_delays = tuple(
+            StopDelay(str(_field(stop, "stop_id")), _event_delay(stop, "arrival"), _event_delay(stop, "departure"))
+            for stop in _field(data, "stop_time_update", ())
+        )
+        return TripUpdate(
+            trip_id=str(trip_id),
+            date=date,
+            cancelled=_field(trip, "schedule_relationship") in ("CANCELED", "CANCELLED", 3),
+            delay=_minutes(_field(data, "delay") or 0),
+            stop_delays=stop_delays,
+            reason=str(_field(data, "reason") or ""),
+            timestamp=int(_field(data, "timestamp") or 0),
+        )
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"malformed trip update: {e}") from e
+
+
+def parse_trip_updates(data: Any, today: str) -> List[TripUpdate]:
+    """Reads a trip update, a feed entity holding one, or a feed message or list of them."""
+    if isinstance(data, list):
+        entities = data
+    elif isinstance(data, dict) and "entity" in data:
+        entities = data["entity"]
+    else:
+        entities = [data]
+    updates = []
+    for entity in entities:
+        if not isinstance(entity, dict):
+            raise ValueError("trip updates must be JSON objects")
+        update = _field(entity, "trip_update")
+        if update is None and "trip" not in entity and "trip_id" not in entity and "tripId" not in entity:
+            continue  # an entity of another kind, e.g. an alert
+        updates.append(parse_trip_update(update or entity, today))
+    return updates
+
+
+class TripUpdateLog:
+    """The latest update of every trip and date, kept to rebuild indexes after a timetable reload."""
+
+    def __init__(self):
+        self._latest: Dict[Tuple[str, str], TripUpdate] = {}
+
+    def add(self, updates: Iterable[TripUpdate]) -> List[TripUpdate]:
+        """Records `updates` and returns the ones that change something, at most one per trip and date."""
+        fresh: Dict[Tuple[str, str], TripUpdate] = {}
+        for update in updates:
+            key = (update.trip_id, update.date)
+            current = self._latest.get(key)
+            if current is not None and (update == current or update.timestamp < current.timestamp):
+                continue
+            self._latest[key] = fresh[key] = update
+        return list(fresh.values())
+
+    def latest(self) -> List[TripUpdate]:
+        return list(self._latest.values())
+
+    def prune(self, before: str) -> List[TripUpdate]:
+        """Forgets the updates of service dates before `before`, and returns them."""
+        return [self._latest.pop(key) for key in [key for key in self._latest if key[1] < before]]
+
+
+class RealtimeIndex:
+    """Trip updates applied on top of one timetable and its planner index."""
+
+    def __init__(self, timetable: Timetable, connections: ConnectionIndex):
+        self.timetable = timetable
+        self.connections = connections
+        self.days: Dict[str, DayOverlay] = {}
+        # Train id -> trip, for the trips updated so far (trips_by_id is a binary search)
+        self._trips: Dict[str, int] = {}
+
+    def day(self, date: str) -> Optional[DayOverlay]:
+        return self.days.get(date)
+
+    def apply(self, updates: Iterable[TripUpdate]) -> List[Tuple[TripUpdate, Optional[TripState]]]:
+        """
+        Applies `updates` and returns each with the trip's new state (None
+        once back on schedule). Updates of trips not in the timetable are
+        left out. Not thread-safe: one thread applies at a time.
+        """
+        latest = {(update.trip_id, update.date): update for update in updates}
+        by_date: Dict[str, List[TripUpdate]] = {}
+        for update in latest.values():
+            by_date.setdefault(update.date, []).append(update)
+        days = dict(self.days)
+        applied = []
+        for date, day_updates in by_date.items():
+            overlay, changes = self._apply_day(days.get(date), day_updates)
+            if overlay.trips:
+                days[date] = overlay
+            else:
+                days.pop(date, None)
+            applied.extend(changes)
+        self.days = days
+        return applied
+
+    def prune(self, before: str):
+        """Drops the overlays of service dates before `before`."""
+        self.days = {date: overlay for date, overlay in self.days.items() if date >= before}
+
+    def _apply_day(self, overlay: Optional[DayOverlay], updates: List[TripUpdate]):
+        index = self.connections
+        trip_stops = self.timetable.columns.trip_stops
+        trips = dict(overlay.trips) if overlay else {}
+        moved = dict(overlay.connections.moved) if overlay else {}
+        outgoing = dict(overlay.connections.outgoing) if overlay else {}
+        removed: Set[int] = set()
+        added: Dict[int, List[Tuple[int, int, int]]] = {}
+        changes = []
+        for update in updates:
+            trip = self._trip(update.trip_id)
+            if trip is None:
+                continue
+            connections = [index.stop_connection[stop] for stop in range(trip_stops[trip], trip_stops[trip + 1] - 1)]
+            if trip in trips:
+                for c in connections:
+                    if moved.pop(c, False) is not False:
+                        removed.add(c)
+            state = self._trip_state(trip, update)
+            changes.append((update, state))
+            if state is None:
+                trips.pop(trip, None)
+                continue
+            trips[trip] = state
+            for position, c in enumerate(connections):
+                if state.times is None:
+                    moved[c] = None
+                    continue
+                expected = (state.times[position][1], state.times[position + 1][0])
+                if expected != (index.departure[c], index.arrival[c]):
+                    moved[c] = expected
+                    added.setdefault(index.origin[c], []).append((expected[0], c, expected[1]))
+        # Rebuild the delayed streams of the stations whose connections changed
+        for c in removed:
+            station = index.origin[c]
+            if station not in added:
+                added[station] = []
+        for station, entries in added.items():
+            stream = [entry for entry in outgoing.get(station, ()) if entry[1] not in removed]
+            for entry in entries:
+                insort(stream, entry)
+            if stream:
+                outgoing[station] = tuple(stream)
+            else:
+                outgoing.pop(station, None)
+        return DayOverlay(trips, ConnectionDelays(moved, outgoing)), changes
+
+    def _trip(self, trip_id: str) -> Optional[int]:
+        trip = self._trips.get(trip_id)
+        if trip is None:
+            trip = self.timetable.trips_by_id.get(trip_id)
+            if trip is not None:
+                self._trips[trip_id] = trip
+        return trip
+
+    def _trip_state(self, trip: int, update: TripUpdate) -> Optional[TripState]:
+        if update.cancelled:
+            return TripState(update, None)
+        c = self.timetable.columns
+        by_station = {stop.station: stop for stop in update.stop_delays}
+        delay = update.delay
+        times = []
+        previous = None
+        for stop in range(c.trip_stops[trip], c.trip_stops[trip + 1]):
+            arrival_delay = departure_delay = delay
+            stop_delay = by_station.get(c.stations[c.stop_station[stop]].code)
+            if stop_delay is not None:
+                arrival_delay = stop_delay.arrival if stop_delay.arrival is not None else stop_delay.departure
+                if arrival_delay is None:
+                    arrival_delay = delay
+                departure_delay = stop_delay.departure if stop_delay.departure is not None else arrival_delay
+                delay = departure_delay
+            # A train neither leaves before it arrives nor arrives before it left
+            arrival = max(c.stop_arrival[stop] + arrival_delay, previous if previous is not None else -1)
+            departure = max(c.stop_departure[stop] + departure_delay, arrival)
+            times.append((arrival, departure))
+            previous = departure
+        scheduled = [(c.stop_arrival[stop], c.stop_departure[stop]) for stop in range(c.trip_stops[trip], c.trip_stops[trip + 1])]
+        if times == scheduled:
+            return None
+        return TripState(update, tuple(times))
+
+    def trip_view(self, update: TripUpdate, state: Optional[TripState]) -> Optional[Dict]:
+        """A trip's real-time status in the shape the frontend consumes; None for unknown trips."""
+        trip = self.timetable.trips_by_id.get(update.trip_id)
+        if trip is None:
+            return None
+        c = self.timetable.columns
+        stops = []
+        for position, stop in enumerate(range(c.trip_stops[trip], c.trip_stops[trip + 1])):
+            station = c.stations[c.stop_station[stop]]
+            expected = state.times[position] if state is not None and state.times is not None else None
+            stops.append({
+                "station_code": station.code,
+                "station_name": station.name,
+                "city": station.city,
+                "scheduled_arrival": format_time(c.stop_arrival[stop]),
+                "scheduled_departure": format_time(c.stop_departure[stop]),
+                "expected_arrival": format_time(expected[0]) if expected else None,
+                "expected_departure": format_time(expected[1]) if expected else None,
+            })
+        if state is None:
+            status, delay = "On Time", 0
+        elif state.times is None:
+            status, delay = "Cancelled", 0
+        else:
+            status, delay = "Delayed", state.times[-1][0] - c.stop_arrival[c.trip_stops[trip + 1] - 1]
+        return {
+            "train_id": update.trip_id,
+            "train_name": c.trip_names[trip],
+            "date": update.date,
+            "status": status,
+            # Expected lateness at the last stop
+            "delay_minutes": delay,
+            "reason": update.reason,
+            "updated_at": update.timestamp,
+            "route": f"{stops[0]['city']} → {stops[-1]['city']}",
+            "stops": stops,
+        }
+
+    def views(self) -> List[Dict]:
+        """The status of every trip running off schedule, by date and train."""
+        views = []
+        for date in sorted(self.days):
+            for state in self.days[date].trips.values():
+                views.append(self.trip_view(state.update, state))
+        views.sort(key=lambda view: (view["date"], view["train_id"]))
+        return views
+
+
+def read_new_lines(path: str, position: Tuple[Optional[int], int], max_bytes: int = 1 << 20):
+    """
+    The complete lines appended to `path` since `position` (as returned by
+    the previous call, or (None, 0) to start), and the new position. Starts
+    over when the file is replaced or truncated.
+    """
+    inode, offset = position
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != inode or stat.st_size < offset:
+                inode, offset = stat.st_ino, 0
+            f.seek(offset)
+            data = f.read(max_bytes)
+    except FileNotFoundError:
+        return [], (None, 0)
+    end = data.rfind(b"\n") + 1
+    lines = data[:end].decode("utf-8", errors="replace").splitlines()
+    return [line for line in lines if line.strip()], (inode, offset + end)
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_queued: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(max_queued)
+        # Set when messages were dropped because the subscriber fell behind
+        self.overflowed = False
+
+    def _deliver(self, message):
+        if self.queue.full():
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broadcaster:
+    """Passes messages published from any thread on to every subscriber's event loop."""
+
+    def __init__(self, max_queued: int = 256):
+        self.max_queued = max_queued
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        """Subscribes for the duration of the block; call from the subscriber's event loop."""
+        subscription = Subscription(asyncio.get_running_loop(), self.max_queued)
+        with self._lock:
+            self._subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscription)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, message)
+            except RuntimeError:
+                # The subscriber's loop is closed
+                pass
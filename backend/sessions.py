@@ -0,0 +1,213 @@
+"""
+Server-side chat sessions.
+
+Each `session_id` keeps its model chat object (and therefore its history)
+on the server, so clients only send the new message. Sessions are evicted
+when they have been idle for longer than the TTL, when there are more than
+`max_sessions` of them, or when the approximate size of all histories goes
+over `max_total_chars`; the least recently used sessions go first.
+
+With a state backend, every finished turn also saves the history there under
+a revision number, and turns of one session take a lock in the backend. A
+worker whose chat object is behind the stored revision (because the previous
+turn went to another worker, or its copy was evicted) rebuilds the chat from
+the stored history.
+"""
+import asyncio
+import contextlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from state import StateBackend, dump, load
+
+
+class StoredHistory(NamedTuple):
+    revision: int
+    history: list
+
+
+class ChatSession:
+    __slots__ = ("chat", "last_used", "size", "history_length", "lock", "revision")
+
+    def __init__(self, chat: Any):
+        self.chat = chat
+        self.last_used = time.monotonic()
+        self.size = 0
+        self.history_length = 0
+        self.lock = asyncio.Lock()
+        self.revision = 0
+
+
+class ChatSessionStore:
+    def __init__(
+        self,
+        ttl_seconds: float = 1800,
+        max_sessions: int = 1000,
+        max_total_chars: int = 50_000_000,
+        state: Optional[StateBackend] = None,
+        turn_lock_seconds: float = 300,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_total_chars = max_total_chars
+        self.total_chars = 0
+        self.state = state
+        self.turn_lock_seconds = turn_lock_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        self._evict_expired()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def get_or_create(self, session_id: str, create_chat: Callable[[], Any]) -> ChatSession:
+        session = self.get(session_id)
+        if session is None:
+            session = ChatSession(create_chat())
+            self._sessions[session_id] = session
+            self.update_size(session)
+            self._evict_over_capacity()
+        return session
+
+    def replace_chat(self, session: ChatSession, chat: Any):
+        """Swaps in a new chat object, e.g. after its history was summarized."""
+        session.chat = chat
+        self.total_chars -= session.size
+        session.size = 0
+        session.history_length = 0
+        self.update_size(session)
+
+    def update_size(self, session: ChatSession):
+        """Accounts for the history entries added since the last update."""
+        history = session.chat.history
+        added = sum(len(str(content)) for content in history[session.history_length:])
+        session.history_length = len(history)
+        session.size += added
+        self.total_chars += added
+        self._evict_over_capacity()
+
+    def load_history(self, session_id: str) -> Optional[StoredHistory]:
+        if self.state is None:
+            return None
+        stored = load(self.state.get(f"chat:{session_id}"))
+        return StoredHistory(stored["revision"], stored["history"]) if stored else None
+
+    def save_history(self, session_id: str, session: ChatSession):
+        """Stores the session's history as its next revision."""
+        session.revision += 1
+        if self.state is not None:
+            history = serialize_history(session.chat.history)
+            self.state.set(
+                f"chat:{session_id}", dump({"revision": session.revision, "history": history}), ttl=self.ttl_seconds
+            )
+
+    @contextlib.asynccontextmanager
+    async def turn_lock(self, session_id: str, poll_interval: float = 0.05):
+        """Keeps other workers out of the session for the duration of a turn."""
+        if self.state is None:
+            yield
+            return
+        token = secrets.token_hex(8)
+        name = f"chat:{session_id}"
+        while not await asyncio.to_thread(self.state.acquire, name, token, self.turn_lock_seconds):
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.state.release, name, token)
+
+    def discard(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.total_chars -= session.size
+
+    def _evict_expired(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > deadline:
+                break
+            self.discard(session_id)
+
+    def _evict_over_capacity(self):
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self.total_chars > self.max_total_chars
+        ):
+            self.discard(next(iter(self._sessions)))
+
+
+def summarize_history(history: list, keep_last: int, max_chars_per_message: int = 200) -> list:
+    """
+    Folds everything but the last `keep_last` history entries into a single
+    plain-text summary. Tool call payloads are dropped from the summary, which
+    is where most of the prompt tokens of a long booking dialog go.
+
+    The kept tail always starts at a user text message so the roles still
+    alternate correctly. Returns the history unchanged if there is nothing
+    to fold.
+    """
+    cut = None
+    for index in range(max(len(history) - keep_last, 0), len(history)):
+        if _role(history[index]) == "user" and _text(history[index]):
+            cut = index
+            break
+    if not cut:
+        return history
+
+    lines = []
+    for content in history[:cut]:
+        text = _text(content)
+        if text:
+            lines.append(f"{_role(content)}: {text[:max_chars_per_message]}")
+    summary = "Summary of the earlier conversation:\n" + "\n".join(lines)
+    return [
+        {"role": "user", "parts": [{"text": summary}]},
+        {"role": "model", "parts": [{"text": "Understood, I'll continue from there."}]},
+        *history[cut:],
+    ]
+
+
+def serialize_history(history: list) -> List[dict]:
+    """Converts model history entries (SDK messages, dicts or plain text) to JSON-ready dicts."""
+    serialized = []
+    for content in history:
+        if isinstance(content, dict):
+            serialized.append(content)
+        elif isinstance(content, str):
+            serialized.append({"role": "user", "parts": [{"text": content}]})
+        elif isinstance(content, list):
+            # A list of parts sent as one user message, e.g. tool results
+            serialized.append({"role": "user", "parts": [_part_dict(part) for part in content]})
+        else:
+            serialized.append(type(content).to_dict(content))
+    return serialized
+
+
+def _part_dict(part) -> dict:
+    if isinstance(part, dict):
+        return part
+    if isinstance(part, str):
+        return {"text": part}
+    return type(part).to_dict(part)
+
+
+def _role(content) -> str:
+    return content["role"] if isinstance(content, dict) else content.role
+
+
+def _text(content) -> str:
+    parts = content["parts"] if isinstance(content, dict) else content.parts
+    texts = []
+    for part in parts:
+        text = part.get("text") if isinstance(part, dict) else getattr(part, "text", "")
+        if text:
+            texts.append(text)
+    return " ".join(texts)
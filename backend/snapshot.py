@@ -0,0 +1,129 @@
+"""
+Timetable snapshots.
+
+A snapshot holds a timetable's columns and its journey planner index in a
+single file that is mapped into memory rather than read: loading one costs
+a few milliseconds whatever its size, and every worker on a machine shares
+the same pages. Workers therefore start (and pick up a new timetable)
+without parsing the feed again.
+
+Layout: a magic line, the length of a JSON header, the header (stations,
+train types, metadata and where each column lives), then the columns as
+raw native-endian integers, each starting on an 8-byte boundary. String
+columns are stored as their UTF-8 bytes plus an array of end offsets.
+
+Snapshots are written to a temporary file and renamed into place, so a
+reader sees either the old snapshot or the new one. Readers that mapped the
+old file keep using it until they let go of it.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, NamedTuple
+
+from planner import ConnectionIndex
+from timetable import INT_COLUMNS, STRING_COLUMNS, Station, StringColumn, Timetable, TimetableColumns
+
+MAGIC = b"apaaja-timetable-snapshot 3\n"
+ALIGNMENT = 8
+
+
+class SnapshotError(Exception):
+    """Raised when a file is not a snapshot this build can read."""
+
+
+class Snapshot(NamedTuple):
+    timetable: Timetable
+    connections: ConnectionIndex
+    meta: Dict[str, Any]
+
+
+def write_snapshot(path: str, timetable: Timetable, connections: ConnectionIndex, meta: Dict[str, Any]):
+    """Writes the timetable, its planner index and `meta` (JSON-serializable) to `path`."""
+    columns = timetable.columns
+    blocks = []  # (name, typecode, bytes-like)
+    for name in INT_COLUMNS:
+        blocks.append((name, "i", _int_bytes(getattr(columns, name), "i")))
+    for name in STRING_COLUMNS:
+        strings = getattr(columns, name)
+        blocks.append((f"{name}.data", "B", strings.data))
+        blocks.append((f"{name}.ends", "q", _int_bytes(strings.ends, "q")))
+    for name, values in connections.arrays().items():
+        blocks.append((f"connections.{name}", "i", _int_bytes(values, "i")))
+
+    layout, offset = {}, 0
+    for name, typecode, data in blocks:
+        layout[name] = {"typecode": typecode, "offset": offset, "size": len(data)}
+        offset = _aligned(offset + len(data))
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "stations": [list(station) for station in columns.stations],
+        "train_types": columns.train_types,
+        "columns": layout,
+        "meta": meta,
+    }).encode()
+    start = _aligned(len(MAGIC) + 8 + len(header))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, _, data in blocks:
+            f.seek(start + layout[name]["offset"])
+            f.write(data)
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str) -> Snapshot:
+    """Maps the snapshot at `path`; the arrays it returns are views into the file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{path} is not a timetable snapshot")
+        try:
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length))
+        except (struct.error, ValueError) as e:
+            raise SnapshotError(f"{path} has a damaged header") from e
+        if header["byteorder"] != sys.byteorder:
+            raise SnapshotError(f"{path} was written on a {header['byteorder']}-endian machine")
+        start = _aligned(len(MAGIC) + 8 + header_length)
+        end = start + max((spec["offset"] + spec["size"] for spec in header["columns"].values()), default=0)
+        if os.fstat(f.fileno()).st_size < end:
+            raise SnapshotError(f"{path} is truncated")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+
+    def column(name: str):
+        spec = header["columns"][name]
+        first = start + spec["offset"]
+        return view[first:first + spec["size"]].cast(spec["typecode"])
+
+    columns = TimetableColumns(
+        stations=[Station(*station) for station in header["stations"]],
+        train_types=header["train_types"],
+        **{name: column(name) for name in INT_COLUMNS},
+        **{name: StringColumn(column(f"{name}.data"), column(f"{name}.ends")) for name in STRING_COLUMNS},
+    )
+    timetable = Timetable.from_columns(columns)
+    connections = ConnectionIndex.from_arrays(
+        timetable, {name: column(f"connections.{name}") for name in ConnectionIndex.ARRAYS},
+    )
+    return Snapshot(timetable, connections, header["meta"])
+
+
+def _int_bytes(values, typecode: str) -> bytes:
+    if getattr(values, "typecode", None) == typecode:
+        return values.tobytes()
+    return array(typecode, values).tobytes()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,518 @@
+"""
+Shared state backends.
+
+Everything that has to be consistent across worker processes -- seat
+inventory, chat histories, idempotency keys and (optionally) orders -- is
+kept in a `StateBackend`. The interface is a small subset of Redis: string
+keys with optional TTLs, counters, hashes, pub/sub, and an atomic
+read-modify-write over a set of keys (`update`).
+
+* `MemoryStateBackend`: process-local dicts behind one lock. The default for
+  a single worker, and the fake to use in tests.
+* `SQLiteStateBackend`: a SQLite file shared by all workers on one machine
+  (`uvicorn --workers N`). Pub/sub messages go through a table that each
+  process polls.
+* `RedisStateBackend`: a Redis server, for workers on several machines.
+  Needs the `redis` package.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("apaaja.state")
+
+# How often expired keys are swept, on the next write; until then they are
+# only dropped when read.
+DEFAULT_SWEEP_INTERVAL_SECONDS = 60
+
+
+class WithTTL(NamedTuple):
+    """A new value for `update` that also replaces the key's TTL (None: no expiry)."""
+    value: str
+    ttl: Optional[float]
+
+
+# fn(current values by key) -> (new values by key, result). A new value of
+# None deletes the key, a string keeps the key's TTL, and keys left out of
+# the new values are not touched.
+Updater = Callable[[Dict[str, Optional[str]]], Tuple[Dict[str, Union[str, WithTTL, None]], object]]
+
+
+class StateBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """Stores a value; with `nx`, only if the key doesn't exist. Returns whether it was stored."""
+
+    @abstractmethod
+    def delete(self, *keys: str) -> None:
+        pass
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        pass
+
+    @abstractmethod
+    def hset(self, name: str, field: str, value: str) -> None:
+        pass
+
+    @abstractmethod
+    def hget(self, name: str, field: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def hvals(self, name: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def hdel(self, name: str, *fields: str) -> None:
+        pass
+
+    @abstractmethod
+    def hlen(self, name: str) -> int:
+        pass
+
+    @abstractmethod
+    def update(self, keys: Sequence[str], fn: Updater) -> object:
+        """
+        Reads `keys`, applies `fn` and writes its new values as one atomic
+        step, so no other update of these keys can interleave. `fn` may be
+        called more than once if it has to be retried; it must not have side
+        effects. Returns the result of the call that was applied.
+        """
+
+    @abstractmethod
+    def publish(self, channel: str, message: str) -> None:
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Calls `callback` with every message published on `channel`, in any process."""
+
+    def acquire(self, name: str, token: str, ttl: float) -> bool:
+        """Takes a lock if it is free. The lock frees itself after `ttl` seconds."""
+        return self.set(f"lock:{name}", token, ttl=ttl, nx=True)
+
+    def release(self, name: str, token: str) -> None:
+        """Releases a lock, but only if it is still held with `token`."""
+        key = f"lock:{name}"
+        self.update([key], lambda values: ({key: None} if values[key] == token else {}, None))
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    def __init__(self, sweep_interval: float = DEFAULT_SWEEP_INTERVAL_SECONDS):
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+        self._values: Dict[str, str] = {}
+        self._expires: Dict[str, float] = {}
+        self._hashes: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._lock = threading.RLock()
+
+    def _live(self, key: str) -> Optional[str]:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._values.pop(key, None)
+            del self._expires[key]
+        return self._values.get(key)
+
+    def _sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        for key in [key for key, expires_at in self._expires.items() if expires_at <= now]:
+            self._values.pop(key, None)
+            del self._expires[key]
+
+    def _store(self, key: str, value: Optional[str], ttl: Optional[float] = None):
+        self._sweep()
+        self._expires.pop(key, None)
+        if value is None:
+            self._values.pop(key, None)
+            return
+        self._values[key] = value
+        if ttl is not None:
+            self._expires[key] = time.time() + ttl
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._store(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._live(key) or 0) + 1
+            self._values[key] = str(value)
+            return value
+
+    def hset(self, name: str, field: str, value: str) -> None:
+        with self._lock:
+            self._hashes[name][field] = value
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        with self._lock:
+            return self._hashes[name].get(field)
+
+    def hvals(self, name: str) -> List[str]:
+        with self._lock:
+            return list(self._hashes[name].values())
+
+    def hdel(self, name: str, *fields: str) -> None:
+        with self._lock:
+            for field in fields:
+                self._hashes[name].pop(field, None)
+
+    def hlen(self, name: str) -> int:
+        with self._lock:
+            return len(self._hashes[name])
+
+    def update(self, keys: Sequence[str], fn: Updater) -> object:
+        with self._lock:
+            values, result = fn({key: self._live(key) for key in keys})
+            for key, value in values.items():
+                if isinstance(value, WithTTL):
+                    self._store(key, value.value, value.ttl)
+                    continue
+                # Plain values keep the key's TTL, like a Redis SET with KEEPTTL
+                expires_at = self._expires.get(key)
+                self._store(key, value)
+                if value is not None and expires_at is not None:
+                    self._expires[key] = expires_at
+            return result
+
+    def publish(self, channel: str, message: str) -> None:
+        with self._lock:
+            callbacks = list(self._subscribers[channel])
+        _deliver(callbacks, channel, message)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        with self._lock:
+            self._subscribers[channel].append(callback)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at);
+CREATE TABLE IF NOT EXISTS state_hashes (
+    name TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, field)
+);
+CREATE TABLE IF NOT EXISTS state_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteStateBackend(StateBackend):
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = 0.1,
+        message_ttl: float = 60,
+        sweep_interval: float = DEFAULT_SWEEP_INTERVAL_SECONDS,
+    ):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.message_ttl = message_ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+        self._local = threading.local()
+        self._connection().executescript(SQLITE_SCHEMA)
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._subscribers_lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; SQLite serializes the writers
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, fn):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._sweep(connection)
+        connection.execute("COMMIT")
+        return result
+
+    def _sweep(self, connection: sqlite3.Connection):
+        # Each process sweeps on its own schedule; any of them clears the
+        # rows of all of them
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        connection.execute("DELETE FROM state WHERE expires_at <= ?", (now,))
+
+    @staticmethod
+    def _read(connection: sqlite3.Connection, key: str) -> Optional[str]:
+        row = connection.execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, key: str) -> Optional[str]:
+        return self._read(self._connection(), key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        def write(connection):
+            if nx and self._read(connection, key) is not None:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+            )
+            return True
+
+        return self._transaction(write)
+
+    def delete(self, *keys: str) -> None:
+        self._transaction(lambda connection: connection.executemany(
+            "DELETE FROM state WHERE key = ?", [(key,) for key in keys]
+        ))
+
+    def incr(self, key: str) -> int:
+        def write(connection):
+            value = int(self._read(connection, key) or 0) + 1
+            connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+            return value
+
+        return self._transaction(write)
+
+    def hset(self, name: str, field: str, value: str) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state_hashes (name, field, value) VALUES (?, ?, ?)", (name, field, value)
+        )
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT value FROM state_hashes WHERE name = ? AND field = ?", (name, field)
+        ).fetchone()
+        return row[0] if row else None
+
+    def hvals(self, name: str) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT value FROM state_hashes WHERE name = ?", (name,))]
+
+    def hdel(self, name: str, *fields: str) -> None:
+        self._connection().executemany(
+            "DELETE FROM state_hashes WHERE name = ? AND field = ?", [(name, field) for field in fields]
+        )
+
+    def hlen(self, name: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM state_hashes WHERE name = ?", (name,)).fetchone()[0]
+
+    def update(self, keys: Sequence[str], fn: Updater) -> object:
+        def write(connection):
+            now = time.time()
+            values, result = fn({key: self._read(connection, key) for key in keys})
+            for key, value in values.items():
+                if value is None:
+                    connection.execute("DELETE FROM state WHERE key = ?", (key,))
+                elif isinstance(value, WithTTL):
+                    connection.execute(
+                        "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value.value, None if value.ttl is None else now + value.ttl),
+                    )
+                else:
+                    # Keeps the key's TTL, unless the old value had already expired
+                    updated = connection.execute(
+                        "UPDATE state SET value = ?, expires_at = CASE WHEN expires_at <= ? THEN NULL ELSE expires_at END "
+                        "WHERE key = ?",
+                        (value, now, key),
+                    ).rowcount
+                    if not updated:
+                        connection.execute("INSERT INTO state (key, value) VALUES (?, ?)", (key, value))
+            return result
+
+        return self._transaction(write)
+
+    def publish(self, channel: str, message: str) -> None:
+        now = time.time()
+
+        def write(connection):
+            connection.execute(
+                "INSERT INTO state_messages (channel, message, created_at) VALUES (?, ?, ?)", (channel, message, now)
+            )
+            connection.execute("DELETE FROM state_messages WHERE created_at < ?", (now - self.message_ttl,))
+
+        self._transaction(write)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        with self._subscribers_lock:
+            self._subscribers[channel].append(callback)
+            if self._poller is None:
+                # Read here rather than in the poller, so that messages
+                # published as soon as subscribe() returns are delivered
+                last_id = self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM state_messages").fetchone()[0]
+                self._poller = threading.Thread(
+                    target=self._poll_messages, args=(last_id,), name="state-messages", daemon=True,
+                )
+                self._poller.start()
+
+    def _poll_messages(self, last_id: int):
+        connection = self._connection()
+        while not self._closed.wait(self.poll_interval):
+            rows = connection.execute(
+                "SELECT id, channel, message FROM state_messages WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+            for message_id, channel, message in rows:
+                last_id = message_id
+                with self._subscribers_lock:
+                    callbacks = list(self._subscribers.get(channel, ()))
+                _deliver(callbacks, channel, message)
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+class RedisStateBackend(StateBackend):
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis needs the 'redis' package (pip install redis).") from e
+        self._redis = redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._pubsub = None
+        self._listener = None
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        px = int(ttl * 1000) if ttl is not None else None
+        return bool(self.client.set(key, value, px=px, nx=nx))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def hset(self, name: str, field: str, value: str) -> None:
+        self.client.hset(name, field, value)
+
+    def hget(self, name: str, field: str) -> Optional[str]:
+        return self.client.hget(name, field)
+
+    def hvals(self, name: str) -> List[str]:
+        return self.client.hvals(name)
+
+    def hdel(self, name: str, *fields: str) -> None:
+        if fields:
+            self.client.hdel(name, *fields)
+
+    def hlen(self, name: str) -> int:
+        return self.client.hlen(name)
+
+    def update(self, keys: Sequence[str], fn: Updater) -> object:
+        # Optimistic: retried whenever another client wrote one of the keys
+        # between WATCH and EXEC.
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*keys)
+                    values, result = fn({key: pipe.get(key) for key in keys})
+                    pipe.multi()
+                    for key, value in values.items():
+                        if value is None:
+                            pipe.delete(key)
+                        elif isinstance(value, WithTTL):
+                            pipe.set(key, value.value, px=None if value.ttl is None else int(value.ttl * 1000))
+                        else:
+                            pipe.set(key, value, keepttl=True)
+                    pipe.execute()
+                    return result
+                except self._redis.WatchError:
+                    continue
+
+    def publish(self, channel: str, message: str) -> None:
+        self.client.publish(channel, message)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._subscribers[channel].append(callback)
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{channel: self._dispatch})
+        if self._listener is None:
+            self._listener = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def _dispatch(self, message):
+        _deliver(list(self._subscribers.get(message["channel"], ())), message["channel"], message["data"])
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+        self.client.close()
+
+
+def _deliver(callbacks: Iterable[Callable[[str], None]], channel: str, message: str) -> None:
+    """Calls each subscriber; one that fails is logged and doesn't stop the others (or a listener thread)."""
+    for callback in callbacks:
+        try:
+            callback(message)
+        except Exception:
+            logger.exception("State subscriber for %r failed", channel)
+
+
+def create_state_backend(backend: str, sqlite_path: str, redis_url: str) -> StateBackend:
+    if backend == "memory":
+        return MemoryStateBackend()
+    if backend == "sqlite":
+        return SQLiteStateBackend(sqlite_path)
+    if backend == "redis":
+        return RedisStateBackend(redis_url)
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+def dump(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def load(value: Optional[str], default=None):
+    return default if value is None else json.loads(value)
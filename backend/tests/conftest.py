@@ -0,0 +1,29 @@
+"""
+The tests import the app module with in-memory shared state and an order
+database of their own, so they never touch the development databases.
+"""
+import os
+import sys
+import tempfile
+
+DATA_DIRECTORY = tempfile.mkdtemp(prefix="apaaja-tests-")
+
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ.setdefault("ORDER_STORE", "sqlite")
+os.environ.setdefault("ORDERS_DB_PATH", os.path.join(DATA_DIRECTORY, "orders.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from state import MemoryStateBackend, SQLiteStateBackend  # noqa: E402
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    """Each state backend that runs without a server."""
+    if request.param == "memory":
+        state = MemoryStateBackend(sweep_interval=0.05)
+    else:
+        state = SQLiteStateBackend(str(tmp_path / "state.db"), poll_interval=0.01, sweep_interval=0.05)
+    yield state
+    state.close()
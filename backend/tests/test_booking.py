@@ -0,0 +1,90 @@
+"""Validation of bookings: every passenger gets exactly one seat on every leg."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from inventory import SeatInventory, SeatLayout, SeatRequest, SeatsUnavailable
+from state import MemoryStateBackend
+
+LAYOUT = SeatLayout(capacity=24, coach_size=16)
+
+client = TestClient(main.app)
+
+
+def alternative_booking(date: str, passengers: int, seats_per_leg: int, details: int = None):
+    legs = [
+        {"trainId": train_id, "trainName": train_id, "date": date, "from": "A", "to": "B",
+         "departureTime": "08:00", "arrivalTime": "10:00"}
+        for train_id in ("KAI001", "KAI004")
+    ]
+    seats = ["1A", "1B", "1C", "1D", "2A", "2B"][:seats_per_leg]
+    return {
+        "route": {"origin": "Jakarta", "destination": "Solo", "legs": legs},
+        "passengers": passengers,
+        "passengersInfo": [{"name": f"P{i}", "idNumber": str(i)} for i in range(passengers if details is None else details)],
+        "selectedSeats": {str(i): seats for i in range(len(legs))},
+        "totalPrice": 100000 * max(passengers, 0),
+    }
+
+
+def test_pick_needs_one_seat_per_passenger():
+    inventory = SeatInventory(lambda train_id: LAYOUT, MemoryStateBackend())
+    with pytest.raises(SeatsUnavailable):
+        inventory.hold([SeatRequest("T1", "2031-04-01", count=3, seats=["1A"])])
+    with pytest.raises(SeatsUnavailable):
+        inventory.hold([SeatRequest("T1", "2031-04-01", count=0)])
+    assert inventory.available("T1", "2031-04-01") == LAYOUT.capacity
+
+
+def test_alternative_booking_rejects_fewer_seats_than_passengers():
+    date = "2031-04-02"
+    available = main.seat_inventory.available("KAI001", date)
+    response = client.post("/api/book-alternative-route", json=alternative_booking(date, passengers=5, seats_per_leg=1))
+    assert response.status_code == 409
+    assert main.seat_inventory.available("KAI001", date) == available
+
+
+@pytest.mark.parametrize("passengers", [0, -3])
+def test_alternative_booking_needs_a_passenger(passengers):
+    response = client.post("/api/book-alternative-route", json=alternative_booking("2031-04-03", passengers, 0))
+    assert response.status_code == 422
+
+
+def test_alternative_booking_needs_details_for_every_passenger():
+    response = client.post(
+        "/api/book-alternative-route", json=alternative_booking("2031-04-04", passengers=2, seats_per_leg=2, details=1),
+    )
+    assert response.status_code == 400
+
+
+def test_alternative_booking_takes_the_selected_seats():
+    date = "2031-04-05"
+    response = client.post("/api/book-alternative-route", json=alternative_booking(date, passengers=2, seats_per_leg=2))
+    assert response.status_code == 200
+    assert [leg["seats"] for leg in response.json()["orderDetails"]["legs"]] == [["1A", "1B"], ["1A", "1B"]]
+    assert {"1A", "1B"} <= set(main.seat_inventory.taken_seats("KAI001", date))
+
+
+@pytest.mark.parametrize("passengers, details", [(0, 0), (2, 1)])
+def test_chat_booking_needs_details_for_every_passenger(passengers, details):
+    info = [{"name": f"P{i}", "idNumber": str(i)} for i in range(details)]
+    available = main.seat_inventory.available("KAI002", "2031-04-06")
+    result = main.book_ticket_from_chat("KAI002", "2031-04-06", passengers, info)
+    assert result["status"] == "error"
+    assert main.seat_inventory.available("KAI002", "2031-04-06") == available
+
+
+def test_a_seat_hold_is_booked_once():
+    date = "2031-04-07"
+    hold = client.post("/api/seat-holds", json={"legs": [
+        {"trainId": train_id, "date": date, "passengers": 1} for train_id in ("KAI001", "KAI004")
+    ]}).json()
+    booking = {**alternative_booking(date, passengers=1, seats_per_leg=0), "holdId": hold["holdId"]}
+    assert client.post("/api/book-alternative-route", json=booking).status_code == 200
+    available = main.seat_inventory.available("KAI001", date)
+    response = client.post("/api/book-alternative-route", json=booking)
+    assert response.status_code == 409
+    assert main.seat_inventory.available("KAI001", date) == available
+    assert main.seat_inventory.taken_seats("KAI001", date) == ["1A"]
+    assert client.delete(f"/api/seat-holds/{hold['holdId']}").status_code == 409
+    assert main.seat_inventory.available("KAI001", date) == available
@@ -0,0 +1,24 @@
+"""Tool result caching."""
+import main
+from cache import ToolResultCache
+
+
+def test_error_results_are_not_cached():
+    calls = []
+
+    def lookup(order_id):
+        calls.append(order_id)
+        return {"status": "error"} if len(calls) == 1 else {"status": "success"}
+
+    cache = ToolResultCache({"lookup": 60})
+    assert cache.call("lookup", lookup, {"order_id": "A"}) == {"status": "error"}
+    assert cache.call("lookup", lookup, {"order_id": "A"}) == {"status": "success"}
+    assert cache.call("lookup", lookup, {"order_id": "A"}) == {"status": "success"}
+    assert len(calls) == 2
+
+
+def test_order_status_finds_an_order_created_after_a_miss():
+    args = {"order_id": "TRXTESTCACHE0001"}
+    assert main.tool_cache.call("get_order_status", main.get_order_status, args)["status"] == "error"
+    main.order_repository.add({**main.SEED_ORDERS[0], "id": "TRXTESTCACHE0001"})
+    assert main.tool_cache.call("get_order_status", main.get_order_status, args)["status"] == "success"
@@ -0,0 +1,57 @@
+"""The chat tools, called with arguments the way the Gemini SDK passes them."""
+import asyncio
+
+from fastapi.testclient import TestClient
+from google.generativeai import protos
+
+import main
+from inventory import SeatRequest
+
+PASSENGERS_INFO = [{"name": "Siti Rahma", "idNumber": "3174000000000001"}, {"name": "Budi", "idNumber": "3174000000000002"}]
+
+
+def model_call(name: str, **args):
+    """Runs a tool the way the chat pipeline does for a function call from the model."""
+    function_call = protos.FunctionCall(name=name, args=args)
+    return asyncio.run(main.call_function(function_call.name, dict(function_call.args), "test-chat-tools"))
+
+
+def test_proto_args_become_plain_values():
+    function_call = protos.FunctionCall(name="book_ticket_from_chat", args={"passengers": 2, "passengers_info": PASSENGERS_INFO})
+    args = main.plain_args(dict(function_call.args))
+    assert args == {"passengers": 2, "passengers_info": PASSENGERS_INFO}
+    assert type(args["passengers_info"]) is list and type(args["passengers_info"][0]) is dict
+
+
+def test_chat_booking_stores_a_json_order():
+    result = model_call(
+        "book_ticket_from_chat", train_id="KAI002", date="2031-03-01", passengers=2, passengers_info=PASSENGERS_INFO,
+    )
+    assert result["status"] == "success"
+    order = main.order_repository.get(result["order_id"])
+    assert order["passengers"] == 2 and type(order["passengers"]) is int
+    assert order["passengersInfo"] == PASSENGERS_INFO
+    assert len(order["seats"]) == 2
+
+    response = TestClient(main.app).get("/api/my-orders")
+    assert response.status_code == 200
+    assert result["order_id"] in [order["id"] for order in response.json()]
+
+
+def test_repeated_chat_booking_books_once():
+    args = {"train_id": "KAI003", "date": "2031-03-02", "passengers": 2, "passengers_info": PASSENGERS_INFO}
+    available = main.seat_inventory.available("KAI003", "2031-03-02")
+    first = model_call("book_ticket_from_chat", **args)
+    second = model_call("book_ticket_from_chat", **args)
+    assert first["status"] == "success"
+    assert second == first
+    assert main.seat_inventory.available("KAI003", "2031-03-02") == available - 2
+
+
+def test_failed_chat_booking_is_not_replayed():
+    date = "2031-03-03"
+    everything = main.seat_inventory.hold([SeatRequest("KAI003", date, count=main.seat_inventory.available("KAI003", date))])
+    args = dict(train_id="KAI003", date=date, passengers=2, passengers_info=PASSENGERS_INFO)
+    assert model_call("book_ticket_from_chat", **args)["status"] == "error"
+    main.seat_inventory.release(everything.hold_id)
+    assert model_call("book_ticket_from_chat", **args)["status"] == "success"
@@ -0,0 +1,69 @@
+"""Idempotency keys: a retried request gets the first result back."""
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ids import IdempotencyKeyReused, IdempotencyStore, request_fingerprint
+
+
+def test_replay_returns_the_first_result(backend):
+    store = IdempotencyStore(backend)
+    calls = []
+    action = lambda: calls.append(1) or {"orderId": f"TRX{len(calls)}"}  # noqa: E731
+    assert store.run("k", {"a": 1}, action) == {"orderId": "TRX1"}
+    assert store.run("k", {"a": 1}, action) == {"orderId": "TRX1"}
+    assert len(calls) == 1
+
+
+def test_concurrent_retries_run_once(backend):
+    store = IdempotencyStore(backend, poll_interval=0.005)
+    calls = []
+    lock = threading.Lock()
+
+    def action():
+        with lock:
+            calls.append(1)
+        time.sleep(0.05)
+        return {"orderId": "TRX1"}
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: store.run("k", {"a": 1}, action), range(8)))
+    assert results == [{"orderId": "TRX1"}] * 8
+    assert len(calls) == 1
+
+
+def test_key_reused_for_another_request(backend):
+    store = IdempotencyStore(backend)
+    store.run("k", {"a": 1}, lambda: "first")
+    with pytest.raises(IdempotencyKeyReused):
+        store.run("k", {"a": 2}, lambda: "second")
+
+
+def test_failed_attempt_can_be_retried(backend):
+    store = IdempotencyStore(backend)
+
+    def fail():
+        raise RuntimeError("seats service down")
+
+    with pytest.raises(RuntimeError):
+        store.run("k", {"a": 1}, fail)
+    assert store.run("k", {"a": 1}, lambda: "booked") == "booked"
+
+
+def test_fingerprint_takes_values_that_are_not_json():
+    assert request_fingerprint({"a": [1, {"b": 2}]}) == request_fingerprint({"a": [1, {"b": 2}]})
+    date = datetime.date(2031, 5, 1)
+    assert request_fingerprint({"date": date}) == request_fingerprint({"date": datetime.date(2031, 5, 1)})
+    assert request_fingerprint({"date": date}) != request_fingerprint({"date": datetime.date(2031, 5, 2)})
+
+
+def test_results_not_kept_are_not_replayed(backend):
+    store = IdempotencyStore(backend)
+    sold_out = {"status": "error", "message": "Only 0 seats left."}
+    keep = lambda result: result["status"] != "error"  # noqa: E731
+    assert store.run("k", {"a": 1}, lambda: sold_out, keep=keep) == sold_out
+    assert store.run("k", {"a": 1}, lambda: {"status": "success"}, keep=keep) == {"status": "success"}
+    assert store.run("k", {"a": 1}, lambda: sold_out, keep=keep) == {"status": "success"}
@@ -0,0 +1,100 @@
+"""Seat holds on the shared state backends: no seat is ever sold twice."""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import inventory as inventory_module
+from inventory import SeatInventory, SeatLayout, SeatRequest, SeatsUnavailable
+
+LAYOUT = SeatLayout(capacity=24, coach_size=16)
+DATE = "2031-06-01"
+
+
+@pytest.fixture
+def inventory(backend):
+    return SeatInventory(lambda train_id: LAYOUT if train_id.startswith("T") else None, backend)
+
+
+def test_hold_confirm_release(inventory):
+    hold = inventory.hold([SeatRequest("T1", DATE, count=2), SeatRequest("T2", DATE, seats=["1A"], count=1)])
+    assert hold.seats == {("T1", DATE): ("1A", "1B"), ("T2", DATE): ("1A",)}
+    assert inventory.available("T1", DATE) == LAYOUT.capacity - 2
+    inventory.confirm(hold.hold_id)
+    assert inventory.seats(hold.hold_id) == hold.seats
+    assert inventory.taken_seats("T2", DATE) == ["1A"]
+    with pytest.raises(SeatsUnavailable):
+        inventory.confirm(hold.hold_id)
+
+    released = inventory.hold([SeatRequest("T1", DATE, count=3)])
+    inventory.release(released.hold_id)
+    assert inventory.available("T1", DATE) == LAYOUT.capacity - 2
+    with pytest.raises(SeatsUnavailable):
+        inventory.confirm(released.hold_id)
+
+
+def test_confirmed_seats_are_only_freed_by_their_confirmation(inventory):
+    hold = inventory.hold([SeatRequest("T1", DATE, count=2)])
+    confirmation = inventory.confirm(hold.hold_id)
+    with pytest.raises(SeatsUnavailable):
+        inventory.release(hold.hold_id)
+    inventory.revert(hold.hold_id, "another request")
+    assert inventory.available("T1", DATE) == LAYOUT.capacity - 2
+    inventory.revert(hold.hold_id, confirmation)
+    assert inventory.available("T1", DATE) == LAYOUT.capacity
+
+
+def test_confirmed_hold_records_expire_after_the_travel_day(inventory, monkeypatch):
+    monkeypatch.setattr(inventory_module, "CONFIRMED_RECORD_GRACE_SECONDS", 0.05)
+    past = inventory.hold([SeatRequest("T1", "2020-01-01", count=1)])
+    upcoming = inventory.hold([SeatRequest("T1", DATE, count=1)])
+    inventory.confirm(past.hold_id)
+    inventory.confirm(upcoming.hold_id)
+    time.sleep(0.1)
+    with pytest.raises(SeatsUnavailable):
+        inventory.seats(past.hold_id)
+    assert inventory.seats(upcoming.hold_id) == upcoming.seats
+    assert inventory.taken_seats("T1", "2020-01-01") == ["1A"]
+
+
+def test_holds_take_all_legs_or_none(inventory):
+    inventory.reserve([SeatRequest("T2", DATE, seats=["1C"], count=1)])
+    with pytest.raises(SeatsUnavailable):
+        inventory.hold([SeatRequest("T1", DATE, count=1), SeatRequest("T2", DATE, seats=["1C"], count=1)])
+    with pytest.raises(SeatsUnavailable):
+        inventory.hold([SeatRequest("T1", DATE, count=1), SeatRequest("UNKNOWN", DATE, count=1)])
+    assert inventory.available("T1", DATE) == LAYOUT.capacity
+
+
+def test_expired_holds_free_their_seats(inventory):
+    hold = inventory.hold([SeatRequest("T1", DATE, count=LAYOUT.capacity)], ttl_seconds=0.05)
+    with pytest.raises(SeatsUnavailable):
+        inventory.hold([SeatRequest("T1", DATE, count=1)])
+    time.sleep(0.1)
+    assert inventory.available("T1", DATE) == LAYOUT.capacity
+    with pytest.raises(SeatsUnavailable):
+        inventory.confirm(hold.hold_id)
+
+
+def test_no_seat_is_sold_twice(inventory):
+    def customer(seed):
+        rng = random.Random(seed)
+        sold = []
+        for _ in range(6):
+            try:
+                hold = inventory.hold([SeatRequest("T1", DATE, count=rng.randint(1, 3))])
+            except SeatsUnavailable:
+                continue
+            if rng.random() < 0.3:
+                inventory.release(hold.hold_id)
+                continue
+            inventory.confirm(hold.hold_id)
+            sold.extend(hold.seats[("T1", DATE)])
+        return sold
+
+    with ThreadPoolExecutor(8) as pool:
+        sold = [seat for seats in pool.map(customer, range(16)) for seat in seats]
+    assert len(sold) == len(set(sold))
+    assert sorted(sold) == sorted(inventory.taken_seats("T1", DATE))
+    assert inventory.available("T1", DATE) == LAYOUT.capacity - len(sold)
@@ -0,0 +1,119 @@
+"""The journey planner against an exhaustive search on small random timetables."""
+import random
+
+import pytest
+
+from planner import DEFAULT_MIN_TRANSFER_MINUTES, DEFAULT_SEARCH_SLACK_MINUTES, JourneyPlanner
+from realtime import RealtimeIndex, TripUpdate
+from timetable import MINUTES_PER_DAY, Station, StopTime, Timetable, Trip
+
+CITIES = 6
+
+
+def random_timetable(seed: int, trips: int = 40) -> Timetable:
+    rng = random.Random(seed)
+    stations = [Station(f"C{c}S{s}", f"C{c}S{s}", f"City{c}", f"city{c}") for c in range(CITIES) for s in range(2)]
+    generated = []
+    for i in range(trips):
+        route = rng.sample(stations, rng.randint(2, 4))
+        minute, fare, stops = rng.randrange(0, 8 * 60), 0, []
+        for position, station in enumerate(route):
+            if position:
+                minute += rng.randrange(10, 90)
+                fare += rng.randrange(1, 20) * 1000
+            arrival = minute
+            minute += rng.choice((0, 0, 5))
+            stops.append(StopTime(station, arrival, minute, fare))
+        generated.append(Trip(f"T{i}", f"Train {i}", "Economy", tuple(stops), 100))
+    return Timetable(generated)
+
+
+def exhaustive_search(timetable: Timetable, origin: str, destination: str, start: int, min_legs: int, max_legs: int):
+    """The Pareto set of (arrival, price, legs) over every journey, as the planner defines them."""
+    connections = [
+        (trip.train_id, a.station, a.departure, b.station, b.arrival, b.fare - a.fare)
+        for trip in timetable.trips
+        for a, b in zip(trip.stops, trip.stops[1:])
+    ]
+    journeys = []
+
+    def extend(station, arrival, price, legs, trip_id):
+        for trip, origin_station, departure, to, to_arrival, fare in connections:
+            if origin_station != station or departure > start + MINUTES_PER_DAY:
+                continue
+            if trip == trip_id:
+                if arrival > departure:
+                    continue
+                next_legs = legs
+            else:
+                if legs >= max_legs or arrival + (DEFAULT_MIN_TRANSFER_MINUTES if legs else 0) > departure:
+                    continue
+                next_legs = legs + 1
+            if to.city_key == destination:
+                if next_legs >= min_legs:
+                    journeys.append((to_arrival, price + fare, next_legs))
+            else:
+                extend(to, to_arrival, price + fare, next_legs, trip)
+
+    for station in timetable.stations_by_city[origin].values():
+        extend(station, start, 0, 0, None)
+    if not journeys:
+        return set()
+    latest = min(arrival for arrival, _, _ in journeys) + DEFAULT_SEARCH_SLACK_MINUTES
+    journeys = [journey for journey in journeys if journey[0] <= latest]
+    return {
+        journey for journey in journeys
+        if not any(other != journey and all(o <= j for o, j in zip(other, journey)) for other in journeys)
+    }
+
+
+def planned(planner: JourneyPlanner, origin: str, destination: str, start: int, min_transfers: int, delays=None):
+    labels = planner.search(origin, destination, start=start, min_transfers=min_transfers, delays=delays)
+    return {(label.arrival, label.price, label.legs) for label in labels}
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_planner_finds_the_pareto_set(seed):
+    timetable = random_timetable(seed)
+    planner = JourneyPlanner(timetable)
+    rng = random.Random(seed)
+    for _ in range(15):
+        origin, destination = (f"city{c}" for c in rng.sample(range(CITIES), 2))
+        start, min_transfers = rng.choice((0, 120, 300)), rng.choice((0, 1))
+        expected = exhaustive_search(timetable, origin, destination, start, min_transfers + 1, 3)
+        assert planned(planner, origin, destination, start, min_transfers) == expected
+
+
+def delayed_timetable(timetable: Timetable, realtime: RealtimeIndex, date: str) -> Timetable:
+    """The timetable as it runs with the real-time changes of `date`: cancelled trips gone, delays applied."""
+    day = realtime.day(date)
+    trips = []
+    for position, trip in enumerate(timetable.trips):
+        state = day.trips.get(position)
+        if state is None:
+            trips.append(trip)
+        elif state.times is not None:
+            stops = tuple(
+                StopTime(stop.station, arrival, departure, stop.fare)
+                for stop, (arrival, departure) in zip(trip.stops, state.times)
+            )
+            trips.append(trip._replace(stops=stops))
+    return Timetable(trips)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_planner_with_delays_matches_the_delayed_timetable(seed):
+    timetable = random_timetable(seed)
+    planner = JourneyPlanner(timetable)
+    realtime = RealtimeIndex(timetable, planner.connections)
+    rng = random.Random(100 + seed)
+    date = "2031-07-01"
+    realtime.apply([
+        TripUpdate(trip.train_id, date, cancelled=rng.random() < 0.2, delay=rng.randrange(0, 120))
+        for trip in rng.sample(list(timetable.trips), 15)
+    ])
+    delayed = delayed_timetable(timetable, realtime, date)
+    for _ in range(15):
+        origin, destination = (f"city{c}" for c in rng.sample(range(CITIES), 2))
+        expected = exhaustive_search(delayed, origin, destination, 0, 1, 3)
+        assert planned(planner, origin, destination, 0, 0, realtime.day(date).connections) == expected
@@ -0,0 +1,58 @@
+"""Trip updates shared through the state backend."""
+import datetime
+
+import pytest
+
+import main
+from realtime import TripUpdate
+
+
+@pytest.fixture
+def today(monkeypatch):
+    """Lets a test move the service date; returns a function that sets it."""
+    current = {"date": datetime.date.today()}
+    monkeypatch.setattr(main, "service_date", lambda days=0: (current["date"] + datetime.timedelta(days=days)).isoformat())
+
+    def set_today(date: datetime.date):
+        current["date"] = date
+
+    yield set_today
+    main.state_backend.hdel(main.TRIP_UPDATES_KEY, *[
+        main.trip_update_field(update) for update in main.trip_updates.prune("9999-12-31")
+    ])
+    main.get_transit().realtime.prune("9999-12-31")
+    main.realtime_pruned_before = ""
+
+
+def shared_fields():
+    return sorted(main.trip_update_field(update) for update in main.read_trip_updates(
+        main.state_backend.hvals(main.TRIP_UPDATES_KEY), "the test",
+    ))
+
+
+def test_shared_updates_are_forgotten_after_their_day(today):
+    monday = datetime.date(2031, 5, 5)
+    today(monday)
+    main.share_trip_updates([TripUpdate("KAI001", "2031-05-05", delay=15), TripUpdate("KAI002", "2031-05-06", delay=5)])
+    assert shared_fields() == ["2031-05-05 KAI001", "2031-05-06 KAI002"]
+    assert main.get_transit().realtime.day("2031-05-05") is not None
+
+    today(monday + datetime.timedelta(days=3))
+    main.share_trip_updates([TripUpdate("KAI003", "2031-05-08", delay=10)])
+    assert shared_fields() == ["2031-05-08 KAI003"]
+    assert main.get_transit().realtime.day("2031-05-05") is None
+
+
+def test_past_updates_are_not_shared(today):
+    today(datetime.date(2031, 5, 5))
+    main.share_trip_updates([TripUpdate("KAI001", "2031-05-01", delay=15)])
+    assert shared_fields() == []
+
+
+def test_loading_drops_past_updates(today):
+    today(datetime.date(2031, 5, 5))
+    for update in (TripUpdate("KAI001", "2031-05-01", delay=15), TripUpdate("KAI002", "2031-05-05", delay=5)):
+        main.state_backend.hset(main.TRIP_UPDATES_KEY, main.trip_update_field(update), main.json.dumps(update.as_json()))
+    main.load_shared_trip_updates()
+    assert shared_fields() == ["2031-05-05 KAI002"]
+    assert main.get_transit().realtime.day("2031-05-05").trips
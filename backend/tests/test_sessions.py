@@ -0,0 +1,28 @@
+"""Chat session persistence."""
+from types import SimpleNamespace
+
+import main
+from sessions import ChatSessionStore
+from state import MemoryStateBackend
+
+
+def chat(*messages):
+    return SimpleNamespace(history=[{"role": "user", "parts": [{"text": text}]} for text in messages])
+
+
+def test_single_process_sessions_are_not_saved():
+    assert main.STATE_BACKEND == "memory"
+    assert main.chat_sessions.state is None
+    session = main.chat_sessions.get_or_create("test-sessions", lambda: chat("hello"))
+    main.chat_sessions.save_history("test-sessions", session)
+    assert main.state_backend.get("chat:test-sessions") is None
+    assert main.chat_sessions.load_history("test-sessions") is None
+
+
+def test_shared_sessions_are_saved_with_their_revision():
+    store = ChatSessionStore(state=MemoryStateBackend())
+    session = store.get_or_create("s1", lambda: chat("hello", "hi"))
+    store.save_history("s1", session)
+    stored = store.load_history("s1")
+    assert stored.revision == 1
+    assert [entry["parts"][0]["text"] for entry in stored.history] == ["hello", "hi"]
@@ -0,0 +1,130 @@
+"""The state backends, as several threads (or workers) use them."""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from state import MemoryStateBackend, SQLiteStateBackend, WithTTL
+
+
+def stored_keys(backend) -> int:
+    """Keys the backend still stores, expired or not."""
+    if isinstance(backend, MemoryStateBackend):
+        return len(backend._values)
+    with sqlite3.connect(backend.path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+
+
+def test_set_if_absent_and_ttl(backend):
+    assert backend.set("k", "a", nx=True)
+    assert not backend.set("k", "b", nx=True)
+    assert backend.get("k") == "a"
+    backend.set("short", "x", ttl=0.05)
+    time.sleep(0.1)
+    assert backend.get("short") is None
+    assert backend.set("short", "y", nx=True)
+
+
+def test_incr_is_atomic(backend):
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: backend.incr("counter"), range(400)))
+    assert backend.incr("counter") == 401
+
+
+def test_update_is_atomic(backend):
+    def add_one(values):
+        return {"total": str(int(values["total"] or 0) + 1)}, None
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: backend.update(["total"], add_one), range(200)))
+    assert backend.get("total") == "200"
+
+
+def test_update_writes_deletes_and_ttls(backend):
+    backend.set("a", "1")
+    backend.set("b", "2")
+    result = backend.update(["a", "b", "c"], lambda values: ({"a": None, "c": WithTTL("3", 0.05)}, "done"))
+    assert result == "done"
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (None, "2", "3")
+    time.sleep(0.1)
+    assert backend.get("c") is None
+
+
+def test_expired_keys_are_swept(backend):
+    backend.set("kept", "1")
+    for i in range(1000):
+        backend.set(f"idempotency:{i}", "done", ttl=0.01)
+    for i in range(200):
+        backend.update([f"hold:{i}"], lambda values, i=i: ({f"hold:{i}": WithTTL("held", 0.01)}, None))
+    time.sleep(0.1)
+    backend.set("written", "after expiry")
+    assert stored_keys(backend) == 2
+
+
+def test_hashes(backend):
+    backend.hset("h", "x", "1")
+    backend.hset("h", "y", "2")
+    backend.hset("other", "x", "3")
+    assert backend.hget("h", "x") == "1"
+    assert sorted(backend.hvals("h")) == ["1", "2"]
+    backend.hdel("h", "x", "missing")
+    assert backend.hvals("h") == ["2"] and backend.hlen("h") == 1
+    assert backend.hvals("other") == ["3"]
+
+
+def test_lock_has_one_owner(backend):
+    assert backend.acquire("lock", "first", ttl=10)
+    assert not backend.acquire("lock", "second", ttl=10)
+    backend.release("lock", "second")
+    assert not backend.acquire("lock", "second", ttl=10)
+    backend.release("lock", "first")
+    assert backend.acquire("lock", "second", ttl=10)
+
+
+def test_published_messages_reach_subscribers(backend):
+    received = []
+    delivered = threading.Event()
+
+    def on_message(message):
+        received.append(message)
+        if len(received) == 2:
+            delivered.set()
+
+    backend.subscribe("channel", on_message)
+    backend.publish("channel", "one")
+    backend.publish("channel", "two")
+    assert delivered.wait(2)
+    assert received == ["one", "two"]
+
+
+def test_a_failing_subscriber_does_not_stop_delivery(backend):
+    received = []
+    delivered = threading.Event()
+
+    def broken(message):
+        raise RuntimeError("subscriber bug")
+
+    def on_message(message):
+        received.append(message)
+        if len(received) == 2:
+            delivered.set()
+
+    backend.subscribe("channel", broken)
+    backend.subscribe("channel", on_message)
+    backend.publish("channel", "one")
+    backend.publish("channel", "two")
+    assert delivered.wait(2)
+    assert received == ["one", "two"]
+
+
+def test_sqlite_workers_share_state(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first, second = SQLiteStateBackend(path, poll_interval=0.01), SQLiteStateBackend(path, poll_interval=0.01)
+    received = threading.Event()
+    second.subscribe("channel", lambda message: received.set())
+    first.set("k", "v")
+    first.publish("channel", "hello")
+    assert second.get("k") == "v"
+    assert received.wait(2)
+    first.close()
+    second.close()
@@ -0,0 +1,21 @@
+"""Direct offers between cities."""
+from benchmarks.synthetic import city_name, generate_timetable
+
+import timetable as timetable_module
+
+
+def test_unknown_places_are_not_memoized():
+    timetable = generate_timetable(200, cities=10)
+    for i in range(100):
+        assert timetable.direct_offers(f"nowhere {i}", city_name(1).lower()) == []
+    assert timetable._direct_offers.cache_info().currsize == 0
+
+
+def test_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(timetable_module, "DIRECT_OFFER_PAIRS", 5)
+    timetable = generate_timetable(500, cities=10)
+    for origin in range(10):
+        for destination in range(10):
+            offers = timetable.direct_offers(city_name(origin).lower(), city_name(destination).lower())
+            assert offers == sorted(offers)
+    assert timetable._direct_offers.cache_info().currsize == 5
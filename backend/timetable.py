@@ -0,0 +1,427 @@
+"""
+In-memory timetable store.
+
+The timetable is built once and is read-only afterwards. It is stored
+column-wise (`TimetableColumns`): flat integer arrays for the trips, their
+stops and a departure index, plus string columns for train ids and names.
+The same columns can be written to a snapshot file and mapped back into
+memory without parsing (see snapshot.py), so a timetable of millions of
+stops costs a few arrays rather than millions of Python objects.
+
+On top of the columns the store keeps these indexes:
+
+* station -> departures (sorted by departure time), as one column sorted
+  by (station, time) with an offset per station
+* normalized (origin city, destination city) -> direct offers, built lazily
+  on the first search for that pair and reused afterwards
+* train id -> trip, by binary search over the trips sorted by id
+
+`Trip` and `StopTime` records are built on access, so callers keep working
+with the same shapes as before.
+
+Times are stored as minutes after midnight of the service day. Arrivals
+after midnight are stored as values above 1440 so a trip never goes
+"backwards" in time.
+"""
+import functools
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+# City pairs whose direct offers Timetable.direct_offers keeps
+DIRECT_OFFER_PAIRS = 10_000
+
+
+class Station(NamedTuple):
+    code: str
+    name: str
+    city: str
+    city_key: str
+
+
+class StopTime(NamedTuple):
+    station: Station
+    arrival: int
+    departure: int
+    fare: int  # cumulative fare from the first stop of the trip
+
+
+class Trip(NamedTuple):
+    train_id: str
+    train_name: str
+    train_type: str
+    stops: Tuple[StopTime, ...]
+    seats: int
+
+
+class Departure(NamedTuple):
+    departure: int
+    trip: int  # position of the trip in Timetable.trips
+    stop: int  # position of the boarding stop in Trip.stops
+
+
+class DirectOffer(NamedTuple):
+    departure: int
+    trip: int
+    board: int
+    alight: int
+
+
+class StringColumn(Sequence):
+    """Strings stored back to back as UTF-8, with the end offset of each one."""
+
+    def __init__(self, data=None, ends=None):
+        self.data = bytearray() if data is None else data
+        self.ends = array("q") if ends is None else ends
+
+    def append(self, value: str):
+        self.data.extend(value.encode())
+        self.ends.append(len(self.data))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self.ends)
+        start = self.ends[index - 1] if index else 0
+        return bytes(self.data[start:self.ends[index]]).decode()
+
+
+class TimetableColumns(NamedTuple):
+    stations: List[Station]
+    train_types: List[str]
+    trip_ids: Sequence  # str per trip
+    trip_names: Sequence  # str per trip
+    trip_types: Sequence  # index into train_types, per trip
+    trip_seats: Sequence
+    trip_stops: Sequence  # offset of each trip's first stop; one more entry than trips
+    stop_station: Sequence  # index into stations, per stop
+    stop_arrival: Sequence
+    stop_departure: Sequence
+    stop_fare: Sequence  # cumulative from the first stop of the trip
+    station_departures: Sequence  # offset of each station's departures; one more entry than stations
+    departure_time: Sequence
+    departure_trip: Sequence
+    departure_stop: Sequence  # position of the boarding stop in its trip
+    trip_id_order: Sequence  # trip indexes sorted by train id
+
+
+# Integer columns and their array type codes, in snapshot order
+INT_COLUMNS = (
+    "trip_types", "trip_seats", "trip_stops", "stop_station", "stop_arrival", "stop_departure",
+    "stop_fare", "station_departures", "departure_time", "departure_trip", "departure_stop", "trip_id_order",
+)
+STRING_COLUMNS = ("trip_ids", "trip_names")
+
+
+class TimetableBuilder:
+    """Collects trips one stop at a time and turns them into columns."""
+
+    def __init__(self):
+        self.stations: List[Station] = []
+        self.station_index: Dict[str, int] = {}
+        self.train_types: List[str] = []
+        self.type_index: Dict[str, int] = {}
+        self.trip_ids = StringColumn()
+        self.trip_names = StringColumn()
+        self.trip_types = array("i")
+        self.trip_seats = array("i")
+        self.trip_stops = array("i", [0])
+        self.stop_station = array("i")
+        self.stop_arrival = array("i")
+        self.stop_departure = array("i")
+        self.stop_fare = array("i")
+
+    def add_station(self, station: Station) -> int:
+        index = self.station_index.get(station.code)
+        if index is None:
+            index = self.station_index[station.code] = len(self.stations)
+            self.stations.append(station)
+        return index
+
+    def add_stop(self, station: int, arrival: int, departure: int, fare: int):
+        """Adds a stop to the trip being built; finish it with `end_trip`."""
+        self.stop_station.append(station)
+        self.stop_arrival.append(arrival)
+        self.stop_departure.append(departure)
+        self.stop_fare.append(fare)
+
+    def add_stops(self, stations: Iterable[int], arrivals: Iterable[int], departures: Iterable[int], fares: Iterable[int]):
+        """`add_stop` for several stops at once, given column-wise."""
+        self.stop_station.extend(stations)
+        self.stop_arrival.extend(arrivals)
+        self.stop_departure.extend(departures)
+        self.stop_fare.extend(fares)
+
+    def end_trip(self, train_id: str, train_name: str, train_type: str, seats: int):
+        """Closes the trip made of the stops added since the previous one."""
+        type_index = self.type_index.get(train_type)
+        if type_index is None:
+            type_index = self.type_index[train_type] = len(self.train_types)
+            self.train_types.append(train_type)
+        self.trip_ids.append(train_id)
+        self.trip_names.append(train_name)
+        self.trip_types.append(type_index)
+        self.trip_seats.append(seats)
+        self.trip_stops.append(len(self.stop_station))
+
+    def add_trip(self, trip: Trip):
+        for stop in trip.stops:
+            self.add_stop(self.add_station(stop.station), stop.arrival, stop.departure, stop.fare)
+        self.end_trip(trip.train_id, trip.train_name, trip.train_type, trip.seats)
+
+    def build(self) -> TimetableColumns:
+        trip_stops, stop_station = self.trip_stops, self.stop_station
+        # Every stop but the last of its trip is a departure. They are
+        # bucketed by station (a counting sort, so no list of a million
+        # boxed ints), then each station's departures are sorted by time.
+        boarding = array("i")
+        for trip in range(len(trip_stops) - 1):
+            boarding.extend(range(trip_stops[trip], trip_stops[trip + 1] - 1))
+        counts = Counter(map(stop_station.__getitem__, boarding))
+        station_departures = array("i", [0] * (len(self.stations) + 1))
+        for station in range(len(self.stations)):
+            station_departures[station + 1] = station_departures[station] + counts[station]
+
+        stop_departure = self.stop_departure
+        order = array("i", bytes(boarding.itemsize * len(boarding)))
+        position = array("i", station_departures)
+        for stop in boarding:
+            station = stop_station[stop]
+            order[position[station]] = stop
+            position[station] += 1
+        del boarding
+        for station in range(len(self.stations)):
+            first, end = station_departures[station], station_departures[station + 1]
+            order[first:end] = array("i", sorted(order[first:end], key=stop_departure.__getitem__))
+
+        stop_trip = array("i")
+        for trip in range(len(trip_stops) - 1):
+            stop_trip.extend([trip] * (trip_stops[trip + 1] - trip_stops[trip]))
+        departure_trip = array("i", (stop_trip[stop] for stop in order))
+        trip_ids = self.trip_ids
+        return TimetableColumns(
+            stations=self.stations,
+            train_types=self.train_types,
+            trip_ids=trip_ids,
+            trip_names=self.trip_names,
+            trip_types=self.trip_types,
+            trip_seats=self.trip_seats,
+            trip_stops=trip_stops,
+            stop_station=stop_station,
+            stop_arrival=self.stop_arrival,
+            stop_departure=stop_departure,
+            stop_fare=self.stop_fare,
+            station_departures=station_departures,
+            departure_time=array("i", (stop_departure[stop] for stop in order)),
+            departure_trip=departure_trip,
+            departure_stop=array("i", (stop - trip_stops[trip] for stop, trip in zip(order, departure_trip))),
+            trip_id_order=array("i", sorted(range(len(trip_ids)), key=trip_ids.__getitem__)),
+        )
+
+
+def parse_time(value: str) -> int:
+    """Converts an 'HH:MM' string into minutes after midnight."""
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def format_time(minutes: int) -> str:
+    """Converts minutes after midnight back into an 'HH:MM' string."""
+    minutes %= MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def format_duration(minutes: int) -> str:
+    """Formats a duration the same way the frontend displays it, e.g. '9h 0m'."""
+    return f"{minutes // 60}h {minutes % 60}m"
+
+
+class _Trips(Sequence):
+    """`Timetable.trips`: builds each `Trip` from the columns on access."""
+
+    def __init__(self, timetable: "Timetable"):
+        self.timetable = timetable
+
+    def __len__(self):
+        return len(self.timetable.columns.trip_ids)
+
+    def __getitem__(self, index: int) -> Trip:
+        return self.timetable.trip(index)
+
+
+class _TripsById(Mapping):
+    """`Timetable.trips_by_id`: train id -> trip index, by binary search."""
+
+    def __init__(self, columns: TimetableColumns):
+        self.columns = columns
+
+    def __getitem__(self, train_id: str) -> int:
+        ids, order = self.columns.trip_ids, self.columns.trip_id_order
+        position = bisect_left(order, train_id, key=ids.__getitem__)
+        if position < len(order) and ids[order[position]] == train_id:
+            return order[position]
+        raise KeyError(train_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns.trip_ids)
+
+    def __len__(self):
+        return len(self.columns.trip_ids)
+
+
+class Timetable:
+    """Read-only, indexed view over a set of trips."""
+
+    def __init__(self, trips: Iterable[Trip]):
+        builder = TimetableBuilder()
+        for trip in trips:
+            builder.add_trip(trip)
+        self._load(builder.build())
+
+    @classmethod
+    def from_columns(cls, columns: TimetableColumns) -> "Timetable":
+        timetable = cls.__new__(cls)
+        timetable._load(columns)
+        return timetable
+
+    def _load(self, columns: TimetableColumns):
+        self.columns = columns
+        self.trips = _Trips(self)
+        self.trips_by_id = _TripsById(columns)
+        self.stations: Dict[str, Station] = {station.code: station for station in columns.stations}
+        self.station_index: Dict[str, int] = {code: i for i, code in enumerate(self.stations)}
+        self.stations_by_city: Dict[str, Dict[str, Station]] = {}
+        for station in columns.stations:
+            self.stations_by_city.setdefault(station.city_key, {})[station.code] = station
+        self._direct_offers = functools.lru_cache(maxsize=DIRECT_OFFER_PAIRS)(self._find_direct_offers)
+
+    @classmethod
+    def from_mock_trains(cls, trains: Iterable[Dict], normalize: Callable[[str], str]) -> "Timetable":
+        """Builds a timetable from the single-hop train dicts used by the mock data."""
+        stations: Dict[str, Station] = {}
+
+        def station_for(endpoint: Dict) -> Station:
+            code = endpoint["station_code"]
+            if code not in stations:
+                stations[code] = Station(code, endpoint["station_name"], endpoint["city"], normalize(endpoint["city"]))
+            return stations[code]
+
+        trips = []
+        for train in trains:
+            departure = parse_time(train["departure"]["time"])
+            arrival = parse_time(train["arrival"]["time"])
+            if arrival < departure:
+                arrival += MINUTES_PER_DAY
+            stops = (
+                StopTime(station_for(train["departure"]), departure, departure, 0),
+                StopTime(station_for(train["arrival"]), arrival, arrival, train["price"]),
+            )
+            trips.append(Trip(train["train_id"], train["train_name"], train["train_type"], stops, train["available_seats"]))
+        return cls(trips)
+
+    def trip(self, index: int) -> Trip:
+        c = self.columns
+        if index < 0:
+            index += len(c.trip_ids)
+        stations = c.stations
+        stops = tuple(
+            StopTime(stations[c.stop_station[stop]], c.stop_arrival[stop], c.stop_departure[stop], c.stop_fare[stop])
+            for stop in range(c.trip_stops[index], c.trip_stops[index + 1])
+        )
+        return Trip(c.trip_ids[index], c.trip_names[index], c.train_types[c.trip_types[index]], stops, c.trip_seats[index])
+
+    def get_trip(self, train_id: str) -> Optional[Trip]:
+        index = self.trips_by_id.get(train_id)
+        return self.trip(index) if index is not None else None
+
+    def _departures(self, station: int, first: int, end: int) -> List[Departure]:
+        c = self.columns
+        return [Departure(c.departure_time[i], c.departure_trip[i], c.departure_stop[i]) for i in range(first, end)]
+
+    def departures_from(self, city_key: str) -> Dict[str, List[Departure]]:
+        """Returns station code -> sorted departures for every station in a city."""
+        offsets = self.columns.station_departures
+        departures = {}
+        for code in self.stations_by_city.get(city_key, {}):
+            station = self.station_index[code]
+            if offsets[station] < offsets[station + 1]:
+                departures[code] = self._departures(station, offsets[station], offsets[station + 1])
+        return departures
+
+    def departures_after(self, station: Station, minutes: int) -> List[Departure]:
+        """Returns the departures from a station at or after the given time."""
+        index = self.station_index.get(station.code)
+        if index is None:
+            return []
+        offsets = self.columns.station_departures
+        first = bisect_left(self.columns.departure_time, minutes, offsets[index], offsets[index + 1])
+        return self._departures(index, first, offsets[index + 1])
+
+    def direct_offers(self, origin_key: str, destination_key: str) -> List[DirectOffer]:
+        """
+        Returns every direct way to ride from one city to another, sorted by
+        departure time. The results for the DIRECT_OFFER_PAIRS most recently
+        searched city pairs are kept; names that are not cities find nothing
+        and are not kept.
+        """
+        if origin_key not in self.stations_by_city or destination_key not in self.stations_by_city:
+            return []
+        return self._direct_offers(origin_key, destination_key)
+
+    def _find_direct_offers(self, origin_key: str, destination_key: str) -> List[DirectOffer]:
+        c = self.columns
+        offsets, trip_stops, stop_station = c.station_departures, c.trip_stops, c.stop_station
+        destinations = {self.station_index[code] for code in self.stations_by_city[destination_key]}
+        offers = []
+        for code in self.stations_by_city[origin_key]:
+            station = self.station_index[code]
+            for i in range(offsets[station], offsets[station + 1]):
+                trip, board = c.departure_trip[i], c.departure_stop[i]
+                first = trip_stops[trip]
+                for stop in range(first + board + 1, trip_stops[trip + 1]):
+                    if stop_station[stop] in destinations:
+                        offers.append(DirectOffer(c.departure_time[i], trip, board, stop - first))
+                        break
+        offers.sort()
+        return offers
+
+    def offer_view(self, offer: DirectOffer, times: Optional[Tuple[Tuple[int, int], ...]] = None) -> Dict:
+        """
+        Builds the dict shape the frontend expects for a direct route.
+        `times` are the expected (arrival, departure) of each stop of the
+        trip when it runs off schedule.
+        """
+        c = self.columns
+        first = c.trip_stops[offer.trip]
+        board, alight = first + offer.board, first + offer.alight
+        board_station = c.stations[c.stop_station[board]]
+        alight_station = c.stations[c.stop_station[alight]]
+        departure, arrival = c.stop_departure[board], c.stop_arrival[alight]
+        if times is not None:
+            departure, arrival = times[offer.board][1], times[offer.alight][0]
+        return {
+            "train_id": c.trip_ids[offer.trip],
+            "train_name": c.trip_names[offer.trip],
+            "train_type": c.train_types[c.trip_types[offer.trip]],
+            "departure": {
+                "station_code": board_station.code,
+                "station_name": board_station.name,
+                "city": board_station.city,
+                "time": format_time(departure),
+            },
+            "arrival": {
+                "station_code": alight_station.code,
+                "station_name": alight_station.name,
+                "city": alight_station.city,
+                "time": format_time(arrival),
+            },
+            "duration": format_duration(arrival - departure),
+            "price": c.stop_fare[alight] - c.stop_fare[board],
+            "available_seats": c.trip_seats[offer.trip],
+            "delay_minutes": departure - c.stop_departure[board],
+        }
@@ -66,43 +66,58 @@ const ChatBot = () => {
     setInput("");
     setAlternativeRoutes([]); // Clear previous alternative routes
 
+    // Placeholder bot message that is filled in as the answer streams in
+    setMessages((prev) => [...prev, { role: "bot", content: "" }]);
+    const updateBotMessage = (content: string) =>
+      setMessages((prev) => [...prev.slice(0, -1), { role: "bot", content }]);
+
     try {
-      const response = await fetch("http://127.0.0.1:8000/api/chat", {
+      const response = await fetch("http://127.0.0.1:8000/api/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
+        // The server keeps the conversation for this session, so only the
+        // new message is sent.
         body: JSON.stringify({
           message: input,
-          conversation_history: newMessages,
           session_id: sessionIdRef.current,
           language: navigator.language,
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error("Network response was not ok");
       }
 
-      const botResponse = await response.json();
-
-      const botMessage: Message = {
-        role: "bot",
-        content: botResponse.content,
-      };
-
-      if (botResponse.alternative_routes) {
-        setAlternativeRoutes(botResponse.alternative_routes);
+      // Read server-sent events: "status" while tools run, "token" for each
+      // piece of the answer, "done" at the end and "error" on failure.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let answer = "";
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const rawEvent of events) {
+          const event = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(rawEvent.match(/^data: (.*)$/m)?.[1] || "{}");
+          if (event === "status" && !answer) {
+            updateBotMessage(data.message);
+          } else if (event === "token") {
+            answer += data.text;
+            updateBotMessage(answer);
+          } else if (event === "error") {
+            throw new Error(data.message);
+          }
+        }
       }
-
-      setMessages((prev) => [...prev, botMessage]);
     } catch (error) {
       console.error("Error fetching from API:", error);
-      const errorMessage: Message = {
-        role: "bot",
-        content: "Sorry, I'm having trouble connecting to the server.",
-      };
-      setMessages((prev) => [...prev, errorMessage]);
+      updateBotMessage("Sorry, I'm having trouble connecting to the server.");
     }
   };
 
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
 import { Button } from "./ui/button";
 import { Input } from "./ui/input";
@@ -6,12 +6,48 @@ import { Label } from "./ui/label";
 import { Card } from "./ui/card";
 import { Search, MapPin, Calendar, Users } from "lucide-react";
 
+interface PlaceSuggestion {
+  type: "city" | "station";
+  name: string;
+  city: string;
+  code?: string;
+}
+
+// Fetches city and station suggestions for what has been typed so far.
+const usePlaceSuggestions = (query: string) => {
+  const [suggestions, setSuggestions] = useState<PlaceSuggestion[]>([]);
+
+  useEffect(() => {
+    if (!query.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    fetch(`http://127.0.0.1:8000/api/places/autocomplete?q=${encodeURIComponent(query)}`, {
+      signal: controller.signal,
+    })
+      .then((response) => (response.ok ? response.json() : { suggestions: [] }))
+      .then((data) => setSuggestions(data.suggestions))
+      .catch(() => {
+        // Aborted by the next keystroke, or the backend is unavailable
+      });
+    return () => controller.abort();
+  }, [query]);
+
+  return suggestions;
+};
+
+const suggestionValue = (suggestion: PlaceSuggestion) =>
+  suggestion.type === "city" ? suggestion.name : `${suggestion.name} (${suggestion.code})`;
+
 const TrainSearchForm = () => {
   const navigate = useNavigate();
   const [origin, setOrigin] = useState("");
   const [destination, setDestination] = useState("");
   const [date, setDate] = useState("");
   const [passengers, setPassengers] = useState(1);
+  const originSuggestions = usePlaceSuggestions(origin);
+  const destinationSuggestions = usePlaceSuggestions(destination);
 
   const handleSearch = (e: React.FormEvent) => {
     e.preventDefault();
@@ -32,8 +68,17 @@ const TrainSearchForm = () => {
               placeholder="e.g., Jakarta"
               value={origin}
               onChange={(e) => setOrigin(e.target.value)}
+              list="origin-suggestions"
+              autoComplete="off"
               required
             />
+            <datalist id="origin-suggestions">
+              {originSuggestions.map((suggestion) => (
+                <option key={suggestionValue(suggestion)} value={suggestion.type === "city" ? suggestion.name : suggestion.code}>
+                  {suggestionValue(suggestion)}
+                </option>
+              ))}
+            </datalist>
           </div>
 
           <div className="space-y-2">
@@ -46,8 +91,17 @@ const TrainSearchForm = () => {
               placeholder="e.g., Surabaya"
               value={destination}
               onChange={(e) => setDestination(e.target.value)}
+              list="destination-suggestions"
+              autoComplete="off"
               required
             />
+            <datalist id="destination-suggestions">
+              {destinationSuggestions.map((suggestion) => (
+                <option key={suggestionValue(suggestion)} value={suggestion.type === "city" ? suggestion.name : suggestion.code}>
+                  {suggestionValue(suggestion)}
+                </option>
+              ))}
+            </datalist>
           </div>
 
           <div className="space-y-2">
@@ -2,51 +2,99 @@ import Navbar from "@/components/Navbar";
 import { Card } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert";
+import { useEffect, useState } from "react";
 import { Clock, AlertTriangle, Train, MapPin } from "lucide-react";
 
+const STREAM_URL = "http://127.0.0.1:8000/api/realtime/stream";
+
+interface StopStatus {
+  station_code: string;
+  station_name: string;
+  city: string;
+  scheduled_arrival: string;
+  scheduled_departure: string;
+  expected_arrival: string | null;
+  expected_departure: string | null;
+}
+
+interface TripStatus {
+  train_id: string;
+  train_name: string;
+  date: string;
+  status: "On Time" | "Delayed" | "Cancelled";
+  delay_minutes: number;
+  reason: string;
+  updated_at: number;
+  route: string;
+  stops: StopStatus[];
+}
+
+const tripKey = (trip: TripStatus) => `${trip.date} ${trip.train_id}`;
+
+const getSeverity = (trip: TripStatus) => {
+  if (trip.status === "Cancelled") return "cancelled";
+  if (trip.delay_minutes >= 60) return "high";
+  if (trip.delay_minutes >= 30) return "moderate";
+  return "low";
+};
+
+// Card fields from a trip's real-time status
+const toDelay = (trip: TripStatus) => {
+  const lastStop = trip.stops[trip.stops.length - 1];
+  const firstLate = trip.stops.find(
+    (stop) => stop.expected_departure !== stop.scheduled_departure || stop.expected_arrival !== stop.scheduled_arrival,
+  );
+  return {
+    id: tripKey(trip),
+    train: trip.train_name,
+    route: trip.route,
+    lastStation: firstLate ? firstLate.station_name : "-",
+    originalETA: lastStop.scheduled_arrival,
+    delayMinutes: trip.delay_minutes,
+    estimatedETA: lastStop.expected_arrival ?? "Cancelled",
+    reason: trip.reason || "No reason given",
+    timestamp: trip.updated_at ? new Date(trip.updated_at * 1000).toLocaleString() : trip.date,
+    severity: getSeverity(trip),
+  };
+};
+
 const Delays = () => {
-  // Mock delay notifications
-  const delays = [
-    {
-      id: 1,
-      train: "Argo Bromo Anggrek",
-      route: "Jakarta → Surabaya",
-      lastStation: "Cirebon",
-      originalETA: "16:30",
-      delayMinutes: 45,
-      estimatedETA: "17:15",
-      reason: "Technical maintenance at station",
-      timestamp: "2025-10-02 14:30",
-      severity: "moderate",
-    },
-    {
-      id: 2,
-      train: "Gajayana",
-      route: "Jakarta → Malang",
-      lastStation: "Yogyakarta",
-      originalETA: "22:00",
-      delayMinutes: 120,
-      estimatedETA: "00:00",
-      reason: "Weather conditions affecting track visibility",
-      timestamp: "2025-10-02 18:45",
-      severity: "high",
-    },
-    {
-      id: 3,
-      train: "Mutiara Selatan",
-      route: "Bandung → Surabaya",
-      lastStation: "Semarang",
-      originalETA: "19:30",
-      delayMinutes: 15,
-      estimatedETA: "19:45",
-      reason: "Slight schedule adjustment",
-      timestamp: "2025-10-02 17:00",
-      severity: "low",
-    },
-  ];
+  // Trips running off schedule, kept up to date by the server's event stream
+  const [trips, setTrips] = useState<Record<string, TripStatus>>({});
+  const [connected, setConnected] = useState(false);
+
+  useEffect(() => {
+    const source = new EventSource(STREAM_URL);
+    source.onopen = () => setConnected(true);
+    source.onerror = () => setConnected(false);
+    source.addEventListener("snapshot", (event) => {
+      const { trips } = JSON.parse((event as MessageEvent).data) as { trips: TripStatus[] };
+      setTrips(Object.fromEntries(trips.map((trip) => [tripKey(trip), trip])));
+    });
+    source.addEventListener("trip-updates", (event) => {
+      const { trips } = JSON.parse((event as MessageEvent).data) as { trips: TripStatus[] };
+      setTrips((current) => {
+        const next = { ...current };
+        for (const trip of trips) {
+          if (trip.status === "On Time") {
+            delete next[tripKey(trip)];
+          } else {
+            next[tripKey(trip)] = trip;
+          }
+        }
+        return next;
+      });
+    });
+    return () => source.close();
+  }, []);
+
+  const delays = Object.values(trips)
+    .sort((a, b) => b.updated_at - a.updated_at)
+    .map(toDelay);
 
   const getSeverityColor = (severity: string) => {
     switch (severity) {
+      case "cancelled":
       case "high":
         return "bg-destructive text-destructive-foreground";
       case "moderate":
@@ -60,6 +108,8 @@ const Delays = () => {
 
   const getSeverityLabel = (severity: string) => {
     switch (severity) {
+      case "cancelled":
+        return "Cancelled";
       case "high":
         return "Significant Delay";
       case "moderate":
@@ -85,9 +135,9 @@ const Delays = () => {
 
         <Alert className="mb-6 border-info bg-info/10">
           <AlertTriangle className="h-4 w-4 text-info" />
-          <AlertTitle className="text-info">Live Updates Active</AlertTitle>
+          <AlertTitle className="text-info">{connected ? "Live Updates Active" : "Connecting to Live Updates..."}</AlertTitle>
           <AlertDescription>
-            You will receive instant notifications when any of your booked trains experience delays.
+            Delays and cancellations appear here as soon as they are reported.
           </AlertDescription>
         </Alert>
 
@@ -113,7 +163,7 @@ const Delays = () => {
                 <div className="flex items-start gap-2">
                   <MapPin className="h-4 w-4 text-muted-foreground mt-0.5" />
                   <div>
-                    <p className="text-xs text-muted-foreground">Last Station</p>
+                    <p className="text-xs text-muted-foreground">Delayed From</p>
                     <p className="font-semibold">{delay.lastStation}</p>
                   </div>
                 </div>
@@ -138,7 +188,9 @@ const Delays = () => {
               <div className="bg-muted/50 rounded-lg p-4">
                 <div className="flex items-center gap-2 mb-2">
                   <AlertTriangle className="h-4 w-4 text-warning" />
-                  <p className="font-semibold text-sm">Delay: {delay.delayMinutes} minutes</p>
+                  <p className="font-semibold text-sm">
+                    {delay.severity === "cancelled" ? "Train cancelled" : `Delay: ${delay.delayMinutes} minutes`}
+                  </p>
                 </div>
                 <p className="text-sm text-muted-foreground mb-2">
                   <strong>Reason:</strong> {delay.reason}
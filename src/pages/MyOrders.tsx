@@ -29,8 +29,9 @@ const MyOrders = () => {
   useEffect(() => {
     const fetchOrders = async () => {
       try {
-        // Fetch orders directly from our new backend endpoint
-        const response = await fetch("http://127.0.0.1:8000/api/my-orders");
+        // Fetch orders directly from our new backend endpoint; the list view
+        // only needs the summary fields of each order.
+        const response = await fetch("http://127.0.0.1:8000/api/my-orders?fields=summary");
         if (!response.ok) {
           throw new Error("Failed to fetch orders from the backend.");
         }